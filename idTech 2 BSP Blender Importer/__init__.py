@@ -11,13 +11,15 @@ bl_info = {
 
 
 from bpy_extras.io_utils import ImportHelper
-from bpy.props import BoolProperty, StringProperty, IntProperty
+from bpy.props import BoolProperty, StringProperty, IntProperty, EnumProperty, FloatVectorProperty, CollectionProperty
 import bpy
+import mathutils
 import os
 import sys
 import platform
 import subprocess
 import stat
+import traceback
 from importlib import reload # required when a self-written module is imported that's edited simultaneously
 
 
@@ -76,7 +78,15 @@ else:
             print(f"ERROR: {pkg} failed to install\n{e}")
 
 
-from .idtech2_bsp import load_idtech2_bsp
+from .idtech2_bsp import bsp_import_job, upgrade_proxy_textures
+from .batch_import import bsp_batch_import, get_bsp_paths
+from .custom_types import bsp_import_options, BRUSH_CONTENTS
+from .texture_library import cleanup_library
+
+
+# How often a background import is checked on, and how long each check may spend creating datablocks
+IMPORT_TIMER_INTERVAL = 0.05
+IMPORT_BUILD_STEP = 0.1
 
 
 class ImportBSP(bpy.types.Operator, ImportHelper):
@@ -84,11 +94,15 @@ class ImportBSP(bpy.types.Operator, ImportHelper):
     bl_label = "Import idtech 2 BSP"
 
     filter_glob: StringProperty(
-        default="*.bsp", # only shows bsp files in opening screen
+        default="*.bsp;*.pak", # only shows bsp (and pak) files in opening screen
         options={'HIDDEN'},
         maxlen=255,  # Max internal buffer length, longer would be clamped.
     )
 
+    # Every file selected in the file browser, for importing several maps at once
+    files: CollectionProperty(type=bpy.types.OperatorFileListElement, options={'HIDDEN', 'SKIP_SAVE'})
+    directory: StringProperty(subtype='DIR_PATH', options={'HIDDEN', 'SKIP_SAVE'})
+
     model_scale: bpy.props.FloatProperty(name="New Model Scale",
                                     description='Desired scale for the model.\nDefault is 1%, as idTech 2 did not consider vertex coordinates "meters" :)',
                                     default=.01)
@@ -102,33 +116,326 @@ class ImportBSP(bpy.types.Operator, ImportHelper):
                                         In this case, all files under the PARENT folder from the .BSP will be searched.""",
                                         default=False)
 
+    use_paks: BoolProperty(name="Read Textures from PAK Files", description="""Textures that aren't extracted are read straight out of the .pak files
+                                        in the texture search folder, layered like the game does (pak1 overrides pak0, etc...).  Extracted files still come first.""",
+                                        default=True)
+
+    pak_map: StringProperty(name="Map in PAK", description="""When a .pak file is selected, the map to import from it, e.g. "base1" or "maps/base1.bsp".
+                                        All the .pak files in that folder are searched, the map and its textures don't need extracting.""",
+                                        default="")
+
+    import_folder: BoolProperty(name="Import Whole Folder", description="""Import every .bsp file in the selected file's folder.  Several files can also be
+                                        selected in the file browser.  Maps are parsed side by side in separate processes (one per CPU core)
+                                        while the ones already parsed get built.""",
+                                        default=False)
+
+    geometry_only: BoolProperty(name="Geometry Only", description="""Build the mesh and UVs without loading any texture pixels (or lightmaps).  Only the texture
+                                        file headers are read for their sizes, so the UVs are still right.  The materials get the texture's path
+                                        ("bsp_texture_path", and "bsp_texture_member" for PAKs) for loading it later.  For collision, navmesh, layout work, etc...""",
+                                        default=False)
+
+    texture_mip: EnumProperty(name="Texture Resolution", description="""Decode .wal textures from a smaller mip level, as fast, light proxies for layout/blocking work.
+                                        UVs are unaffected.  File > External Data > Upgrade BSP Proxy Textures replaces them with the full resolution later.""",
+                                        items=[('0', "Full", "Full resolution"),
+                                               ('1', "1/2 (Proxy)", "Mip level 1, 1/4 of the pixels"),
+                                               ('2', "1/4 (Proxy)", "Mip level 2, 1/16 of the pixels"),
+                                               ('3', "1/8 (Proxy)", "Mip level 3, 1/64 of the pixels")],
+                                        default='0')
+
+    cache_textures: BoolProperty(name="Cache Textures as Files", description="""Decode .wal textures to .png files in a cache folder once, and load those instead of packing
+                                        the pixels into the .blend.  Blender only reads an image file when it's displayed, so importing is faster and lighter,
+                                        and the .blend stays small.  The .blend then depends on the cache folder.""",
+                                        default=False)
+
+    texture_atlas: BoolProperty(name="Texture Atlas", description="""Pack the textures into a few atlas images, with one material per atlas instead of one per
+                                        texture, for far fewer draw calls in the viewport and in exported scenes.  Every face gets its texture's tile
+                                        as attributes ("bsp_atlas_offset", "bsp_atlas_scale"), the materials repeat the UVs inside it.
+                                        Animated textures keep their own materials.""",
+                                        default=False)
+
+    texture_cache_dir: StringProperty(name="Texture Cache Folder", description="Where cached textures go, blank for a folder in Blender's user data",
+                                        subtype='DIR_PATH', default="")
+
+    use_import_cache: BoolProperty(name="Cache Preprocessed Import", description="""Save the map as it is right before the mesh is created (geometry, UVs,
+                                        lightmap atlas, where the textures are) to a snapshot file, and import straight from that the next time.
+                                        A snapshot is only used for the same map file with the same import options, so repeated imports skip all the parsing.""",
+                                        default=False)
+
+    import_cache_dir: StringProperty(name="Import Cache Folder", description="Where import snapshots go, blank for a folder in Blender's user data",
+                                        subtype='DIR_PATH', default="")
+
+    low_memory: BoolProperty(name="Low Memory", description="""For big maps: let go of everything the import works with as soon as it's been used, and decode
+                                        textures one at a time while creating them instead of all of them ahead (a bit slower).
+                                        Peak memory of every import stage is printed to the console either way.""",
+                                        default=False)
+
     apply_lightmaps: BoolProperty(name="Apply Lightmaps", default=False)
 
     lightmap_influence: IntProperty(name="Lightmap Influence", description="""Depending on the game and the lighting, the lightmaps can sometimes make a map very
-                                        dark.  If so, this allows controlling the influence of the lightmaps.  The materials have a "Lightmap Influence value
-                                        node which can be adjusted between 0 and 1 at any time.""",
+                                        dark.  If so, this allows controlling the influence of the lightmaps.  The "BSP Surface" node group every material uses has a
+                                        "Lightmap Influence" value node, one for all materials, which can be adjusted between 0 and 1 at any time.""",
                                         min=0, max=100, default=100)
 
+    lightmap_mode: EnumProperty(name="Lightmap Mode", description="How the lightmaps are applied",
+                                        items=[('ATLAS', "Atlas", "Pack every face's lightmap into one atlas image, with its own UV map"),
+                                               ('VERTEX', "Vertex Colors", """Sample the lightmaps at the face corners into a "Lightmap" color attribute: no atlas
+                                                image at all, for cheap lighting previews of huge maps.  Coarser, lighting only changes between corners""")],
+                                        default='ATLAS')
+
+    smooth_vertex_lightmaps: BoolProperty(name="Smooth Vertex Lightmaps", description="""Vertex Colors mode: average the lighting of the faces meeting at every vertex,
+                                        for smooth lighting across faces instead of each face's own""",
+                                        default=False)
+
+    collapse_uniform_lightmaps: BoolProperty(name="Collapse Uniform Lightmaps", description="""Identical face lightmaps are always packed into the atlas once.
+                                        This also cuts lightmaps of a single color (fully lit, fully dark...) down to 1 pixel, shared by every face
+                                        of that color, for a smaller atlas""",
+                                        default=False)
+
     show_entities: BoolProperty(name="Show Entity Info", description="""If an entity has an origin/location, an empty object will be created, along with text 
                                         for the properties""", default=False)
 
+    import_brushes: BoolProperty(name="Import Brushes", description="""Also rebuild the brushes' convex volumes from their planes, as one "<map>_brushes" object
+                                        with every polygon's brush index and contents flags as attributes ("bsp_brush_index", "bsp_brush_contents").
+                                        The actual collision geometry, for collision and physics previews""",
+                                        default=False)
+
+    brush_contents: EnumProperty(name="Brush Contents", description="Which brushes to import, by their contents",
+                                        options={'ENUM_FLAG'},
+                                        items=[('SOLID', "Solid", "Walls, floors..."),
+                                               ('WINDOW', "Window", "See-through solid brushes"),
+                                               ('LAVA', "Lava", ""),
+                                               ('SLIME', "Slime", ""),
+                                               ('WATER', "Water", ""),
+                                               ('MIST', "Mist", ""),
+                                               ('PLAYERCLIP', "Player Clip", "Invisible walls only players collide with"),
+                                               ('MONSTERCLIP', "Monster Clip", "Invisible walls only monsters collide with"),
+                                               ('LADDER', "Ladder", "")],
+                                        default={'SOLID', 'WINDOW'})
+
+    pvs_cull: EnumProperty(name="Visibility Cull", description="""Only import the faces in clusters potentially visible (PVS) from a point.
+                                        For renders where only what can be seen from there matters, this can cut the polygon count a lot on big maps.
+                                        Faces of brush entities (doors, lifts, etc...) are not part of the visibility data and are skipped.""",
+                                        items=[('NONE', "None", "Import all faces"),
+                                               ('PLAYER_START', "Player Start", "Faces visible from the info_player_start entity"),
+                                               ('CURSOR', "3D Cursor", "Faces visible from the 3D cursor (in scaled scene units, map at the origin)")],
+                                        default='NONE')
+
+    region_import: EnumProperty(name="Region Import", description="""Only import the faces within a box, found by walking the BSP tree.
+                                        Handy for partial imports of huge maps.""",
+                                        items=[('NONE', "None", "Import all faces"),
+                                               ('BOUNDS', "Region Bounds", "Faces within the Region Min/Max below (in scaled scene units)"),
+                                               ('ACTIVE_OBJECT', "Active Object", "Faces within the bounding box of the active object, e.g. a cube placed over the area wanted")],
+                                        default='NONE')
+
+    region_min: FloatVectorProperty(name="Region Min", subtype='XYZ', default=(-10.0, -10.0, -10.0))
+
+    region_max: FloatVectorProperty(name="Region Max", subtype='XYZ', default=(10.0, 10.0, 10.0))
+
+    area_import: EnumProperty(name="Areas", description="""Areas are the parts of a map the engine can close off from each other (e.g. a building behind a door).
+                                        Faces are grouped by area through the leafs that contain them.""",
+                                        items=[('NONE', "All", "Import all faces into one object"),
+                                               ('SELECTED', "Selected Areas", "Only import the areas listed in Area List"),
+                                               ('SPLIT', "Object per Area", "One object per area, each in its own collection so they can be toggled")],
+                                        default='NONE')
+
+    areas: StringProperty(name="Area List", description="Areas to import with Selected Areas, e.g. \"1, 3-5\"", default="1")
+
+    skip_nodraw: BoolProperty(name="Skip Non-Rendered Faces", description="""Leaves out faces flagged hint, skip or nodraw, which the game never draws.""",
+                                        default=True)
+
+    separate_special_faces: BoolProperty(name="Separate Sky/Liquid/Translucent", description="""Puts sky, liquid (warped) and translucent faces into their own objects.
+                                        These are never lightmapped, so they are left out of the lightmap atlas either way.""",
+                                        default=False)
+
+    optimize_mesh: BoolProperty(name="Weld & Merge Faces", description="""Welds vertices within the weld distance, then merges neighbouring coplanar faces with the
+                                        same texture, which the BSP compiler split up.  With lightmaps applied, lit faces are only merged when their lightmaps are one and the same color.""",
+                                        default=False)
+
+    weld_distance: bpy.props.FloatProperty(name="Weld Distance", description="Vertices closer than this (in BSP units, before scaling) are welded",
+                                        min=0.0001, default=0.01)
+
+    triangulate: BoolProperty(name="Triangulate", description="""Import triangles instead of the BSP's polygons, for exporting to glTF/game engines without a
+                                        Triangulate modifier.  BSP faces are convex, so a fan per face is exact.  UVs, lightmap UVs, materials and
+                                        bsp_face_index carry over (and the brushes' attributes, if imported).""",
+                                        default=False)
+
+    chunk_mode: EnumProperty(name="Split into Chunks", description="""Splits the map into one object per spatial chunk instead of 1 huge mesh.
+                                        Editing, selection and viewport drawing stay fast, and Blender can cull the chunks that are off screen.""",
+                                        items=[('NONE', "None", "Single object"),
+                                               ('GRID', "Grid", "Cubic grid cells of Chunk Size"),
+                                               ('NODES', "BSP Nodes", "The BSP node subtrees at Chunk Depth below the root (up to 2^depth chunks)")],
+                                        default='NONE')
+
+    chunk_size: bpy.props.FloatProperty(name="Chunk Size", description="Grid cell size, in scene units (after scaling)", min=0.01, default=10.0)
+
+    chunk_depth: IntProperty(name="Chunk Depth", description="BSP tree depth to split at", min=1, max=16, default=4)
+
+    reimport: BoolProperty(name="Update Existing Import", description="""If this map was imported before (same object name), update that object instead of creating a new one.
+                                        Lumps are compared by hash: the object, materials and images are kept when their inputs didn't change,
+                                        the mesh is rewritten in place if the geometry changed, and the lightmap atlas is only rebuilt if the lighting or faces changed.
+                                        Only works for single object imports (no area/sky/chunk splitting).""",
+                                        default=False)
+
+    shared_library: BoolProperty(name="Share Textures Between Maps", description="""Reuse images and materials from earlier imports using the same game folder.
+                                        Images are matched by the contents of their texture file, so each texture is only decoded once per .blend,
+                                        and nothing an earlier map uses gets deleted.  Use File > Clean Up > Remove Unused BSP Textures to remove
+                                        what no imported map uses anymore.""",
+                                        default=False)
+
+    background_import: BoolProperty(name="Import in Background", description="""Parse the map, find and decode its textures and pack its lightmaps in a background thread,
+                                        with progress in the status bar, so Blender doesn't freeze.  Esc cancels.  Only creating the objects, images and materials
+                                        happens in the foreground, a batch at a time.""",
+                                        default=True)
+
+    def get_region(self, context):
+        if self.region_import == 'BOUNDS':
+            return (tuple(self.region_min), tuple(self.region_max))
+        elif self.region_import == 'ACTIVE_OBJECT' and context.active_object:
+            obj = context.active_object
+            corners = [obj.matrix_world @ mathutils.Vector(corner) for corner in obj.bound_box]
+            return (tuple(min(c[i] for c in corners) for i in range(3)), tuple(max(c[i] for c in corners) for i in range(3)))
+        return None
+
+    def get_options(self, context):
+        return bsp_import_options(model_scale=self.model_scale, apply_transforms=self.apply_transforms, search_from_parent=self.search_from_parent,
+                                  apply_lightmaps=self.apply_lightmaps, lightmap_influence=self.lightmap_influence,
+                                  collapse_uniform_lightmaps=self.collapse_uniform_lightmaps,
+                                  lightmap_mode=self.lightmap_mode, smooth_vertex_lightmaps=self.smooth_vertex_lightmaps, show_entities=self.show_entities,
+                                  pvs_cull=self.pvs_cull, region=self.get_region(context), area_import=self.area_import, areas=self.areas,
+                                  skip_nodraw=self.skip_nodraw, separate_special_faces=self.separate_special_faces,
+                                  optimize_mesh=self.optimize_mesh, weld_distance=self.weld_distance,
+                                  chunk_mode=self.chunk_mode, chunk_size=self.chunk_size, chunk_depth=self.chunk_depth,
+                                  reimport=self.reimport, shared_library=self.shared_library,
+                                  use_paks=self.use_paks, pak_map=self.pak_map if self.filepath.casefold().endswith(".pak") else "",
+                                  texture_mip=int(self.texture_mip), cache_textures=self.cache_textures, texture_cache_dir=self.texture_cache_dir,
+                                  texture_atlas=self.texture_atlas,
+                                  geometry_only=self.geometry_only, use_import_cache=self.use_import_cache, import_cache_dir=self.import_cache_dir,
+                                  low_memory=self.low_memory, import_brushes=self.import_brushes,
+                                  brush_contents=sum(BRUSH_CONTENTS[contents] for contents in self.brush_contents), triangulate=self.triangulate)
+
+    def get_bsp_paths(self):
+        """
+        The maps to import: the whole folder, every selected .bsp file, or just the one file (which can be a .pak, see pak_map).
+        """
+        folder = self.directory or os.path.dirname(self.filepath)
+        if self.import_folder:
+            return get_bsp_paths(folder)
+        names = [file.name for file in self.files if file.name.casefold().endswith(".bsp")]
+        if len(names) > 1:
+            return [os.path.join(folder, name) for name in names]
+        return [self.filepath]
+
     def execute(self, context):
+        bsp_paths = self.get_bsp_paths()
+        if not bsp_paths:
+            self.report({'ERROR'}, "No .bsp files to import")
+            return {'CANCELLED'}
+
+        options = self.get_options(context)
+        if not self.background_import or bpy.app.background or context.window is None:
+            # Scripts, command line: all at once
+            for bsp_path in bsp_paths:
+                bsp_import_job(bsp_path, options).run()
+            return {'FINISHED'}
+
+        self.batch = bsp_batch_import(bsp_paths, options)
+        self.batch.start()
+
+        wm = context.window_manager
+        wm.progress_begin(0, 100)
+        self.timer = wm.event_timer_add(IMPORT_TIMER_INTERVAL, window=context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type == 'ESC' and event.value == 'PRESS':
+            self.batch.cancel()
+            return {'RUNNING_MODAL'}
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        batch = self.batch
         try:
-            return load_idtech2_bsp(self.filepath, self.model_scale, self.apply_transforms, self.search_from_parent, self.apply_lightmaps, self.lightmap_influence, self.show_entities)
+            # Only creating the datablocks happens here, a batch at a time so the UI keeps up
+            if not batch.step(IMPORT_BUILD_STEP):
+                self.show_progress(context)
+                return {'RUNNING_MODAL'}
         except Exception as argument:
+            print(f"ERROR loading .BSP file: {argument}")
+            traceback.print_exc()
+            self.stop(context)
             self.report({'ERROR'}, str(argument))
+            return {'CANCELLED'}
+
+        self.stop(context)
+        imported = ", ".join(batch.imported) or "nothing"
+        if batch.cancelled:
+            self.report({'WARNING'}, f"Import cancelled, imported {imported}")
+        elif batch.failed:
+            self.report({'ERROR'}, f"Imported {imported}, failed: " + "; ".join(f"{name}: {error}" for name, error in batch.failed))
+        else:
+            self.report({'INFO'}, f"Imported {imported}")
+        return {'FINISHED'} if batch.imported else {'CANCELLED'}
+
+    def show_progress(self, context):
+        percent = int(self.batch.progress * 100)
+        context.window_manager.progress_update(percent)
+        context.workspace.status_text_set(f"Importing {self.batch.stage} ({percent}%), Esc to cancel")
+
+    def stop(self, context):
+        wm = context.window_manager
+        wm.event_timer_remove(self.timer)
+        wm.progress_end()
+        context.workspace.status_text_set(None)
+        self.batch.close()
+
+
+class CleanupBSPLibrary(bpy.types.Operator):
+    """Remove shared BSP textures and materials no imported map in this file uses anymore"""
+    bl_idname = "import_idtech2.cleanup_library"
+    bl_label = "Remove Unused BSP Textures"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def execute(self, context):
+        removed_materials, removed_images = cleanup_library()
+        self.report({'INFO'}, f"Removed {removed_materials} materials and {removed_images} images")
+        return {'FINISHED'}
+
+
+class UpgradeBSPProxyTextures(bpy.types.Operator):
+    """Reload BSP textures imported at a lower resolution (proxies) at full resolution, in place"""
+    bl_idname = "import_idtech2.upgrade_proxy_textures"
+    bl_label = "Upgrade BSP Proxy Textures"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def execute(self, context):
+        upgraded = upgrade_proxy_textures()
+        self.report({'INFO'}, f"Upgraded {upgraded} textures to full resolution")
+        return {'FINISHED'}
 
 
 def menu_func_import(self, context):
     self.layout.operator(ImportBSP.bl_idname, text="idTech 2 [Quake II/Anachronox] (.BSP)")
 
 
+def menu_func_cleanup(self, context):
+    self.layout.operator(CleanupBSPLibrary.bl_idname)
+
+
+def menu_func_external_data(self, context):
+    self.layout.operator(UpgradeBSPProxyTextures.bl_idname)
+
+
 classes = [
-    ImportBSP
+    ImportBSP,
+    CleanupBSPLibrary,
+    UpgradeBSPProxyTextures
 ]
 
 def register():
     bpy.types.TOPBAR_MT_file_import.append(menu_func_import)
+    bpy.types.TOPBAR_MT_file_cleanup.append(menu_func_cleanup)
+    bpy.types.TOPBAR_MT_file_external_data.append(menu_func_external_data)
 
     for cls in classes:
         print(f'Registering: {cls}')
@@ -137,15 +444,13 @@ def register():
 
 def unregister():
     bpy.types.TOPBAR_MT_file_import.remove(menu_func_import)
+    bpy.types.TOPBAR_MT_file_cleanup.remove(menu_func_cleanup)
+    bpy.types.TOPBAR_MT_file_external_data.remove(menu_func_external_data)
 
     for cls in reversed(classes):
         bpy.utils.unregister_class(cls)
 
 
-def missing_file(self, context):
-    self.layout.label(text="File does not exist in currently selected directory! Perhaps you didn't select the correct .bsp file?")
-
-
 if __name__ == "__main__":
     register()
     print("Quake II/Anachronox BSP Importer loaded.")
\ No newline at end of file
@@ -0,0 +1,206 @@
+import os
+import time
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .idtech2_bsp import bsp_import_job
+from .bsp_preprocess import import_cancelled, preprocess_in_worker
+
+
+# Runs first in every worker process.  The addon's __init__ needs bpy, which worker processes don't have, so its package
+# is put in place as an empty module pointing at the addon folder: bsp_preprocess and what it imports load from there as usual.
+WORKER_SETUP = """
+import sys
+import types
+parts = package.split(".")
+for i in range(1, len(parts) + 1):
+    name = ".".join(parts[:i])
+    if name not in sys.modules:
+        module = types.ModuleType(name)
+        module.__path__ = [addon_dir] if i == len(parts) else []
+        sys.modules[name] = module
+"""
+
+
+def get_bsp_paths(folder):
+    """
+    Every .bsp file in a folder, by name.
+    """
+    return sorted(os.path.join(folder, file) for file in os.listdir(folder)
+                  if file.casefold().endswith(".bsp") and os.path.isfile(os.path.join(folder, file)))
+
+
+class bsp_batch_import(object):
+    """
+    Imports several maps at once.  Preprocessing (see bsp_preprocessor) runs in a pool of worker processes, a map per CPU
+    core, while the main thread builds the maps already preprocessed, whichever is ready first.  A single map is preprocessed
+    in a background thread instead, starting processes isn't worth it for one, and so is every map if the pool can't be started.
+    Call start(), then step() from a timer until it returns True.  stage and progress (0-1) are for the whole batch.
+    A map that fails is reported in failed, the others go on.
+    """
+
+    def __init__(self, bsp_paths, options, max_workers=0):
+        self.jobs = [bsp_import_job(path, options) for path in bsp_paths]
+        self.max_workers = max(1, min(len(self.jobs), max_workers or os.cpu_count() or 1))
+        self.pool = None
+        self.futures = {}           # job -> its preprocessing in the pool
+        self.waiting = []           # Jobs being preprocessed, not built yet
+        self.current = None         # Job being built
+        self.builder = None
+        self.done = 0
+        self.imported = []          # Map names
+        self.failed = []            # (map name, error)
+        self.cancelled = False
+
+
+    def start(self):
+        for job in self.jobs:
+            try:
+                if job.prepare():
+                    self.waiting.append(job)
+                    continue
+            except Exception as e:
+                print(f"ERROR loading .BSP file: {e}")
+                self.failed.append((job.ctx.name if job.ctx else os.path.basename(job.preprocessor.bsp_path), e))
+            job.finish()
+            self.done += 1
+
+        if len(self.waiting) > 1:
+            try:
+                self.pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"), initializer=exec,
+                                                initargs=(WORKER_SETUP, {"package": __package__, "addon_dir": os.path.dirname(__file__)}))
+                for job in self.waiting:
+                    self.futures[job] = self.pool.submit(preprocess_in_worker, job.preprocessor)
+                print(f"Preprocessing {len(self.waiting)} maps in {self.max_workers} processes")
+            except Exception as e:
+                print(f"Couldn't start worker processes, preprocessing in the background instead: {e}")
+                self.stop_pool()
+
+
+    def stop_pool(self):
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+        self.pool = None
+        self.futures = {}
+
+
+    def cancel(self):
+        self.cancelled = True
+        for job in self.waiting:
+            job.cancel()
+        if self.current:
+            self.current.cancel()
+        self.stop_pool()
+
+
+    def get_ready_job(self):
+        """
+        A preprocessed job to build next, if there's one.  Without the pool, maps are preprocessed one at a time, in order.
+        """
+        if not self.futures:
+            job = self.waiting[0]
+            if job.thread is None:
+                job.preprocess_in_background()
+            return None if job.preprocessing else job
+
+        for job in self.waiting:
+            future = self.futures.get(job)
+            if future is None or not future.done():
+                continue
+            del self.futures[job]
+            try:
+                job.preprocessor = future.result()
+            except BrokenProcessPool as e:
+                # Some worker died, what's left gets preprocessed here
+                print(f"Worker processes stopped, preprocessing the remaining maps in the background instead: {e}")
+                self.stop_pool()
+                return None
+            except Exception as e:
+                job.error = e
+            return job
+        return None
+
+
+    def step(self, seconds):
+        """
+        Does up to `seconds` of work in the main thread.  Returns True once the whole batch is done.
+        """
+        step_end = time.perf_counter() + seconds
+        while True:
+            if self.cancelled:
+                if self.current:
+                    self.current.abort()
+                self.close()
+                return True
+
+            if self.current is None:
+                if not self.waiting:
+                    return True
+                job = self.get_ready_job()
+                if job is None:
+                    return False
+                self.waiting.remove(job)
+                self.current = job
+                self.builder = None if job.error else job.build()
+
+            job = self.current
+            try:
+                if job.error:
+                    raise job.error
+                for _ in self.builder:
+                    if time.perf_counter() > step_end:
+                        return False
+                self.imported.append(job.ctx.name)
+            except import_cancelled:
+                self.cancelled = True
+                continue
+            except Exception as e:
+                if e is not job.error:
+                    print(f"ERROR loading .BSP file: {e}")
+                    traceback.print_exc()
+                job.abort()
+                self.failed.append((job.ctx.name, e))
+
+            job.finish()
+            self.current = self.builder = None
+            self.done += 1
+            if time.perf_counter() > step_end:
+                return False
+
+
+    @property
+    def stage(self):
+        if self.current:
+            return f"{self.current.ctx.name}: {self.current.stage}"
+        if self.waiting and not self.futures:
+            return f"{self.waiting[0].ctx.name}: {self.waiting[0].stage}"
+        return f"Preprocessing {len(self.waiting)} maps"
+
+
+    @property
+    def progress(self):
+        if self.current:
+            job_progress = self.current.progress
+        elif self.waiting and not self.futures:
+            job_progress = self.waiting[0].progress
+        else:
+            job_progress = 0.0
+        return (self.done + job_progress) / max(len(self.jobs), 1)
+
+
+    def close(self):
+        """
+        Stops whatever is left and lets go of every map's data.
+        """
+        self.stop_pool()
+        for job in self.waiting:
+            job.cancel()
+            if not job.preprocessing:
+                # Still preprocessing, dropped along with the job once its thread stops
+                job.finish()
+        self.waiting = []
+        if self.current:
+            self.current.finish()
+        self.current = self.builder = None
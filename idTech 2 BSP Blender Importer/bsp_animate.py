@@ -0,0 +1,99 @@
+# The engine steps animated textures twice a second: frame = (int)(time * 2) % number of frames
+ANIMATION_FPS = 2
+
+
+def get_animation_chains(next_texinfos):
+    """
+    Resolves texture animations by following the next_texinfo links, once, in O(n).
+    The compiler links every frame to the next and the last back to the first, so an animation is a cycle of texinfos.
+    Texinfos leading into a cycle belong to that animation too (and get its material, made for the cycle's first frame, even
+    when they come before it).  Links ending at -1 (or out of range) aren't animated.
+    Returns (chains, chain of every texinfo): chains is a list of frame lists (texinfo indices, starting from the lowest),
+    the chain of a texinfo is an index into it, -1 if not animated.
+    """
+    num_texinfos = len(next_texinfos)
+    NEW, ON_PATH, DONE = 0, 1, 2
+    state = [NEW] * num_texinfos
+    texinfo_chains = [-1] * num_texinfos
+    chains = []
+
+    for start in range(num_texinfos):
+        if state[start] != NEW:
+            continue
+
+        # Walk until something already seen, or the end of the links
+        path = []
+        texinfo = start
+        while 0 <= texinfo < num_texinfos and state[texinfo] == NEW:
+            state[texinfo] = ON_PATH
+            path.append(texinfo)
+            texinfo = next_texinfos[texinfo]
+
+        if 0 <= texinfo < num_texinfos and state[texinfo] == ON_PATH:
+            # Closed a new cycle, the part of the path from where it was entered
+            cycle = path[path.index(texinfo):]
+            first = cycle.index(min(cycle))
+            chains.append(cycle[first:] + cycle[:first])
+            chain = len(chains) - 1
+        elif 0 <= texinfo < num_texinfos:
+            # Ran into a texinfo resolved earlier, same chain (or none) as that one
+            chain = texinfo_chains[texinfo]
+        else:
+            chain = -1
+
+        for texinfo in path:
+            state[texinfo] = DONE
+            texinfo_chains[texinfo] = chain
+
+    return chains, texinfo_chains
+
+
+def add_animation_frames(mat, frame_images, name, scene):
+    """
+    Makes a texture material step through frame_images: one image node per frame, and a Value node driven by the scene time
+    (fmod(floor(frame * ANIMATION_FPS / fps), frames), fps from scene) picking which one reaches the material's color input (the surface
+    group's, see get_surface_node_group), through a row of Mix nodes.  The material's existing image node is frame 0.
+    """
+    tree = mat.node_tree
+    nodes = tree.nodes
+    links = tree.links
+
+    first_image = next(n for n in nodes if n.type == 'TEX_IMAGE')
+    color_input = first_image.outputs['Color'].links[0].to_socket
+
+    frame_node = nodes.new('ShaderNodeValue')
+    frame_node.name = "Anim_Frame"
+    frame_node.label = f"{name} Frame"
+    driver = frame_node.outputs[0].driver_add("default_value").driver
+    driver.type = 'SCRIPTED'
+    fps_var = driver.variables.new()
+    fps_var.name = "fps"
+    fps_var.type = 'SINGLE_PROP'
+    fps_var.targets[0].id_type = 'SCENE'
+    fps_var.targets[0].id = scene
+    fps_var.targets[0].data_path = "render.fps"
+    # fmod rather than %, which keeps this a simple expression: evaluated without Python, so it works with auto run scripts off
+    driver.expression = f"fmod(floor(frame * {ANIMATION_FPS} / fps), {len(frame_images)})"
+
+    color = first_image.outputs['Color']
+    for frame, image in enumerate(frame_images[1:], start=1):
+        tex_image = nodes.new('ShaderNodeTexImage')
+        tex_image.name = f"Anim_Frame_{frame}"
+        tex_image.image = image
+        tex_image.location = (first_image.location.x, first_image.location.y - 300 * frame)
+
+        is_frame = nodes.new('ShaderNodeMath')
+        is_frame.operation = 'COMPARE'
+        is_frame.inputs[1].default_value = frame
+        is_frame.inputs[2].default_value = 0.5
+        links.new(frame_node.outputs[0], is_frame.inputs[0])
+
+        mix_node = nodes.new('ShaderNodeMixRGB')
+        mix_node.name = f"Anim_Mix_{frame}"
+        links.new(is_frame.outputs[0], mix_node.inputs['Fac'])
+        links.new(color, mix_node.inputs['Color1'])
+        links.new(tex_image.outputs['Color'], mix_node.inputs['Color2'])
+        color = mix_node.outputs['Color']
+
+    links.new(color, color_input)
+    mat["bsp_animation_frames"] = len(frame_images)
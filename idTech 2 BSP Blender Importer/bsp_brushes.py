@@ -0,0 +1,130 @@
+import itertools
+import numpy as np
+
+from .custom_types import *
+from .bsp_tree import load_lump_array
+
+
+# Distance (BSP units) within which a point counts as on a plane
+PLANE_EPSILON = 0.01
+# Corners closer than this (BSP units) are the same corner, e.g. where more than 3 sides meet
+CORNER_MERGE_DISTANCE = 0.001
+# Roughly how many (brush, plane triple, side) distances are worked on at once, to keep the memory use flat
+BATCH_SIZE = 2_000_000
+
+
+def get_side_basis(normals):
+    """
+    Two in plane axes for every normal, (normal, u, v) right handed, so going from u towards v turns counter-clockwise
+    seen from the front of the plane.
+    """
+    helper = np.where(np.abs(normals[:, 2:3]) < 0.9, (0.0, 0.0, 1.0), (1.0, 0.0, 0.0))
+    u = np.cross(helper, normals)
+    u /= np.linalg.norm(u, axis=1, keepdims=True)
+    return u, np.cross(normals, u)
+
+
+def build_brush_batch(brush_indices, num_sides, side_planes, normals, distances):
+    """
+    Convex hulls of brushes that all have num_sides sides.  Every corner is the intersection of 3 side planes that's inside
+    (or on) all the other sides, solved for all plane triples of all the brushes at once; every side's face is then the
+    corners on its plane, ordered around their center.
+    Returns (corners, loop_vertices, loop_totals, polygon brush indices), loops indexing into corners.
+    """
+    side_normals = normals[side_planes]             # (brushes, sides, 3)
+    side_distances = distances[side_planes]         # (brushes, sides)
+
+    # Every corner candidate
+    triples = np.array(list(itertools.combinations(range(num_sides), 3)), dtype=np.int64)
+    matrices = side_normals[:, triples]             # (brushes, triples, 3, 3)
+    solvable = np.abs(np.linalg.det(matrices)) > 1e-6
+    points = np.zeros(matrices.shape[:3])
+    points[solvable] = np.linalg.solve(matrices[solvable], side_distances[:, triples][solvable][..., None])[..., 0]
+
+    # Corners are inside every side, whose normals point out of the brush
+    outside = np.einsum('btj,bsj->bts', points, side_normals) - side_distances[:, None, :]
+    is_corner = solvable & np.all(outside <= PLANE_EPSILON, axis=2)
+    corner_brushes, corner_triples = np.nonzero(is_corner)
+    corners = points[corner_brushes, corner_triples]
+
+    # Several triples meet in the same corner when more than 3 sides do
+    keys = np.column_stack((corner_brushes, np.round(corners / CORNER_MERGE_DISTANCE).astype(np.int64)))
+    keys, first, corner_ids = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    corners = corners[first]
+    corner_brushes = corner_brushes[first]
+
+    # Sides a corner is on.  A plane used twice by a brush only makes 1 face, and bevel sides (which the compiler adds
+    # for collision) only touch an edge or a corner, so they end up with less than 3 corners and no face.
+    repeated = np.zeros(side_planes.shape, dtype=bool)
+    for side in range(1, num_sides):
+        repeated[:, side] = np.any(side_planes[:, :side] == side_planes[:, side:side + 1], axis=1)
+    on_side = np.abs(np.einsum('cj,csj->cs', corners, side_normals[corner_brushes]) - side_distances[corner_brushes]) <= PLANE_EPSILON
+    on_side &= ~repeated[corner_brushes]
+    loop_corners, loop_sides = np.nonzero(on_side)
+    loop_faces = corner_brushes[loop_corners] * num_sides + loop_sides
+
+    face_totals = np.bincount(loop_faces, minlength=len(brush_indices) * num_sides)
+    keep = face_totals[loop_faces] >= 3
+    loop_corners, loop_faces = loop_corners[keep], loop_faces[keep]
+
+    # Corners around each face's center, counter-clockwise seen from outside
+    face_normals = side_normals.reshape(-1, 3)
+    face_centers = np.zeros((len(face_totals), 3))
+    np.add.at(face_centers, loop_faces, corners[loop_corners])
+    face_centers /= np.maximum(face_totals, 1)[:, None]
+    u, v = get_side_basis(face_normals[loop_faces])
+    offsets = corners[loop_corners] - face_centers[loop_faces]
+    angles = np.arctan2(np.einsum('ij,ij->i', offsets, v), np.einsum('ij,ij->i', offsets, u))
+    order = np.lexsort((angles, loop_faces))
+    loop_corners, loop_faces = loop_corners[order], loop_faces[order]
+
+    faces, loop_totals = np.unique(loop_faces, return_counts=True)
+    return corners, loop_corners, loop_totals, brush_indices[faces // num_sides]
+
+
+def build_brush_mesh(bytes, header, contents_mask):
+    """
+    Rebuilds the convex volume of every brush with any of the contents_mask CONTENTS_* flags from its side planes
+    (the brushes and brush sides lumps), all as one mesh: a bsp_brush_mesh, or None if no brush matches.
+    Brushes are batched by their number of sides, so everything happens on arrays.
+    """
+    brushes = load_lump_array(bytes, header.brushes_offset, header.brushes_length, bsp_brush_dtype)
+    brush_sides = load_lump_array(bytes, header.brush_sides_offset, header.brush_sides_length, bsp_brush_side_dtype)
+    planes = load_lump_array(bytes, header.planes_offset, header.planes_length, bsp_plane_dtype)
+    normals = planes['normal'].astype(np.float64)
+    distances = planes['distance'].astype(np.float64)
+
+    selected = np.flatnonzero(brushes['contents'] & contents_mask)
+    num_sides = brushes['num_sides'].astype(np.int64)
+
+    vertices, loop_vertices, loop_totals, poly_brushes = [], [], [], []
+    num_vertices = 0
+    for sides in np.unique(num_sides[selected]).tolist():
+        if sides < 4:
+            continue
+        group = selected[num_sides[selected] == sides]
+        triples = sides * (sides - 1) * (sides - 2) // 6
+        batch = max(1, BATCH_SIZE // (triples * sides))
+        for start in range(0, len(group), batch):
+            brush_indices = group[start : start + batch]
+            side_planes = brush_sides['plane'][brushes['first_side'][brush_indices][:, None] + np.arange(sides)].astype(np.int64)
+            corners, loops, totals, brush_polys = build_brush_batch(brush_indices, sides, side_planes, normals, distances)
+            vertices.append(corners)
+            loop_vertices.append(loops + num_vertices)
+            loop_totals.append(totals)
+            poly_brushes.append(brush_polys)
+            num_vertices += len(corners)
+
+    if not loop_totals or not sum(len(totals) for totals in loop_totals):
+        print(f"No brushes with contents {contents_mask:#x}")
+        return None
+
+    loop_totals = np.concatenate(loop_totals)
+    poly_brushes = np.concatenate(poly_brushes)
+    print(f"Rebuilt {len(np.unique(poly_brushes))} of {len(brushes)} brushes: {num_vertices} vertices, {len(loop_totals)} faces")
+    return bsp_brush_mesh(vertices=np.concatenate(vertices),
+                          loop_vertices=np.concatenate(loop_vertices),
+                          loop_starts=np.cumsum(loop_totals) - loop_totals,
+                          loop_totals=loop_totals,
+                          poly_brushes=poly_brushes,
+                          poly_contents=brushes['contents'][poly_brushes].astype(np.int64))
@@ -0,0 +1,410 @@
+# Converts maps to glTF 2.0 binary (.glb) or OBJ/MTL without Blender, from the same preprocessing as the importer (see
+# bsp_preprocessor): faces, UVs, textures and the lightmap atlas.  Run it as a script, e.g.
+#     python "idTech 2 BSP Blender Importer/bsp_convert.py" maps/*.bsp --format glb --output-dir converted
+import os
+import io
+import re
+import sys
+import json
+import struct
+import argparse
+import traceback
+
+if not __package__:
+    # Run as a script: the addon's __init__ needs bpy, so its folder is put in place as a package without it,
+    # the modules below import from there as usual (like batch_import's worker processes)
+    import types
+    __package__ = "idtech2_bsp_convert"
+    _package = types.ModuleType(__package__)
+    _package.__path__ = [os.path.dirname(os.path.abspath(__file__))]
+    sys.modules[__package__] = _package
+
+import numpy as np
+from PIL import Image
+
+from .custom_types import *
+from .wal import wal_image
+from .bsp_preprocess import *
+
+
+GLB_MAGIC = 0x46546C67          # "glTF"
+GLB_CHUNK_JSON = 0x4E4F534A
+GLB_CHUNK_BIN = 0x004E4942
+GLTF_ARRAY_BUFFER = 34962
+GLTF_ELEMENT_ARRAY_BUFFER = 34963
+GLTF_FLOAT = 5126
+GLTF_UNSIGNED_BYTE = 5121
+GLTF_UNSIGNED_INT = 5125
+GLTF_CLAMP_TO_EDGE = 33071
+GLTF_LINEAR = 9729
+
+CONVERT_FORMATS = ('GLB', 'OBJ')
+TEXTURE_FOLDER = "textures"
+
+
+def get_output_positions(vertices, model_scale):
+    """
+    Vertices in scene units, Y up (glTF, and what OBJ readers expect) instead of Z up: (x, y, z) -> (x, z, -y).
+    """
+    scaled = np.asarray(vertices, dtype=np.float64) * model_scale
+    return np.column_stack((scaled[:, 0], scaled[:, 2], 0.0 - scaled[:, 1])).astype(np.float32)
+
+
+def get_texinfo_materials(ctx):
+    """
+    The material (texture name) of every texinfo, and the names in order.  Every frame of an animated texture gets its first
+    frame's material, like the imported materials (see create_materials).
+    """
+    used_texture_infos = get_used_texture_infos(ctx)
+    material_names = []
+    texinfo_materials = np.zeros(len(ctx.textures), dtype=np.int64)
+    for texture_idx, texture in enumerate(ctx.textures):
+        chain = ctx.texinfo_chains[texture_idx]
+        texture_name = ctx.textures[ctx.animation_chains[chain][0]].texture_name if chain >= 0 else texture.texture_name
+        if texture_idx in used_texture_infos and texture_name not in material_names:
+            material_names.append(texture_name)
+        texinfo_materials[texture_idx] = material_names.index(texture_name) if texture_name in material_names else 0
+    return texinfo_materials, material_names
+
+
+def encode_image(pixels):
+    """
+    PNG bytes of (height, width, 3 or 4) pixel bytes, rows top down.
+    """
+    output = io.BytesIO()
+    Image.fromarray(np.ascontiguousarray(pixels)).save(output, format='PNG')
+    return output.getvalue()
+
+
+def get_texture_image(ctx, texture_name, texture_mip=0):
+    """
+    A texture as a file glTF and OBJ readers take: (bytes, MIME type, extension), or None if it wasn't found or can't be read.
+    PNGs and JPEGs are passed on as they are, WALs (already decoded ahead, if they were, see decode_textures) and other
+    formats become PNGs.
+    """
+    if texture_name not in ctx.texture_source_dict:
+        return None
+    path, pak_member = ctx.texture_source_dict[texture_name]
+    extension = os.path.splitext(pak_member or path)[1].casefold()
+    try:
+        if texture_name in ctx.decoded_textures:
+            return encode_image(ctx.decoded_textures[texture_name][1]), "image/png", ".png"
+        data = read_texture_data(ctx, path, pak_member)
+        if extension == '.wal':
+            return encode_image(get_wal_pixels(wal_image(data, texture_mip))), "image/png", ".png"
+        if extension == '.png':
+            return bytes(data), "image/png", ".png"
+        if extension in ('.jpg', '.jpeg'):
+            return bytes(data), "image/jpeg", ".jpg"
+        with Image.open(io.BytesIO(data)) as pil_img:
+            return encode_image(np.asarray(pil_img.convert('RGBA'))), "image/png", ".png"
+    except Exception as e:
+        print(f"ERROR reading {texture_name} ({path}): {e}")
+        return None
+
+
+def get_lightmap_image(ctx):
+    """
+    The lightmap atlas as PNG bytes.  ctx.lightmap_pixels has its rows bottom up (like Blender's image pixels), PNG rows
+    go top down, so they're flipped over.
+    """
+    return encode_image(ctx.lightmap_pixels[::-1, :, :3])
+
+
+def write_texture_file(output_folder, texture_name, image):
+    """
+    Writes a texture next to the converted map, in TEXTURE_FOLDER.  Returns its path relative to the map.
+    """
+    data, mime_type, extension = image
+    safe_name = re.sub(r'[^\w.-]', '_', texture_name)
+    relative_path = f"{TEXTURE_FOLDER}/{safe_name}{extension}"
+    os.makedirs(os.path.join(output_folder, TEXTURE_FOLDER), exist_ok=True)
+    with open(os.path.join(output_folder, relative_path), "wb") as f:
+        f.write(data)
+    return relative_path
+
+
+class gltf_buffer(object):
+    """
+    The binary chunk of a .glb, built from whole arrays: every add() is one buffer view, 4 byte aligned.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.length = 0
+        self.views = []
+
+
+    def add(self, data, target=None):
+        data = data.tobytes() if isinstance(data, np.ndarray) else bytes(data)
+        view = {"buffer": 0, "byteOffset": self.length, "byteLength": len(data)}
+        if target:
+            view["target"] = target
+        self.views.append(view)
+        padding = -len(data) % 4
+        self.chunks.append(data + b"\0" * padding)
+        self.length += len(data) + padding
+        return len(self.views) - 1
+
+
+    def get_bytes(self):
+        return b"".join(self.chunks)
+
+
+def write_glb(ctx, output_path, model_scale, apply_transforms=True, embed_textures=True, texture_mip=0):
+    """
+    Writes the map as one glTF 2.0 binary mesh, with a primitive per material.  Loops with the same vertex and UVs become one
+    glTF vertex.  The lightmap atlas (if packed) is a second UV set (TEXCOORD_1) and an image of its own; glTF has no
+    lightmap slot, so lit materials point at it in their extras ("lightmap": texture index and UV set).  Vertex color lightmaps
+    (see bake_vertex_lightmaps) are COLOR_0, which glTF multiplies the base color by, just like the imported materials do.
+    Textures are in the .glb, or with embed_textures off, files in TEXTURE_FOLDER next to it.
+    """
+    if not len(ctx.loop_totals):
+        raise ValueError(f"{ctx.name} has no faces to write")
+    output_folder = os.path.dirname(os.path.abspath(output_path))
+    has_lightmaps = ctx.lightmap_pixels is not None and ctx.lightmap_uvs is not None
+    texinfo_materials, material_names = get_texinfo_materials(ctx)
+
+    # glTF only takes triangles
+    if np.any(ctx.loop_totals != 3):
+        triangulate_faces(ctx)
+    poly_texinfos = ctx.faces['texture_info'][ctx.bsp_face_indices].astype(np.int64)
+    tri_materials = texinfo_materials[poly_texinfos]
+
+    # glTF's UV origin is the top left, Blender's (and so the context's UVs) the bottom left
+    uvs = ctx.uvs if ctx.uvs is not None else np.zeros((len(ctx.loop_vertices), 2), dtype=np.float32)
+    uvs = np.column_stack((uvs[:, 0], 1.0 - uvs[:, 1])).astype(np.float32)
+    loop_keys = [ctx.loop_vertices.astype(np.int64)[:, None], uvs.view(np.int32)]
+    if has_lightmaps:
+        lightmap_uvs = np.column_stack((ctx.lightmap_uvs[:, 0], 1.0 - ctx.lightmap_uvs[:, 1])).astype(np.float32)
+        loop_keys.append(lightmap_uvs.view(np.int32))
+    if ctx.lightmap_colors is not None:
+        loop_keys.append(np.ascontiguousarray(ctx.lightmap_colors).view(np.int32))
+    unique_keys, first_loops, loop_gltf_vertices = np.unique(np.hstack(loop_keys), axis=0, return_index=True, return_inverse=True)
+    loop_gltf_vertices = loop_gltf_vertices.ravel().astype(np.uint32)
+
+    positions = get_output_positions(ctx.vertices, model_scale if apply_transforms else 1.0)[ctx.loop_vertices[first_loops]]
+    buffer = gltf_buffer()
+    accessors = [{"bufferView": buffer.add(positions, GLTF_ARRAY_BUFFER), "componentType": GLTF_FLOAT, "count": len(positions),
+                  "type": "VEC3", "min": positions.min(axis=0).tolist(), "max": positions.max(axis=0).tolist()},
+                 {"bufferView": buffer.add(uvs[first_loops], GLTF_ARRAY_BUFFER), "componentType": GLTF_FLOAT, "count": len(positions),
+                  "type": "VEC2"}]
+    attributes = {"POSITION": 0, "TEXCOORD_0": 1}
+    if has_lightmaps:
+        attributes["TEXCOORD_1"] = len(accessors)
+        accessors.append({"bufferView": buffer.add(lightmap_uvs[first_loops], GLTF_ARRAY_BUFFER), "componentType": GLTF_FLOAT,
+                          "count": len(positions), "type": "VEC2"})
+    if ctx.lightmap_colors is not None:
+        attributes["COLOR_0"] = len(accessors)
+        accessors.append({"bufferView": buffer.add(np.ascontiguousarray(ctx.lightmap_colors[first_loops]), GLTF_ARRAY_BUFFER),
+                          "componentType": GLTF_UNSIGNED_BYTE, "normalized": True, "count": len(positions), "type": "VEC4"})
+
+    # Every material's triangles in a row, one primitive each
+    tri_order = np.argsort(tri_materials, kind='stable')
+    indices = loop_gltf_vertices.reshape(-1, 3)[tri_order]
+    index_view = buffer.add(indices, GLTF_ELEMENT_ARRAY_BUFFER)
+    material_tris = np.bincount(tri_materials, minlength=len(material_names))
+    tri_offsets = np.cumsum(material_tris) - material_tris
+
+    images, textures, materials = [], [], []
+    def add_image(name, image):
+        data, mime_type, extension = image
+        if embed_textures:
+            images.append({"name": name, "mimeType": mime_type, "bufferView": buffer.add(data)})
+        else:
+            images.append({"name": name, "uri": write_texture_file(output_folder, name, image)})
+        return len(images) - 1
+
+    lightmap_texture = None
+    if has_lightmaps:
+        textures.append({"source": add_image(f"{ctx.name}_atlas", (get_lightmap_image(ctx), "image/png", ".png")), "sampler": 1})
+        lightmap_texture = len(textures) - 1
+    lit_materials = set(texinfo_materials[np.unique(ctx.faces['texture_info'][ctx.lit_faces])].tolist()) if has_lightmaps else set()
+
+    primitives = []
+    for material_idx, texture_name in enumerate(material_names):
+        material = {"name": f"M_{texture_name}", "pbrMetallicRoughness": {"metallicFactor": 0.0, "roughnessFactor": 1.0}}
+        image = get_texture_image(ctx, texture_name, texture_mip)
+        if image:
+            textures.append({"source": add_image(texture_name, image), "sampler": 0})
+            material["pbrMetallicRoughness"]["baseColorTexture"] = {"index": len(textures) - 1}
+        if material_idx in lit_materials:
+            material["extras"] = {"lightmap": {"index": lightmap_texture, "texCoord": 1}}
+        materials.append(material)
+
+        if material_tris[material_idx]:
+            accessors.append({"bufferView": index_view, "byteOffset": int(tri_offsets[material_idx]) * 12, "componentType": GLTF_UNSIGNED_INT,
+                              "count": int(material_tris[material_idx]) * 3, "type": "SCALAR"})
+            primitives.append({"attributes": attributes, "indices": len(accessors) - 1, "material": material_idx})
+
+    node = {"name": ctx.name, "mesh": 0}
+    if not apply_transforms:
+        node["scale"] = [model_scale] * 3
+    gltf = {"asset": {"version": "2.0", "generator": "idTech 2 BSP Importer"},
+            "scene": 0, "scenes": [{"nodes": [0]}], "nodes": [node],
+            "meshes": [{"name": ctx.name, "primitives": primitives}],
+            "materials": materials, "accessors": accessors,
+            "samplers": [{}, {"magFilter": GLTF_LINEAR, "minFilter": GLTF_LINEAR, "wrapS": GLTF_CLAMP_TO_EDGE, "wrapT": GLTF_CLAMP_TO_EDGE}]}
+    if textures:
+        gltf.update(images=images, textures=textures)
+    binary = buffer.get_bytes()
+    gltf.update(bufferViews=buffer.views, buffers=[{"byteLength": len(binary)}])
+
+    json_chunk = json.dumps(gltf, separators=(",", ":")).encode()
+    json_chunk += b" " * (-len(json_chunk) % 4)
+    with open(output_path, "wb") as f:
+        f.write(struct.pack("<III", GLB_MAGIC, 2, 12 + 8 + len(json_chunk) + 8 + len(binary)))
+        f.write(struct.pack("<II", len(json_chunk), GLB_CHUNK_JSON))
+        f.write(json_chunk)
+        f.write(struct.pack("<II", len(binary), GLB_CHUNK_BIN))
+        f.write(binary)
+    print(f"Wrote {output_path}: {len(positions)} vertices, {len(indices)} triangles, {len(materials)} materials, {len(images)} images")
+
+
+def write_obj(ctx, output_path, model_scale, texture_mip=0):
+    """
+    Writes the map as an .obj with its .mtl next to it, and the textures as files in TEXTURE_FOLDER.  Polygons stay polygons
+    (unless triangulated on import), grouped by material.  OBJ has only one UV set, so there are no lightmaps.
+    Every line type is written with one np.savetxt over a whole array, faces a batch per material and corner count.
+    """
+    output_folder = os.path.dirname(os.path.abspath(output_path))
+    mtl_name = os.path.splitext(os.path.basename(output_path))[0] + ".mtl"
+    texinfo_materials, material_names = get_texinfo_materials(ctx)
+    poly_materials = texinfo_materials[ctx.faces['texture_info'][ctx.bsp_face_indices].astype(np.int64)]
+
+    uvs = ctx.uvs if ctx.uvs is not None else np.zeros((len(ctx.loop_vertices), 2), dtype=np.float32)
+    unique_uvs, loop_uvs = np.unique(uvs, axis=0, return_inverse=True)
+    loop_uvs = loop_uvs.ravel()
+
+    with open(os.path.join(output_folder, mtl_name), "w") as f:
+        for texture_name in material_names:
+            f.write(f"newmtl M_{texture_name}\nKd 1.000000 1.000000 1.000000\nKs 0.000000 0.000000 0.000000\n")
+            image = get_texture_image(ctx, texture_name, texture_mip)
+            if image:
+                f.write(f"map_Kd {write_texture_file(output_folder, texture_name, image)}\n")
+            f.write("\n")
+
+    with open(output_path, "w") as f:
+        f.write(f"mtllib {mtl_name}\no {ctx.name}\n")
+        np.savetxt(f, get_output_positions(ctx.vertices, model_scale), fmt="v %.6f %.6f %.6f")
+        np.savetxt(f, unique_uvs, fmt="vt %.6f %.6f")
+
+        # OBJ indices start at 1
+        loop_corners = np.column_stack((ctx.loop_vertices + 1, loop_uvs + 1))
+        for material_idx, texture_name in enumerate(material_names):
+            material_polys = np.flatnonzero(poly_materials == material_idx)
+            if not len(material_polys):
+                continue
+            f.write(f"usemtl M_{texture_name}\n")
+            totals = ctx.loop_totals[material_polys]
+            for total in np.unique(totals).tolist():
+                polys = material_polys[totals == total]
+                corners = loop_corners[(ctx.loop_starts[polys][:, None] + np.arange(total)).ravel()].reshape(len(polys), total * 2)
+                np.savetxt(f, corners, fmt="f" + " %d/%d" * total)
+    print(f"Wrote {output_path}: {len(ctx.vertices)} vertices, {len(ctx.loop_totals)} polygons, {len(material_names)} materials")
+
+
+def convert_bsp(bsp_path, output_path, options=None, file_format='GLB', embed_textures=True):
+    """
+    Converts a .bsp to a .glb or .obj (file_format 'GLB' or 'OBJ'), no Blender needed.  options are the import options
+    (bsp_import_options) of everything it shares with an import: scale, texture search, PAKs, lightmaps, face selection,
+    weld & merge, the import cache.  Options about Blender objects (splitting, entities, brushes...) don't apply.
+    """
+    options = options or bsp_import_options()
+    name = os.path.basename(options.pak_map.replace('\\', '/') if options.pak_map else bsp_path).split('.')[0]
+    preprocessor = bsp_preprocessor(bsp_path, options)
+    preprocessor.ctx = bsp_import_context(name, os.path.dirname(os.path.abspath(bsp_path)))
+    preprocessor.import_cache_dir = options.import_cache_dir or None
+
+    # The preprocessor's own copy of the options: one mesh, no objects besides it
+    options = preprocessor.options
+    if options.area_import == 'SPLIT':
+        options.area_import = 'NONE'
+    options.separate_special_faces = options.show_entities = options.import_brushes = options.reimport = False
+    options.chunk_mode = 'NONE'
+    if file_format == 'OBJ' or options.geometry_only:
+        options.apply_lightmaps = False
+    if options.use_import_cache and not preprocessor.import_cache_dir:
+        print("No import cache folder given, not using the import cache")
+        options.use_import_cache = False
+
+    ctx = preprocessor.ctx
+    try:
+        preprocessor.preprocess()
+        if options.geometry_only:
+            # No textures at all, not even referenced
+            ctx.texture_source_dict = {}
+        if file_format == 'OBJ':
+            write_obj(ctx, output_path, options.model_scale, options.texture_mip)
+        else:
+            write_glb(ctx, output_path, options.model_scale, options.apply_transforms, embed_textures, options.texture_mip)
+    finally:
+        preprocessor.file_bytes = None
+        ctx.release()
+
+
+def get_convert_paths(paths):
+    """
+    The maps to convert: files as they are, and every .bsp file in the folders, by name.
+    """
+    bsp_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            bsp_paths += sorted(os.path.join(path, file) for file in os.listdir(path) if file.casefold().endswith(".bsp"))
+        else:
+            bsp_paths.append(path)
+    return bsp_paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Converts idTech 2 (Quake II) .bsp maps to glTF 2.0 binary (.glb) or OBJ/MTL, "
+                                                 "without Blender.")
+    parser.add_argument("paths", nargs="+", help=".bsp files, or folders to convert every .bsp in")
+    parser.add_argument("-f", "--format", choices=[f.lower() for f in CONVERT_FORMATS], default="glb")
+    parser.add_argument("-o", "--output-dir", help="Where the converted maps go (default: next to each map)")
+    parser.add_argument("--scale", type=float, default=0.01, help="Scale from BSP units (default: 0.01)")
+    parser.add_argument("--lightmaps", action="store_true", help="Pack the lightmap atlas and write it as TEXCOORD_1 (glb only)")
+    parser.add_argument("--lightmap-mode", choices=["atlas", "vertex"], default="atlas",
+                        help="With --lightmaps: an atlas and TEXCOORD_1, or baked to vertex colors (COLOR_0)")
+    parser.add_argument("--smooth-vertex-lightmaps", action="store_true", help="Average vertex lightmaps over the faces of every vertex")
+    parser.add_argument("--collapse-uniform-lightmaps", action="store_true", help="Pack lightmaps of a single color as 1 texel")
+    parser.add_argument("--external-textures", action="store_true", help="Write the textures as files next to the .glb instead of in it")
+    parser.add_argument("--geometry-only", action="store_true", help="No textures, just the geometry and UVs")
+    parser.add_argument("--search-from-parent", action="store_true", help="Search for textures from the map's parent folder")
+    parser.add_argument("--no-paks", action="store_true", help="Don't read textures out of .pak files")
+    parser.add_argument("--texture-mip", type=int, default=0, choices=range(4), help="WAL mip level to write (default: 0, full size)")
+    parser.add_argument("--keep-nodraw", action="store_true", help="Keep nodraw, hint and skip faces")
+    parser.add_argument("--optimize", action="store_true", help="Weld vertices and merge coplanar faces")
+    parser.add_argument("--weld-distance", type=float, default=0.01, help="Weld distance in BSP units (default: 0.01)")
+    parser.add_argument("--triangulate", action="store_true", help="Fan triangulate the polygons (glb always is)")
+    parser.add_argument("--import-cache", metavar="FOLDER", help="Keep preprocessed maps in this folder, to convert unchanged ones faster")
+    parser.add_argument("--low-memory", action="store_true", help="Decode every texture only when writing it")
+    args = parser.parse_args(argv)
+
+    options = bsp_import_options(model_scale=args.scale, search_from_parent=args.search_from_parent, apply_lightmaps=args.lightmaps,
+                                 collapse_uniform_lightmaps=args.collapse_uniform_lightmaps, lightmap_mode=args.lightmap_mode.upper(),
+                                 smooth_vertex_lightmaps=args.smooth_vertex_lightmaps,
+                                 skip_nodraw=not args.keep_nodraw, optimize_mesh=args.optimize, weld_distance=args.weld_distance,
+                                 use_paks=not args.no_paks, texture_mip=args.texture_mip, geometry_only=args.geometry_only,
+                                 use_import_cache=bool(args.import_cache), import_cache_dir=args.import_cache or "",
+                                 low_memory=args.low_memory, triangulate=args.triangulate)
+    file_format = args.format.upper()
+    failed = []
+    for bsp_path in get_convert_paths(args.paths):
+        output_folder = args.output_dir or os.path.dirname(os.path.abspath(bsp_path))
+        os.makedirs(output_folder, exist_ok=True)
+        output_path = os.path.join(output_folder, os.path.splitext(os.path.basename(bsp_path))[0] + "." + file_format.lower())
+        try:
+            convert_bsp(bsp_path, output_path, options, file_format, embed_textures=not args.external_textures)
+        except Exception as e:
+            print(f"ERROR converting {bsp_path}: {e}")
+            traceback.print_exc()
+            failed.append(bsp_path)
+
+    if failed:
+        print(f"{len(failed)} maps failed: {failed}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
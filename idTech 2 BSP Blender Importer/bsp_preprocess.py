@@ -0,0 +1,1081 @@
+# The part of an import that doesn't need Blender: reading the map, building the faces, finding and decoding textures, UVs,
+# lightmaps.  No bpy in here (or in anything imported here), so it runs in background threads and worker processes too.
+from dataclasses import fields, replace
+import struct
+import os
+import io
+import math
+import re
+import threading
+import traceback
+
+import numpy as np
+from pathlib import Path
+
+from .custom_types import *
+from .utils import *
+from .wal import *
+from .bsp_tree import bsp_tree
+from .bsp_brushes import build_brush_mesh
+from .mesh_optimize import *
+from .pak import pak_collection
+from .bsp_animate import get_animation_chains
+from .import_cache import get_import_cache_key, get_import_cache_path, save_import_cache, load_import_cache, restore_import_cache
+from .memory_usage import stage_memory_log
+
+import PIL
+from PIL import Image
+
+
+SAMPLE_STEP = 16.0  # world units per lightmap sample
+pad = 0
+atlas_max_width = 4096
+flip_v = True
+
+
+def get_texinfo_axes(ctx):
+    """
+    The s and t axes of every texinfo as rows of (u axis, u offset, v axis, v offset).
+    """
+    return np.array([(*t.u_axis, t.u_offset, *t.v_axis, t.v_offset) for t in ctx.textures], dtype=np.float64).reshape(-1, 8)
+
+
+def get_lightmap_extents(ctx):
+    """
+    Where every face's lightmap block lies in its texinfo's s/t space, in samples, as (min s, min t, width, height): the
+    bounding box of the face's corners, like the compiler sizes it.  Faces without corners get an empty block.
+    """
+    extents = np.zeros((len(ctx.faces), 4), dtype=np.int64)
+    has_loop = ctx.loop_totals > 0
+    if not np.any(has_loop):
+        return extents
+
+    axes = get_texinfo_axes(ctx)[np.repeat(ctx.faces['texture_info'].astype(np.int64), ctx.loop_totals)]
+    coords = ctx.vertices[ctx.loop_vertices]
+    s = (np.einsum('ij,ij->i', coords, axes[:, 0:3]) - axes[:, 3]) / SAMPLE_STEP
+    t = (np.einsum('ij,ij->i', coords, axes[:, 4:7]) - axes[:, 7]) / SAMPLE_STEP
+    starts = ctx.loop_starts[has_loop]
+    mins = np.floor(np.stack((np.minimum.reduceat(s, starts), np.minimum.reduceat(t, starts)), axis=1))
+    maxs = np.ceil(np.stack((np.maximum.reduceat(s, starts), np.maximum.reduceat(t, starts)), axis=1))
+    extents[has_loop, :2] = mins
+    extents[has_loop, 2:] = maxs - mins
+    return extents
+
+
+def get_uniform_lightmap_colors(ctx, file_bytes, face_indices):
+    """
+    The color (0xRRGGBB) of each of the given faces whose lightmap is all one color, -1 for the others (and for faces
+    without a lightmap).  Stretching such a lightmap over a bigger polygon changes nothing, so these faces can be merged.
+    """
+    samples = np.frombuffer(file_bytes, dtype=np.uint8)
+    lm_base_offset = getattr(ctx.header, "lightmaps_offset", 0)
+    colors = np.full(len(face_indices), -1, dtype=np.int64)
+    for i, fi in enumerate(face_indices.tolist()):
+        width, height = ctx.lightmap_extents[fi, 2:].tolist()
+        byte_offset = lm_base_offset + int(ctx.faces[fi]['lightmap_offset'])
+        if width <= 0 or height <= 0 or byte_offset + width * height * 3 > len(samples):
+            continue
+        block = samples[byte_offset : byte_offset + width * height * 3]
+        if not np.any(block.reshape(-1, 3) != block[:3]):
+            colors[i] = (int(block[0]) << 16) | (int(block[1]) << 8) | int(block[2])
+    return colors
+
+
+def get_face_lightmap_blocks(ctx, file_bytes):
+    """
+    Where the lightmap of every lit polygon is in the file, as (BSP face, byte offset, width, height), without reading it yet.
+    Sizes come from the faces' own corners (ctx.lightmap_extents), so merged polygons still get their face's block.
+    """
+    blocks = []
+    lm_base_offset = getattr(ctx.header, "lightmaps_offset", 0)
+    total_bytes = len(file_bytes)
+
+    # Polygons may only be a subset of the BSP faces (e.g. visibility culled), so go by the polygon -> face mapping
+    for fi in ctx.bsp_face_indices.tolist():
+        # The engine doesn't lightmap sky, warped (liquid) or translucent surfaces, so don't waste atlas space on them
+        if ctx.face_classes[fi] != FACE_CLASS_SOLID:
+            continue
+
+        face = ctx.faces[fi]
+        width, height = ctx.lightmap_extents[fi, 2:].tolist()
+        if width <= 0 or height <= 0:
+            print(f"Skipping face {fi}: degenerate lightmap size {width}x{height}")
+            continue
+
+        byte_offset = lm_base_offset + int(face['lightmap_offset'])
+        expected_bytes = width * height * 3
+        if byte_offset < 0 or byte_offset + expected_bytes > total_bytes:
+            print(f"Face {fi}: invalid lightmap offset/size (offset={byte_offset}, bytes_needed={expected_bytes}), skipping")
+            continue
+
+        blocks.append((fi, byte_offset, width, height))
+
+    print(f"Found {len(blocks)} face lightmaps")
+    return blocks
+
+
+def pack_rows(sizes, max_width, min_width=64, max_height=None):
+    """
+    The packer of both atlases (lightmaps, textures): rectangles (width, height), tallest first, in rows as wide as the
+    widest one, or min_width (both rounded up to a power of 2, up to max_width), each row below the last.
+    With max_height, rows that don't fit anymore start a new page.
+    Returns the (page, x, y) of every rectangle (None for ones that can't fit at all), the width, and the height of every page.
+    """
+    def next_pow2(x): return 1 << (x - 1).bit_length()
+    width = min(max_width, next_pow2(max(max(w for w, h in sizes), min_width)))
+
+    positions = [None] * len(sizes)
+    page_heights = []
+    cur_x = 0
+    cur_y = 0
+    row_h = 0
+    for i in sorted(range(len(sizes)), key=lambda i: sizes[i][1], reverse=True):
+        w, h = sizes[i]
+        if w > width or (max_height and h > max_height):
+            continue
+        if cur_x + w > width:
+            cur_y += row_h
+            cur_x = 0
+            row_h = 0
+        if max_height and cur_y + h > max_height:
+            page_heights.append(cur_y)
+            cur_x = 0
+            cur_y = 0
+            row_h = 0
+        positions[i] = (len(page_heights), cur_x, cur_y)
+        cur_x += w
+        row_h = max(row_h, h)
+    page_heights.append(cur_y + row_h)
+    return positions, width, page_heights
+
+
+def get_lightmap_slots(blocks, samples, collapse_uniform=False):
+    """
+    Deduplicates the face lightmap blocks: many faces have the very same samples (fully lit or dark faces, repeated detail),
+    so every distinct block is only packed once, in a slot the faces with a copy of it share.  With collapse_uniform, a block
+    of a single color is cut down to 1 texel, shared with every other block of that color.
+    Returns the slots as (byte offset, width, height, uniform) and the slot of every block.
+    """
+    slots = []
+    slot_keys = {}          # (width, height, hash of the samples) -> slot
+    block_slots = []
+    for fi, byte_offset, width, height in blocks:
+        block = samples[byte_offset : byte_offset + width * height * 3]
+        uniform = collapse_uniform and not np.any(block.reshape(-1, 3) != block[:3])
+        if uniform:
+            width = height = 1
+            block = block[:3]
+        key = (width, height, hash_bytes(block))
+        if key not in slot_keys:
+            slot_keys[key] = len(slots)
+            slots.append((byte_offset, width, height, uniform))
+        block_slots.append(slot_keys[key])
+    return slots, block_slots
+
+
+def pack_lightmap_atlas(ctx, file_bytes, collapse_uniform=False):
+    """
+    Packs the per face lightmaps into one atlas, in rows by height, and works out every loop's UV in it.
+    Identical lightmaps are packed once (see get_lightmap_slots), faces with the same one get the same rectangle.
+    The rectangles are placed first, then every slot's samples are copied straight from the file into the atlas array,
+    so nothing but the atlas itself is ever allocated for them.
+    Results go on the import context (lightmap_pixels, lightmap_uvs, lit_faces), nothing in Blender is touched yet.
+    """
+    print("Packing atlas lightmap (in-memory only)...")
+    blocks = get_face_lightmap_blocks(ctx, file_bytes)
+    if not blocks:
+        print("No face lightmaps found; aborting.")
+        return
+    samples = np.frombuffer(file_bytes, dtype=np.uint8)
+    slots, block_slots = get_lightmap_slots(blocks, samples, collapse_uniform)
+    print(f"{len(blocks)} face lightmaps, {len(slots)} distinct" + (" (uniform ones collapsed to 1 texel)" if collapse_uniform else ""))
+
+    print("Packing atlas rectangles...")
+    positions, atlas_w, (atlas_h,) = pack_rows([(width + 2 * pad, height + 2 * pad) for byte_offset, width, height, uniform in slots],
+                                               atlas_max_width)
+    slot_positions = {}     # slot -> (x, y)
+    for slot, position in enumerate(positions):
+        if position is None:
+            print(f"Lightmap of {slots[slot][1]}x{slots[slot][2]} too wide for atlas_max_width; skipping")
+            continue
+        slot_positions[slot] = (position[1] + pad, position[2] + pad)
+
+    if atlas_h <= 0:
+        print("Atlas height computed zero; aborting.")
+        return
+
+    # Stream every slot's RGB samples into its rectangle, rows flipped to match Quake's if needed
+    atlas = np.full((atlas_h, atlas_w, 4), 255, dtype=np.uint8)
+    for slot, (x, y) in slot_positions.items():
+        byte_offset, width, height, uniform = slots[slot]
+        block = samples[byte_offset : byte_offset + width * height * 3].reshape(height, width, 3)
+        atlas[y : y + height, x : x + width, :3] = block[::-1] if flip_v else block
+    ctx.lightmap_pixels = atlas
+
+    # Atlas rectangle (u0, v0, u1, v1) of every lit face.  Collapsed (uniform) lightmaps are just the center of their texel,
+    # so filtering never blends in the neighbours
+    lit_blocks = [(fi, slot) for (fi, byte_offset, width, height), slot in zip(blocks, block_slots) if slot in slot_positions]
+    ctx.lit_faces = np.array([fi for fi, slot in lit_blocks], dtype=np.int64)
+    slot_rects = {}
+    for slot, (x, y) in slot_positions.items():
+        byte_offset, width, height, uniform = slots[slot]
+        slot_rects[slot] = (x + 0.5, y + 0.5, x + 0.5, y + 0.5) if uniform else (x, y, x + width, y + height)
+    rects = np.array([slot_rects[slot] for fi, slot in lit_blocks], dtype=np.float64).reshape(-1, 4)
+    rects /= (atlas_w, atlas_h, atlas_w, atlas_h)
+    ctx.lightmap_uvs = get_lightmap_uvs(ctx, rects)
+    print(f"Packed lightmap atlas ({atlas_w}x{atlas_h}) for {len(lit_blocks)} faces in {len(slot_positions)} rectangles")
+
+
+def get_lightmap_uvs(ctx, face_rects):
+    """
+    Lightmap UV of every loop, all at once.  Each lit polygon's corners are projected onto its texinfo's s/t axes, the
+    ones the lightmap's samples are laid out along, and their bounding box is stretched over the face's atlas rectangle
+    (ctx.lit_faces -> face_rects).  Loops of polygons without a lightmap get (0, 0).
+    """
+    face_rect_idx = np.full(len(ctx.faces), -1, dtype=np.int64)
+    face_rect_idx[ctx.lit_faces] = np.arange(len(ctx.lit_faces))
+    poly_rects = face_rect_idx[ctx.bsp_face_indices]
+
+    loop_polys = np.repeat(np.arange(len(ctx.loop_totals)), ctx.loop_totals)
+    corners = ctx.vertices[ctx.loop_vertices]
+    axes = get_texinfo_axes(ctx)[ctx.faces['texture_info'][ctx.bsp_face_indices[loop_polys]].astype(np.int64)]
+
+    # Corner positions along s/t, normalized to 0-1 over the polygon's bounding box
+    local = np.stack((np.einsum('ij,ij->i', corners, axes[:, 0:3]), np.einsum('ij,ij->i', corners, axes[:, 4:7])), axis=1)
+    local_min = np.minimum.reduceat(local, ctx.loop_starts, axis=0)
+    span = np.maximum.reduceat(local, ctx.loop_starts, axis=0) - local_min
+    span[span == 0] = 1e-6
+    local = (local - local_min[loop_polys]) / span[loop_polys]
+
+    uvs = np.zeros((len(corners), 2), dtype=np.float32)
+    lit_loops = poly_rects[loop_polys] >= 0
+    rects = face_rects[poly_rects[loop_polys][lit_loops]]
+    uvs[lit_loops, 0] = rects[:, 0] + local[lit_loops, 0] * (rects[:, 2] - rects[:, 0])
+    uvs[lit_loops, 1] = rects[:, 1] + local[lit_loops, 1] * (rects[:, 3] - rects[:, 1])
+    if flip_v:
+        uvs[lit_loops, 1] = 1.0 - uvs[lit_loops, 1]
+    return uvs
+
+
+def bake_vertex_lightmaps(ctx, file_bytes, smooth=False):
+    """
+    Lighting without an atlas: every lit polygon's lightmap is sampled (bilinear) at its corners, at their lightmap coordinates
+    from the texinfo s/t axes, like the blocks are laid out (see get_face_lightmap_blocks).  With smooth, every loop gets the
+    average of all lit loops of its vertex, so lighting blends across faces.  Loops without a lightmap (sky, liquids...) are
+    white, multiplying by them changes nothing.
+    Results go on the import context: lightmap_colors (RGBA bytes of every loop) and lit_faces.
+    """
+    print("Baking lightmaps to vertex colors...")
+    blocks = get_face_lightmap_blocks(ctx, file_bytes)
+    colors = np.full((len(ctx.loop_vertices), 4), 255, dtype=np.uint8)
+    ctx.lit_faces = np.array([block[0] for block in blocks], dtype=np.int64)
+    ctx.lightmap_colors = colors
+    if not blocks:
+        return
+
+    face_blocks = np.full(len(ctx.faces), -1, dtype=np.int64)
+    face_blocks[ctx.lit_faces] = np.arange(len(blocks))
+    block_layouts = np.array([block[1:] for block in blocks], dtype=np.int64)     # byte offset, width, height
+    loop_polys = np.repeat(np.arange(len(ctx.loop_totals)), ctx.loop_totals)
+    loop_blocks = face_blocks[ctx.bsp_face_indices][loop_polys]
+
+    # Lightmap coordinates in samples, from the corner of each face's block
+    loop_faces = ctx.bsp_face_indices[loop_polys]
+    axes = get_texinfo_axes(ctx)[ctx.faces['texture_info'][loop_faces].astype(np.int64)]
+    coords = ctx.vertices[ctx.loop_vertices]
+    s = (np.einsum('ij,ij->i', coords, axes[:, 0:3]) - axes[:, 3]) / SAMPLE_STEP - ctx.lightmap_extents[loop_faces, 0]
+    t = (np.einsum('ij,ij->i', coords, axes[:, 4:7]) - axes[:, 7]) / SAMPLE_STEP - ctx.lightmap_extents[loop_faces, 1]
+
+    lit = np.flatnonzero(loop_blocks >= 0)
+    offsets, widths, heights = block_layouts[loop_blocks[lit]].T
+    s = np.clip(s[lit], 0, widths - 1)
+    t = np.clip(t[lit], 0, heights - 1)
+    s0, t0 = np.floor(s).astype(np.int64), np.floor(t).astype(np.int64)
+    s1, t1 = np.minimum(s0 + 1, widths - 1), np.minimum(t0 + 1, heights - 1)
+    fs, ft = (s - s0)[:, None], (t - t0)[:, None]
+
+    samples = np.frombuffer(file_bytes, dtype=np.uint8)
+    def texels(x, y):
+        return samples[(offsets + (y * widths + x) * 3)[:, None] + np.arange(3)].astype(np.float64)
+    rgb = (texels(s0, t0) * (1 - fs) + texels(s1, t0) * fs) * (1 - ft) + (texels(s0, t1) * (1 - fs) + texels(s1, t1) * fs) * ft
+
+    if smooth:
+        lit_vertices = ctx.loop_vertices[lit]
+        counts = np.bincount(lit_vertices, minlength=len(ctx.vertices))
+        sums = np.stack([np.bincount(lit_vertices, weights=rgb[:, c], minlength=len(ctx.vertices)) for c in range(3)], axis=1)
+        rgb = sums[lit_vertices] / counts[lit_vertices, None]
+
+    colors[lit, :3] = np.clip(np.rint(rgb), 0, 255).astype(np.uint8)
+    print(f"Baked lightmaps of {len(blocks)} faces to {len(lit)} vertex colors" + (", smoothed" if smooth else ""))
+
+
+def load_header(bytes):
+    arguments = struct.unpack(f"<{'i'*40}", bytes[:160])
+    return bsp_header(*arguments)
+
+
+def load_file(ctx, path, data=None):
+    """
+    Reads the .bsp (unless its contents are given, e.g. from a PAK) and its header.
+    """
+    if data is None:
+        with open(path, "rb") as f:
+            data = f.read()
+    bytes = data
+    ctx.header = load_header(bytes)
+
+    print("--------------- HEADER VALUES -------------------")
+    for field in fields(ctx.header):
+        print(f"{field.name} - ", getattr(ctx.header, field.name))
+    print("--------------------------------------------------")
+    return bytes
+
+
+# Lumps that don't affect the mesh
+NON_GEOMETRY_LUMPS = ("entity", "lightmaps", "pop")
+
+
+def hash_lumps(bytes, header):
+    """
+    Content hash of every lump, keyed by lump name (e.g. "faces"), to tell what changed between two compiles of a map.
+    """
+    lump_hashes = {}
+    for field in fields(header):
+        if field.name.endswith("_offset"):
+            lump_name = field.name[:-len("_offset")]
+            offset = getattr(header, field.name)
+            lump_hashes[lump_name] = hash_bytes(memoryview(bytes)[offset : offset + getattr(header, f"{lump_name}_length")])
+    return lump_hashes
+
+
+def load_geometry(ctx):
+    """
+    Vertices and the polygon loops of every face, from the lumps the tree already has as arrays.
+    A negative face edge is walked from its 2nd vertex, so each face's loop is the first vertex of every directed edge.
+    Faces with fewer than 3 corners can't become polygons and are left out.  Lightmap extents are taken from the faces'
+    loops as they are in the file, before anything is welded or merged.
+    """
+    ctx.vertices = ctx.tree.vertices.astype(np.float64)
+    ctx.faces = ctx.tree.faces
+    ctx.loop_vertices = ctx.tree.loop_vertices
+    ctx.loop_starts = ctx.tree.loop_starts
+    ctx.loop_totals = ctx.tree.loop_totals
+    ctx.bsp_face_indices = np.arange(len(ctx.faces), dtype=np.int64)
+    ctx.lightmap_extents = get_lightmap_extents(ctx)
+    select_faces(ctx, np.flatnonzero(ctx.loop_totals >= 3))
+
+
+def select_faces(ctx, face_indices):
+    """
+    Keeps only the given BSP faces (e.g. the ones potentially visible from a point) for mesh creation.
+    The vertex array is compacted too, otherwise the mesh would keep loose vertices from all the dropped faces.
+    """
+    keep = np.isin(ctx.bsp_face_indices, np.asarray(face_indices, dtype=np.int64))
+    loop_totals = ctx.loop_totals[keep]
+    loop_vertices = ctx.loop_vertices[expand_ranges(ctx.loop_starts[keep], loop_totals)]
+    used_verts, loop_vertices = np.unique(loop_vertices, return_inverse=True)
+
+    print(f"Keeping {len(loop_totals)} of {len(ctx.loop_totals)} faces, {len(used_verts)} of {len(ctx.vertices)} vertices")
+    ctx.vertices = ctx.vertices[used_verts]
+    ctx.loop_vertices = loop_vertices.ravel()
+    ctx.loop_starts = np.cumsum(loop_totals) - loop_totals
+    ctx.loop_totals = loop_totals
+    ctx.bsp_face_indices = ctx.bsp_face_indices[keep]
+
+
+def get_used_texture_infos(ctx):
+    """
+    Texture info indices referenced by the faces being imported, so textures/materials for dropped faces are skipped.
+    The other frames of animated textures are included, the animated materials need them.
+    """
+    used_texture_infos = set(np.unique(ctx.faces['texture_info'][ctx.bsp_face_indices]).tolist())
+    for texture_idx in list(used_texture_infos):
+        if ctx.texinfo_chains[texture_idx] >= 0:
+            used_texture_infos.update(ctx.animation_chains[ctx.texinfo_chains[texture_idx]])
+    return used_texture_infos
+
+
+def classify_faces(ctx):
+    """
+    Sorts every BSP face into a FACE_CLASS_* from its texture info flags, all at once.
+    """
+    texinfo_flags = np.array([t.flags for t in ctx.textures], dtype=np.int64)
+    face_flags = texinfo_flags[ctx.tree.faces['texture_info'].astype(np.int64)]
+
+    # Order matters, e.g. sky faces can also be nodraw and water can also be translucent
+    ctx.face_classes = np.select(
+        [face_flags & SURF_SKY != 0,
+         face_flags & (SURF_NODRAW | SURF_HINT | SURF_SKIP) != 0,
+         face_flags & SURF_WARP != 0,
+         face_flags & (SURF_TRANS33 | SURF_TRANS66) != 0],
+        [FACE_CLASS_SKY, FACE_CLASS_NODRAW, FACE_CLASS_LIQUID, FACE_CLASS_TRANSLUCENT],
+        default=FACE_CLASS_SOLID)
+
+    counts = np.bincount(ctx.face_classes, minlength=len(FACE_CLASS_NAMES))
+    print("Face classes: " + ", ".join(f"{name}: {count}" for name, count in zip(FACE_CLASS_NAMES, counts)))
+
+
+def optimize_faces(ctx, weld_distance, apply_lightmaps, file_bytes=None):
+    """
+    Welds vertices closer than weld_distance, then merges neighbouring coplanar faces with the same texture info, which
+    the BSP compiler split up along the tree.  A merged face can only have 1 lightmap, so when lightmaps are applied,
+    lightmapped faces are only merged with faces of the same light styles whose lightmap is the very same single color
+    (from file_bytes).
+    """
+    coords, loop_vertices, loop_starts, loop_totals = ctx.vertices, ctx.loop_vertices, ctx.loop_starts, ctx.loop_totals
+    poly_faces = ctx.bsp_face_indices
+    verts_before, polys_before = len(coords), len(poly_faces)
+
+    coords, loop_vertices, loop_starts, loop_totals, kept_polys = weld_vertices(coords, loop_vertices, loop_starts, loop_totals, weld_distance)
+    poly_faces = poly_faces[kept_polys]
+
+    face_data = ctx.tree.faces[poly_faces]
+    poly_planes = face_data['plane'].astype(np.int64)
+    poly_groups = ((poly_planes * 2 + (face_data['plane_side'] != 0)) * len(ctx.textures)) + face_data['texture_info'].astype(np.int64)
+    poly_mergeable = np.ones(len(poly_faces), dtype=bool)
+    if apply_lightmaps:
+        lit_polys = np.flatnonzero(ctx.face_classes[poly_faces] == FACE_CLASS_SOLID)
+        lit_colors = np.full(len(poly_faces), -1, dtype=np.int64)
+        if file_bytes is not None:
+            lit_colors[lit_polys] = get_uniform_lightmap_colors(ctx, file_bytes, poly_faces[lit_polys])
+        poly_mergeable[lit_polys] = lit_colors[lit_polys] >= 0
+        styles = face_data['lightmap_styles'].astype(np.int64) @ (256 ** np.arange(4, dtype=np.int64))
+        keys = np.stack((poly_groups, lit_colors, np.where(lit_colors >= 0, styles, 0)), axis=1)
+        poly_groups = np.unique(keys, axis=0, return_inverse=True)[1].ravel()
+
+    loop_vertices, loop_starts, loop_totals, kept_polys = merge_coplanar_polygons(coords, loop_vertices, loop_starts, loop_totals,
+                                                                                  poly_groups, ctx.tree.plane_normals[poly_planes], poly_mergeable)
+    poly_faces = poly_faces[kept_polys]
+
+    # Vertices inside merged faces aren't used by anything anymore
+    used_verts, loop_vertices = np.unique(loop_vertices, return_inverse=True)
+    coords = coords[used_verts]
+
+    ctx.vertices = coords
+    ctx.loop_vertices, ctx.loop_starts, ctx.loop_totals = loop_vertices.ravel(), loop_starts, loop_totals
+    ctx.bsp_face_indices = poly_faces
+    print(f"Weld & merge: {verts_before} -> {len(ctx.vertices)} vertices, {polys_before} -> {len(ctx.bsp_face_indices)} polygons")
+
+
+def get_polygon_centers(ctx):
+    """
+    Average corner position of every polygon being imported, in BSP units.
+    """
+    return np.add.reduceat(ctx.vertices[ctx.loop_vertices], ctx.loop_starts, axis=0) / ctx.loop_totals[:, None]
+
+
+def get_entity_text(bytes, header):
+    return bytes[header.entity_offset : header.entity_offset + header.entity_length].decode('ascii')
+
+
+def parse_bsp_entities(text):
+    print("Parsing entity text into objects...")
+    entities = []
+    # Split text into blocks using curly braces
+    blocks = re.findall(r'\{([^}]*)\}', text)
+    for block in blocks:
+        entity = {}
+        # Parse each line in the block
+        for line in block.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            # Split on first space to get key and value
+            parts = line.split(None, 1)
+            if len(parts) == 2:
+                key, value = parts
+                # Remove surrounding quotes if present
+                key = key.strip('"')
+                value = value.strip('"')
+                entity[key] = value
+        if entity:
+            entities.append(entity)
+            # print(entity)
+    return entities
+
+
+def get_entity_origin(bytes, header, classnames):
+    """
+    Origin (in BSP units, unscaled) of the first entity matching one of the classnames, in order of preference.
+    """
+    entities = parse_bsp_entities(get_entity_text(bytes, header))
+    for classname in classnames:
+        for entity in entities:
+            if entity.get("classname") == classname and "origin" in entity:
+                return tuple(map(float, entity["origin"].split()))
+    return None
+
+
+def get_pvs_point(ctx, file_bytes, pvs_cull, model_scale, cursor):
+    """
+    Point (in BSP units) to cull visibility from, either the player start entity or the 3D cursor (its location, in scene units).
+    """
+    if pvs_cull == 'PLAYER_START':
+        return get_entity_origin(file_bytes, ctx.header, ["info_player_start", "info_player_deathmatch", "info_player_coop"])
+    elif pvs_cull == 'CURSOR':
+        # The map gets scaled by model_scale after import, so undo that to get back to BSP units
+        return tuple(coord / model_scale for coord in cursor)
+    return None
+
+
+def load_textures(ctx, bytes):
+    num_textures = len(bytes) / 76
+    for i in range(int(num_textures)):
+        unpacked_bytes = list(struct.unpack(f"<{'f'*8}II{'c'*32}i", bytes[76*i : 76*i+76]))
+        texture_info = bsp_texture_info(
+            u_axis = unpacked_bytes[0:3],
+            u_offset = unpacked_bytes[3],
+            v_axis = unpacked_bytes[4:7],
+            v_offset = unpacked_bytes[7],
+            flags = unpacked_bytes[8],
+            value = unpacked_bytes[9],
+            texture_name = b''.join([byte for byte in unpacked_bytes[10:42] if byte != b'\x00']).decode('utf-8'),
+            next_texinfo = unpacked_bytes[42]
+        )
+
+        ctx.textures.append(texture_info)
+
+    # Resolve the texture animations once, all frames of an animation share one material
+    ctx.animation_chains, ctx.texinfo_chains = get_animation_chains([t.next_texinfo for t in ctx.textures])
+    for chain in ctx.animation_chains:
+        print(f"Texture animation: {[ctx.textures[frame].texture_name for frame in chain]}")
+
+
+def compute_uvs(ctx):
+    """
+    Texture UV of every loop, from the texture info axes of its face, all at once:
+    u = (position . u_axis + u_offset) / texture width, v likewise, flipped for Blender.
+    """
+    texinfo_axes = np.array([(*t.u_axis, t.u_offset, *t.v_axis, t.v_offset) for t in ctx.textures], dtype=np.float64).reshape(-1, 8)
+    texinfo_sizes = np.zeros((len(ctx.textures), 2), dtype=np.float64)
+    for texture_idx, texture in enumerate(ctx.textures):
+        texture_res = ctx.texture_resolution_dict.get(texture.texture_name)
+        if texture_res:
+            texinfo_sizes[texture_idx] = texture_res
+
+    unsized = set(np.flatnonzero(texinfo_sizes[:, 0] == 0).tolist()) & get_used_texture_infos(ctx)
+    for texture_idx in sorted(unsized):
+        print(f"Skipping {ctx.textures[texture_idx].texture_name} (may be .atd file or non-image)")
+
+    loop_texinfos = np.repeat(ctx.faces['texture_info'][ctx.bsp_face_indices].astype(np.int64), ctx.loop_totals)
+    axes = texinfo_axes[loop_texinfos]
+    coords = ctx.vertices[ctx.loop_vertices]
+
+    bsp_u = np.einsum('ij,ij->i', coords, axes[:, 0:3]) + axes[:, 3]
+    bsp_v = np.einsum('ij,ij->i', coords, axes[:, 4:7]) + axes[:, 7]
+
+    # Loops of textures without a resolution are left at (0, 0)
+    sizes = texinfo_sizes[loop_texinfos]
+    sized = sizes[:, 0] > 0
+    uvs = np.zeros((len(loop_texinfos), 2), dtype=np.float32)
+    uvs[sized, 0] = bsp_u[sized] / sizes[sized, 0]
+    uvs[sized, 1] = 1 - bsp_v[sized] / sizes[sized, 1]    # Invert y-axis for Blender
+    ctx.uvs = uvs
+
+
+def get_wal_pixels(wal_object):
+    """
+    RGBA bytes of a decoded WAL, (height, width, 4).
+    """
+    with wal_object.image as pil_img:
+        return np.asarray(pil_img.convert('RGBA'), dtype=np.uint8)
+
+
+def write_cached_wal(image_name, data, mip_level, cache_dir):
+    """
+    Decodes a WAL to a PNG in the cache folder, unless it's there already.  Returns the PNG's path.
+    The file name has the WAL's content hash, so a changed WAL gets a new file, and the same WAL in another map reuses it.
+    """
+    safe_name = re.sub(r'[^\w.-]', '_', image_name)
+    cache_path = os.path.join(cache_dir, f"{safe_name}.{hash_bytes(data)}.mip{mip_level}.png")
+
+    if not os.path.isfile(cache_path):
+        os.makedirs(cache_dir, exist_ok=True)
+        wal_object = wal_image(data, mip_level)
+        # Maps imported side by side (see batch_import) can write the same texture at once, so nobody may see it half written
+        temp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with wal_object.image as pil_img:
+            # Same row order as the packed pixels (see set_wal_pixels), so both look the same with the same UVs
+            pil_img.transpose(Image.FLIP_TOP_BOTTOM).save(temp_path, format='PNG')
+        os.replace(temp_path, cache_path)
+    return cache_path
+
+
+def get_texture_search_folder(ctx, search_from_parent):
+    # For Quake/Quake II, the default folder layout often places the .BSP files in a folder adjacent the textures,
+    # instead of in a subfolder.  This option allows searching from the parent folder to find those textures.
+    if search_from_parent:
+        return str(Path(ctx.folder_path).parent)
+    return ctx.folder_path
+
+
+TEXTURE_EXTENSIONS = ['.tga','.png','.bmp','.jpg','.wal']
+
+
+def find_texture_files(texture_search_folder):
+    """
+    Every texture file under the search folder, casefolded path -> actual path.
+    """
+    file_paths = []
+
+    print(f"Searching for appropriate texture image files in: {texture_search_folder}")
+    for root, dirs, files in os.walk(texture_search_folder):
+        for file in files:
+            if any(file.endswith(ext.casefold()) for ext in TEXTURE_EXTENSIONS):
+                file_paths.append(os.path.join(root, file))
+
+    return {file_path.casefold(): file_path for file_path in file_paths}
+
+
+def resolve_texture(ctx, texture_name, texture_search_folder):
+    """
+    Where a texture comes from: (path, PAK member).  Loose files come first, then the PAKs (ctx.paks), if any.
+    For PAK members, the path is the PAK's path followed by the member name.  ("", None) if it wasn't found.
+    Sources already known (from an import cache) are used as long as they still exist, the search folder is only listed
+    (once) when something actually has to be looked up.
+    """
+    if texture_name in ctx.texture_source_dict:
+        path, pak_member = ctx.texture_source_dict[texture_name]
+        if pak_member and ctx.paks and ctx.paks.find(pak_member):
+            return ctx.paks.get_path(pak_member), pak_member
+        elif not pak_member and os.path.isfile(path):
+            return path, None
+        del ctx.texture_source_dict[texture_name]
+
+    if ctx.texture_file_paths is None:
+        ctx.texture_file_paths = find_texture_files(texture_search_folder)
+
+    texture_name_casefold = texture_name.casefold()
+    for casefolded_path, original_path in ctx.texture_file_paths.items():
+        if texture_name_casefold.replace('\\','/') in casefolded_path.replace('\\','/'):
+            ctx.texture_source_dict[texture_name] = (original_path, "")
+            return original_path, None
+
+    # Not extracted: read it straight out of the PAKs instead
+    pak_member = ctx.paks.find_texture(texture_name, TEXTURE_EXTENSIONS) if ctx.paks else None
+    if pak_member:
+        ctx.texture_source_dict[texture_name] = (ctx.paks.index[pak_member].path, pak_member)
+        return ctx.paks.get_path(pak_member), pak_member
+    return "", None
+
+
+def read_texture_size(path, data=None):
+    """
+    Width and height of a texture from its header only, without decoding any pixels
+    (PIL doesn't read the pixels until they're asked for).
+    """
+    if path.casefold().endswith('.wal'):
+        if data is None:
+            with open(path, "rb") as f:
+                data = f.read(WAL_HEADER_SIZE)
+        return tuple(read_wal_size(data))
+    with PIL.Image.open(io.BytesIO(data) if data is not None else path) as pil_img:
+        return pil_img.size
+
+
+def get_texture_sizes(ctx, search_from_parent):
+    """
+    Resolves every texture used and reads just its size from the file header, which is all the UVs need, without bpy.
+    For geometry only imports, that's all: no images are created, the materials get the resolved paths instead (see create_materials).
+    """
+    texture_search_folder = get_texture_search_folder(ctx, search_from_parent)
+    used_texture_infos = get_used_texture_infos(ctx)
+
+    for i, t in enumerate(ctx.textures):
+        if i not in used_texture_infos or t.texture_name in ctx.texture_resolution_dict:
+            continue
+        actual_texture_path, pak_member = resolve_texture(ctx, t.texture_name, texture_search_folder)
+        try:
+            if not actual_texture_path:
+                print(f"ERROR: {t.texture_name}, index {i} not found (actual_texture_path blank)")
+                continue
+            ctx.texture_resolution_dict[t.texture_name] = read_texture_size(actual_texture_path, ctx.paks.read(pak_member) if pak_member else None)
+        except Exception as e:
+            print(f"ERROR reading size of {t.texture_name}, attempted path: {actual_texture_path}")
+            print(f"Exception: {e}")
+
+    print(f"Read {len(ctx.texture_resolution_dict)} texture sizes from their file headers")
+
+
+def read_texture_data(ctx, path, pak_member):
+    if pak_member:
+        return ctx.paks.read(pak_member)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def decode_textures(ctx, texture_mip=0, texture_cache_dir=None, skip_names=()):
+    """
+    Decodes the WAL textures ahead of creating their images, without bpy, e.g. in a background thread: to ctx.decoded_textures,
+    or with texture_cache_dir straight to their cached PNG files.  Textures in skip_names (e.g. already in the file) are left alone.
+    Other formats are loaded by Blender itself.  Yields (textures done, total) as it goes.
+    """
+    names = sorted({t.texture_name for t in ctx.textures if t.texture_name in ctx.texture_source_dict and t.texture_name not in skip_names})
+    for done, texture_name in enumerate(names):
+        yield done, len(names)
+        path, pak_member = ctx.texture_source_dict[texture_name]
+        if not (pak_member or path).casefold().endswith('.wal'):
+            continue
+        try:
+            data = read_texture_data(ctx, path, pak_member)
+            if texture_cache_dir:
+                write_cached_wal(texture_name, data, texture_mip, texture_cache_dir)
+            else:
+                wal_object = wal_image(data, texture_mip)
+                pixels = get_wal_pixels(wal_object)
+                wal_object.image = wal_object.image_rgb = None      # Only the sizes are needed from here on
+                ctx.decoded_textures[texture_name] = (wal_object, pixels)
+            data = None
+        except Exception as e:
+            print(f"ERROR decoding {texture_name} ({path}): {e}")
+    yield len(names), len(names)
+
+
+def get_texture_pixels(ctx, texture_name, texture_mip=0):
+    """
+    RGBA bytes (height, width, 4) of a texture, rows in the order its own image gets them (see load_texture_images):
+    WALs and PAK members as decoded, files Blender loads itself bottom row first.  Decoded WALs are taken off ctx.decoded_textures.
+    """
+    path, pak_member = ctx.texture_source_dict[texture_name]
+    decoded = ctx.decoded_textures.pop(texture_name, None)
+    if decoded and decoded[0].mip_level == texture_mip:
+        return decoded[1]
+    data = read_texture_data(ctx, path, pak_member)
+    if (pak_member or path).casefold().endswith('.wal'):
+        return get_wal_pixels(wal_image(data, texture_mip))
+    with PIL.Image.open(io.BytesIO(data)) as pil_img:
+        pixels = np.asarray(pil_img.convert('RGBA'), dtype=np.uint8)
+    return pixels if pak_member else pixels[::-1]
+
+
+def pack_texture_atlas(ctx, texture_mip=0, max_size=atlas_max_width, gutter=2):
+    """
+    Packs the textures into as few atlas pages (max_size square at most) as fit them, so the map needs a material per page
+    instead of one per texture.  Every texture gets a gutter of its own wrapped edges, so filtering at a tile's border
+    blends in the texture itself.  Textures lit and unlit (sky, liquids...) go on separate pages, only lit pages get the lightmap.
+    Animated textures keep their own images and materials, as do ones that don't fit a page.
+    Results go on the import context: texture_atlases (pages, rows bottom first), texture_atlas_rects (texture -> page and
+    (u, v) offset and scale of its tile); repeating UVs inside a tile is up to the material (see create_atlas_material).
+    """
+    texinfos = ctx.faces['texture_info'][ctx.bsp_face_indices].astype(np.int64)
+    lit_texinfos = set(np.unique(texinfos[ctx.face_classes[ctx.bsp_face_indices] == FACE_CLASS_SOLID]).tolist())
+    groups = {True: {}, False: {}}      # lit -> texture -> pixels
+    for texture_idx in np.unique(texinfos).tolist():
+        texture_name = ctx.textures[texture_idx].texture_name
+        if ctx.texinfo_chains[texture_idx] >= 0 or texture_name not in ctx.texture_source_dict:
+            continue
+        groups[texture_idx in lit_texinfos][texture_name] = None
+    # A texture used both ways goes with the lit ones, like its own material would (see add_lightmap_nodes)
+    for texture_name in groups[True]:
+        groups[False].pop(texture_name, None)
+    for texture_idx, chain in enumerate(ctx.texinfo_chains):
+        if chain >= 0:
+            for group in groups.values():
+                group.pop(ctx.textures[texture_idx].texture_name, None)
+
+    ctx.texture_atlases = []
+    ctx.texture_atlas_rects = {}
+    for lit, group in groups.items():
+        for texture_name in list(group):
+            try:
+                pixels = get_texture_pixels(ctx, texture_name, texture_mip)
+                group[texture_name] = np.pad(pixels, ((gutter, gutter), (gutter, gutter), (0, 0)), mode='wrap')
+            except Exception as e:
+                print(f"ERROR reading {texture_name} for the texture atlas: {e}")
+                del group[texture_name]
+        if not group:
+            continue
+
+        names = list(group)
+        sizes = [(group[name].shape[1], group[name].shape[0]) for name in names]
+        area = sum(w * h for w, h in sizes)
+        positions, width, page_heights = pack_rows(sizes, max_size, math.ceil(math.sqrt(area)), max_size)
+        first_page = len(ctx.texture_atlases)
+        pages = [np.zeros((height, width, 4), dtype=np.uint8) for height in page_heights]
+        for texture_name, (w, h), position in zip(names, sizes, positions):
+            if position is None:
+                print(f"Texture {texture_name} ({w - 2 * gutter}x{h - 2 * gutter}) too large for the texture atlas; keeping it separate")
+                continue
+            page, x, y = position
+            pages[page][y : y + h, x : x + w] = group.pop(texture_name)
+            page_h = page_heights[page]
+            ctx.texture_atlas_rects[texture_name] = (first_page + page, (x + gutter) / width, (y + gutter) / page_h,
+                                                     (w - 2 * gutter) / width, (h - 2 * gutter) / page_h)
+        ctx.texture_atlases.extend(pages)
+        print(f"{len(names)} {'lit' if lit else 'unlit'} textures packed into {len(pages)} atlas page(s) of {width} wide")
+
+
+def triangulate_faces(ctx):
+    """
+    Fans every polygon into triangles, exact since BSP faces are convex.  Per loop arrays (UVs, lightmap UVs/colors) follow their
+    corners, the BSP face of every polygon (so its material and the bsp_face_index attribute) follows its triangles.
+    The brushes too, if any.
+    """
+    tri_loops, tri_polys = fan_triangulate(ctx.loop_starts, ctx.loop_totals)
+    loops = tri_loops.ravel()
+    print(f"Triangulating {len(ctx.loop_totals)} polygons into {len(tri_polys)} triangles")
+    ctx.loop_vertices = ctx.loop_vertices[loops]
+    if ctx.uvs is not None:
+        ctx.uvs = ctx.uvs[loops]
+    if ctx.lightmap_uvs is not None:
+        ctx.lightmap_uvs = ctx.lightmap_uvs[loops]
+    if ctx.lightmap_colors is not None:
+        ctx.lightmap_colors = ctx.lightmap_colors[loops]
+    ctx.bsp_face_indices = ctx.bsp_face_indices[tri_polys]
+    ctx.loop_totals = np.full(len(tri_polys), 3, dtype=np.int64)
+    ctx.loop_starts = np.arange(len(tri_polys), dtype=np.int64) * 3
+
+    brushes = ctx.brush_mesh
+    if brushes is not None:
+        tri_loops, tri_polys = fan_triangulate(brushes.loop_starts, brushes.loop_totals)
+        brushes.loop_vertices = brushes.loop_vertices[tri_loops.ravel()]
+        brushes.poly_brushes = brushes.poly_brushes[tri_polys]
+        brushes.poly_contents = brushes.poly_contents[tri_polys]
+        brushes.loop_totals = np.full(len(tri_polys), 3, dtype=np.int64)
+        brushes.loop_starts = np.arange(len(tri_polys), dtype=np.int64) * 3
+
+
+def preprocess_geometry(ctx, file_bytes, model_scale, apply_lightmaps, pvs_cull, region, area_import, areas, skip_nodraw,
+                        optimize_mesh, weld_distance, cursor=(0.0, 0.0, 0.0)):
+    """
+    The polygons to import, from the lumps: face loops and classes, then the face selections and the optional weld & merge.
+    """
+    ctx.tree = bsp_tree(file_bytes, ctx.header)
+    load_geometry(ctx)
+    classify_faces(ctx)
+
+    if skip_nodraw:
+        select_faces(ctx, np.flatnonzero(ctx.face_classes != FACE_CLASS_NODRAW))
+
+    if pvs_cull != 'NONE':
+        pvs_point = get_pvs_point(ctx, file_bytes, pvs_cull, model_scale, cursor)
+        if pvs_point is None:
+            print(f"No point found to cull visibility from ({pvs_cull}), importing all faces")
+        else:
+            select_faces(ctx, ctx.tree.get_visible_faces(pvs_point))
+
+    if region:
+        # Region is given in scene units (after scaling), like the 3D cursor
+        region_min, region_max = [[coord / model_scale for coord in corner] for corner in region]
+        print(f"Importing region {region_min} - {region_max}")
+        select_faces(ctx, ctx.tree.get_faces_in_box(np.minimum(region_min, region_max), np.maximum(region_min, region_max)))
+
+    if area_import == 'SELECTED':
+        selected_areas = parse_index_list(areas)
+        print(f"Importing areas: {sorted(selected_areas)}")
+        face_areas = ctx.tree.get_face_areas()
+        select_faces(ctx, np.flatnonzero(np.isin(face_areas, list(selected_areas))))
+
+    if optimize_mesh:
+        optimize_faces(ctx, weld_distance, apply_lightmaps, file_bytes)
+
+
+class import_cancelled(Exception):
+    pass
+
+
+class bsp_preprocessor(object):
+    """
+    Everything an import does before creating datablocks: parsing, faces, texture search and decoding, UVs, lightmap extraction
+    and packing, the import cache.  What it needs from Blender (3D cursor, the previous import's keys, folders...) is filled
+    in first by bsp_import_job.prepare(), then preprocess() runs anywhere: the main thread, a background thread, or a worker
+    process (it pickles, see preprocess_in_worker).
+    stage and progress (0-1) tell how far it got, cancel() stops it at the next stage.
+    """
+
+    def __init__(self, bsp_path, options):
+        self.bsp_path = bsp_path
+        self.options = replace(options)     # Own copy, some options get adjusted to the file
+        self.ctx = None
+        self.file_bytes = None
+        self.stage = ""
+        self.progress = 0.0
+        self.cancel_requested = threading.Event()
+        self.memory = stage_memory_log()
+
+        # Filled in from Blender, see bsp_import_job.prepare()
+        self.split_requested = False
+        self.cursor = (0.0, 0.0, 0.0)
+        self.previous_keys = None           # (lump hashes, geometry key, lighting key) of the import being updated, if any
+        self.texture_cache_dir = None
+        self.import_cache_dir = None
+        self.existing_images = set()        # Textures these are already loaded for aren't decoded ahead, they're most likely reused
+
+        # Set by preprocess()
+        self.lump_hashes = None
+        self.geometry_key = None
+        self.lighting_key = None
+        self.geometry_changed = self.lighting_changed = True
+        self.build_lightmaps = False
+
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["cancel_requested"]
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.cancel_requested = threading.Event()
+
+
+    def cancel(self):
+        self.cancel_requested.set()
+
+
+    def set_stage(self, stage, progress):
+        self.set_progress(progress)
+        self.stage = stage
+        self.memory.begin(stage)
+        print(f"{self.ctx.name}: {stage}...")
+
+
+    def set_progress(self, progress):
+        if self.cancel_requested.is_set():
+            raise import_cancelled(f"Import of {self.ctx.name} cancelled")
+        self.progress = progress
+
+
+    def open_paks(self):
+        ctx, opts = self.ctx, self.options
+        if opts.pak_map:
+            ctx.paks = pak_collection.from_folder(ctx.folder_path)
+        elif opts.use_paks:
+            ctx.paks = pak_collection.from_folder(get_texture_search_folder(ctx, opts.search_from_parent))
+
+
+    def preprocess(self):
+        ctx, opts = self.ctx, self.options
+        self.set_stage("Reading map", 0.0)
+        self.open_paks()
+        if opts.pak_map:
+            pak_member = ctx.paks.find_map(opts.pak_map)
+            if not pak_member:
+                raise FileNotFoundError(f"{opts.pak_map} not found in the PAK files in {ctx.folder_path}")
+            print(f"Reading {pak_member} from {ctx.paks.get_path(pak_member)}")
+            # The tree keeps views on the BSP, so copy it out rather than keeping the PAK mapped for the whole import
+            self.file_bytes = load_file(ctx, ctx.paks.get_path(pak_member), bytes(ctx.paks.read(pak_member)))
+        else:
+            self.file_bytes = load_file(ctx, self.bsp_path)
+        file_bytes = self.file_bytes
+
+        # Everything that decides what the mesh ends up as: the geometry lumps and the import options.
+        # Comparing these against the ones stored on a previous import tells what has to be rebuilt.
+        self.lump_hashes = hash_lumps(file_bytes, ctx.header)
+        polygons_key = hash_bytes(repr((sorted((name, h) for name, h in self.lump_hashes.items() if name not in NON_GEOMETRY_LUMPS),
+                                        opts.model_scale, opts.apply_transforms, opts.apply_lightmaps, opts.pvs_cull, opts.region,
+                                        opts.area_import, opts.areas, opts.skip_nodraw, opts.optimize_mesh, opts.weld_distance,
+                                        opts.texture_atlas,
+                                        # Which lit faces get merged depends on their lightmaps
+                                        self.lump_hashes["lightmaps"] if opts.optimize_mesh and opts.apply_lightmaps else None,
+                                        self.lump_hashes["entity"] if opts.pvs_cull == 'PLAYER_START' else None,
+                                        self.cursor if opts.pvs_cull == 'CURSOR' else None)).encode())
+        lighting = (self.lump_hashes["lightmaps"], opts.lightmap_influence, opts.collapse_uniform_lightmaps,
+                    opts.lightmap_mode, opts.smooth_vertex_lightmaps)
+        self.geometry_key = hash_bytes(repr((polygons_key, opts.triangulate)).encode())
+        self.lighting_key = hash_bytes(repr((self.geometry_key,) + lighting).encode())
+        # The import cache holds the polygons from before triangulating, so one snapshot serves both
+        snapshot_key = hash_bytes(repr((polygons_key,) + lighting).encode())
+
+        self.geometry_changed = self.lighting_changed = True
+        if self.previous_keys:
+            previous_hashes, previous_geometry_key, previous_lighting_key = self.previous_keys
+            changed_lumps = [name for name, h in self.lump_hashes.items() if previous_hashes.get(name) != h]
+            self.geometry_changed = previous_geometry_key != self.geometry_key
+            self.lighting_changed = previous_lighting_key != self.lighting_key
+            print(f"Updating existing import: {ctx.name}, changed lumps: {changed_lumps or 'none'}, "
+                  f"rebuilding mesh: {self.geometry_changed}, rebuilding lightmaps: {opts.apply_lightmaps and self.lighting_changed}")
+
+        load_textures(ctx, file_bytes[ctx.header.texture_info_offset : ctx.header.texture_info_offset+ctx.header.texture_info_length])
+
+        cache_path = None
+        cached = None
+        if opts.use_import_cache:
+            cache_key = get_import_cache_key(snapshot_key, get_texture_search_folder(ctx, opts.search_from_parent), opts.use_paks)
+            cache_path = get_import_cache_path(self.import_cache_dir, ctx.name, cache_key)
+            cached = load_import_cache(cache_path)
+
+        if cached:
+            # Straight to creating the mesh
+            cached_texture_sizes = restore_import_cache(ctx, cached)
+            if self.split_requested:
+                # Splitting goes by the tree's areas/nodes
+                ctx.tree = bsp_tree(file_bytes, ctx.header)
+        else:
+            self.set_stage("Building faces", 0.1)
+            preprocess_geometry(ctx, file_bytes, opts.model_scale, opts.apply_lightmaps, opts.pvs_cull, opts.region, opts.area_import,
+                                opts.areas, opts.skip_nodraw, opts.optimize_mesh, opts.weld_distance, self.cursor)
+
+        self.set_stage("Finding textures", 0.3)
+        get_texture_sizes(ctx, opts.search_from_parent)
+        if not opts.geometry_only and not opts.low_memory:
+            # Low memory imports decode every texture right when creating its image instead, so only one is ever held
+            self.set_stage("Decoding textures", 0.35)
+            for done, total in decode_textures(ctx, opts.texture_mip, self.texture_cache_dir, self.existing_images):
+                self.set_progress(0.35 + 0.2 * done / max(total, 1))
+
+        # The cached UVs are only good for the texture sizes they were made with
+        texture_sizes = {name: tuple(int(x) for x in size) for name, size in ctx.texture_resolution_dict.items()}
+        cache_outdated = not cached or cached_texture_sizes != texture_sizes
+        if cache_outdated:
+            compute_uvs(ctx)
+
+        if opts.texture_atlas and not opts.geometry_only:
+            self.set_stage("Packing texture atlas", 0.55)
+            pack_texture_atlas(ctx, opts.texture_mip)
+
+        self.build_lightmaps = opts.apply_lightmaps and self.lighting_changed
+        if self.build_lightmaps and opts.lightmap_mode == 'VERTEX':
+            if ctx.lightmap_colors is None:
+                self.set_stage("Baking lightmaps", 0.55)
+                bake_vertex_lightmaps(ctx, file_bytes, opts.smooth_vertex_lightmaps)
+        elif self.build_lightmaps and ctx.lightmap_pixels is None:
+            self.set_stage("Packing lightmaps", 0.55)
+            pack_lightmap_atlas(ctx, file_bytes, opts.collapse_uniform_lightmaps)
+
+        if opts.import_brushes:
+            self.set_stage("Building brushes", 0.6)
+            ctx.brush_mesh = build_brush_mesh(file_bytes, ctx.header, opts.brush_contents)
+
+        if cache_path and cache_outdated and (self.build_lightmaps or not opts.apply_lightmaps):
+            self.set_stage("Saving import cache", 0.65)
+            save_import_cache(cache_path, ctx)
+        if opts.triangulate:
+            # After saving, the snapshot keeps the polygons either way
+            triangulate_faces(ctx)
+        if opts.low_memory:
+            self.release_intermediates()
+        self.set_progress(0.7)
+
+
+    def release_intermediates(self):
+        """
+        Low memory imports: lets go of everything building the objects doesn't need, as soon as preprocessing is done.
+        The faces are copied out of the file, so the file can go too, unless the entities or splitting need it later.
+        """
+        ctx = self.ctx
+        ctx.faces = ctx.faces.copy()
+        if not self.split_requested:
+            ctx.tree = None
+            if not self.options.show_entities:
+                self.file_bytes = None
+
+
+def preprocess_in_worker(preprocessor):
+    """
+    Runs in a worker process (see batch_import): preprocesses a map and sends it back.  Its PAKs stay behind (see
+    bsp_import_context), the import job reopens them for building.
+    """
+    try:
+        preprocessor.preprocess()
+    except import_cancelled:
+        raise
+    except Exception as e:
+        print(f"ERROR loading .BSP file: {e}")
+        traceback.print_exc()
+        raise
+    finally:
+        if preprocessor.ctx.paks:
+            preprocessor.ctx.paks.close()
+    return preprocessor
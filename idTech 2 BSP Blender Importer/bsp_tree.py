@@ -0,0 +1,331 @@
+import struct
+import numpy as np
+
+from .custom_types import *
+from .utils import expand_ranges
+
+
+def load_lump_array(bytes, offset, length, dtype):
+    """
+    Reads a lump of fixed size records as a numpy structured array.
+    This is a view on the file bytes, nothing is copied.
+    """
+    return np.frombuffer(bytes, dtype=dtype, count=length // dtype.itemsize, offset=offset)
+
+
+def load_bsp_tree(path):
+    """
+    Builds the tree straight from a .bsp file, for scripted spatial queries without importing anything, e.g.:
+        tree = load_bsp_tree("maps/base1.bsp")
+        hit = tree.raycast((0, 0, 64), (0, 0, -1))
+    """
+    with open(path, "rb") as f:
+        bytes = f.read()
+    return bsp_tree(bytes, bsp_header(*struct.unpack(f"<{'i'*40}", bytes[:160])))
+
+
+class bsp_tree(object):
+    """
+    The "logical" part of the BSP: planes, nodes, leafs, the leaf->face table and the visibility (PVS) lump.
+    None of this is needed to build the mesh, but it allows answering "what can be seen from here?" type questions,
+    as well as spatial ones (which leaf is a point in, which faces are in a box, what does a ray hit) without a Blender BVH.
+    All positions are in BSP units.
+    """
+
+    def __init__(self, bytes, header):
+        self.planes = load_lump_array(bytes, header.planes_offset, header.planes_length, bsp_plane_dtype)
+        self.nodes = load_lump_array(bytes, header.nodes_offset, header.nodes_length, bsp_node_dtype)
+        self.leafs = load_lump_array(bytes, header.leaf_offset, header.leaf_length, bsp_leaf_dtype)
+        self.leaf_faces = load_lump_array(bytes, header.leaf_face_table_offset, header.leaf_face_table_length, np.dtype('<u2'))
+
+        # Face geometry, for refining box queries and finding which face a ray hit
+        self.faces = load_lump_array(bytes, header.faces_offset, header.faces_length, bsp_face_dtype)
+        self.vertices = load_lump_array(bytes, header.vertices_offset, header.vertices_length, np.dtype('<f4')).reshape(-1, 3)
+        self.edges = load_lump_array(bytes, header.edge_offset, header.edge_length, np.dtype('<u2')).reshape(-1, 2)
+        self.face_edges = load_lump_array(bytes, header.face_edge_table_offset, header.face_edge_table_length, np.dtype('<i4'))
+        self.build_face_loops()
+
+        # Areas are groups of leafs (e.g. a building), connected to each other through area portals (usually doors)
+        self.areas = load_lump_array(bytes, header.areas_offset, header.areas_length, bsp_area_dtype)
+        self.area_portals = load_lump_array(bytes, header.area_portals_offset, header.area_portals_length, bsp_area_portal_dtype)
+
+        # Flattened copies for walking the tree, indexing a structured array per node is slow
+        self.plane_normals = self.planes['normal'].astype(np.float64)
+        self.plane_distances = self.planes['distance'].astype(np.float64)
+        self.node_planes = self.nodes['plane'].astype(np.int64)
+        self.node_children = np.stack((self.nodes['front_child'], self.nodes['back_child']), axis=1).astype(np.int64)
+
+        # Visibility lump: number of clusters, then a (PVS offset, PHS offset) pair per cluster.
+        # Offsets are relative to the start of the lump.
+        self.visibility = bytes[header.visibility_offset : header.visibility_offset + header.visibility_length]
+        self.num_clusters = 0
+        self.vis_offsets = np.zeros((0, 2), dtype=np.int64)
+        if len(self.visibility) >= 4:
+            self.num_clusters = struct.unpack("<i", self.visibility[:4])[0]
+            self.vis_offsets = np.frombuffer(self.visibility, dtype='<i4', count=self.num_clusters * 2, offset=4).reshape(-1, 2)
+
+        print(f"BSP tree: {len(self.planes)} planes, {len(self.nodes)} nodes, {len(self.leafs)} leafs, {self.num_clusters} clusters")
+
+
+    def build_face_loops(self):
+        """
+        Vertex indices of every face as one flat loop array (like Blender's mesh loops), plus the start/count per face.
+        A negative face edge is walked from its 2nd vertex, so the loop is the first vertex of each directed edge.
+        """
+        self.loop_totals = self.faces['num_edges'].astype(np.int64)
+        self.loop_starts = np.cumsum(self.loop_totals) - self.loop_totals
+
+        face_edges = self.face_edges[expand_ranges(self.faces['first_edge'], self.loop_totals)]
+        self.loop_vertices = self.edges[np.abs(face_edges), (face_edges < 0).astype(np.int64)].astype(np.int64)
+
+        # Per face bounding boxes, faces without edges get an empty (inverted) box
+        self.face_mins = np.full((len(self.faces), 3), np.inf)
+        self.face_maxs = np.full((len(self.faces), 3), -np.inf)
+        has_loop = self.loop_totals > 0
+        if has_loop.any():
+            loop_coords = self.vertices[self.loop_vertices]
+            self.face_mins[has_loop] = np.minimum.reduceat(loop_coords, self.loop_starts[has_loop], axis=0)
+            self.face_maxs[has_loop] = np.maximum.reduceat(loop_coords, self.loop_starts[has_loop], axis=0)
+
+
+    def find_leaf(self, point):
+        """
+        Walks down from the root node to the leaf containing the point (in BSP units).
+        """
+        point = np.asarray(point, dtype=np.float64)
+        node = 0
+        while node >= 0:
+            plane = self.node_planes[node]
+            distance = self.plane_normals[plane] @ point - self.plane_distances[plane]
+            node = self.node_children[node, 0 if distance >= 0 else 1]
+        return -(node + 1)
+
+
+    def find_leafs(self, points):
+        """
+        Same as find_leaf, for an (N, 3) array of points at once.  Every step moves all points still in a node down one level.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        nodes = np.zeros(len(points), dtype=np.int64)
+        active = np.flatnonzero(nodes >= 0)
+        while len(active):
+            planes = self.node_planes[nodes[active]]
+            distances = np.einsum('ij,ij->i', self.plane_normals[planes], points[active]) - self.plane_distances[planes]
+            nodes[active] = self.node_children[nodes[active], (distances < 0).astype(np.int64)]
+            active = active[nodes[active] >= 0]
+        return -(nodes + 1)
+
+
+    def find_nodes_at_depth(self, points, depth):
+        """
+        Like find_leafs, but stops depth levels below the root, returning the node each point is in at that level.
+        Points reaching a leaf before that get the (negative) leaf child value instead, like the node children do.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        nodes = np.zeros(len(points), dtype=np.int64)
+        active = np.flatnonzero(nodes >= 0)
+        for _ in range(depth):
+            if not len(active):
+                break
+            planes = self.node_planes[nodes[active]]
+            distances = np.einsum('ij,ij->i', self.plane_normals[planes], points[active]) - self.plane_distances[planes]
+            nodes[active] = self.node_children[nodes[active], (distances < 0).astype(np.int64)]
+            active = active[nodes[active] >= 0]
+        return nodes
+
+
+    def find_leafs_in_box(self, box_min, box_max):
+        """
+        Leafs touching an axis aligned box, walking only the parts of the node tree the box reaches.
+        """
+        box_min = np.asarray(box_min, dtype=np.float64)
+        box_max = np.asarray(box_max, dtype=np.float64)
+        leafs = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if node < 0:
+                leafs.append(-(node + 1))
+                continue
+
+            # Nearest and farthest box corners along the plane normal
+            plane = self.node_planes[node]
+            normal = self.plane_normals[plane]
+            near = np.where(normal >= 0, box_min, box_max) @ normal - self.plane_distances[plane]
+            far = np.where(normal >= 0, box_max, box_min) @ normal - self.plane_distances[plane]
+
+            if far >= 0:
+                stack.append(self.node_children[node, 0])
+            if near < 0:
+                stack.append(self.node_children[node, 1])
+        return np.array(leafs, dtype=np.int64)
+
+
+    def get_faces_in_box(self, box_min, box_max):
+        """
+        BSP face indices of the faces overlapping an axis aligned box.
+        Candidates come from the leafs the box touches, then get filtered by their own bounds.
+        """
+        candidates = self.get_leaf_faces(self.find_leafs_in_box(box_min, box_max)).astype(np.int64)
+        overlaps = np.all((self.face_mins[candidates] <= box_max) & (self.face_maxs[candidates] >= box_min), axis=1)
+        return candidates[overlaps]
+
+
+    def raycast(self, origin, direction, max_distance=1e6, contents_mask=CONTENTS_SOLID):
+        """
+        First point along a ray that enters a leaf with any of the contents_mask flags (solid walls by default).
+        Returns a dict with the hit 'point', 'distance', 'normal', 'leaf' and BSP 'face' index (-1 if it could not be determined),
+        or None if nothing was hit within max_distance.
+        """
+        origin = np.asarray(origin, dtype=np.float64)
+        direction = np.asarray(direction, dtype=np.float64)
+        direction = direction / np.linalg.norm(direction)
+
+        # Recursive walk of the segment through the tree, front to back.  Each entry is (node, t_start, t_end, entry_node),
+        # where entry_node is the node whose plane the segment crossed to get to this part of it.
+        stack = [(0, 0.0, float(max_distance), -1)]
+        while stack:
+            node, t_start, t_end, entry_node = stack.pop()
+            if node < 0:
+                leaf = -(node + 1)
+                if self.leafs['brush_or'][leaf] & contents_mask:
+                    return self.make_hit(origin, direction, t_start, entry_node, leaf)
+                continue
+
+            plane = self.node_planes[node]
+            normal = self.plane_normals[plane]
+            d_start = (origin + direction * t_start) @ normal - self.plane_distances[plane]
+            d_end = (origin + direction * t_end) @ normal - self.plane_distances[plane]
+
+            if d_start >= 0 and d_end >= 0:
+                stack.append((self.node_children[node, 0], t_start, t_end, entry_node))
+            elif d_start < 0 and d_end < 0:
+                stack.append((self.node_children[node, 1], t_start, t_end, entry_node))
+            else:
+                t_mid = t_start + (t_end - t_start) * d_start / (d_start - d_end)
+                near_side = 0 if d_start >= 0 else 1
+                # Pushed in reverse, so the near side is walked first
+                stack.append((self.node_children[node, 1 - near_side], t_mid, t_end, node))
+                stack.append((self.node_children[node, near_side], t_start, t_mid, entry_node))
+        return None
+
+
+    def make_hit(self, origin, direction, distance, entry_node, leaf):
+        point = origin + direction * distance
+        normal = np.zeros(3)
+        face = -1
+        if entry_node >= 0:
+            normal = self.plane_normals[self.node_planes[entry_node]].copy()
+            # Face the ray, not away from it
+            if normal @ direction > 0:
+                normal = -normal
+            first_face = int(self.nodes['first_face'][entry_node])
+            for fi in range(first_face, first_face + int(self.nodes['num_faces'][entry_node])):
+                if self.face_contains_point(fi, point, normal):
+                    face = fi
+                    break
+        return {'point': point, 'distance': float(distance), 'normal': normal, 'leaf': int(leaf), 'face': face}
+
+
+    def face_contains_point(self, fi, point, normal, epsilon=0.01):
+        """
+        Convex polygon test for a point lying on the face's plane.
+        """
+        start = self.loop_starts[fi]
+        corners = self.vertices[self.loop_vertices[start : start + self.loop_totals[fi]]].astype(np.float64)
+        if len(corners) < 3:
+            return False
+        edges = np.roll(corners, -1, axis=0) - corners
+        sides = np.cross(edges, point - corners) @ normal
+        return bool(np.all(sides >= -epsilon) or np.all(sides <= epsilon))
+
+
+    def decompress_vis(self, offset):
+        """
+        Decodes one run-length compressed visibility row into a boolean array with one entry per cluster.
+        A zero byte is followed by a count of zero bytes to emit, any other byte is copied as is.
+        Since the count is never 0, every zero byte in the data is a run marker, which lets this be done without a Python loop.
+        """
+        row_bytes = (self.num_clusters + 7) >> 3
+        # Worst case, a compressed row is 2 bytes per output byte (a run of 1 zero)
+        window = np.frombuffer(self.visibility[offset : offset + 2 * row_bytes], dtype=np.uint8)
+
+        is_run = window == 0
+        run_positions = np.flatnonzero(is_run)
+        run_positions = run_positions[run_positions + 1 < len(window)]
+
+        # How many bytes each position of the compressed data writes out
+        counts = np.where(is_run, 0, 1).astype(np.int64)
+        counts[run_positions] = window[run_positions + 1]
+        counts[run_positions + 1] = 0
+
+        # Only decode up to the end of this row, the window may run into the next one
+        stop = np.searchsorted(np.cumsum(counts), row_bytes) + 1
+        row = np.repeat(window[:stop], counts[:stop])[:row_bytes]
+        if len(row) < row_bytes:
+            row = np.pad(row, (0, row_bytes - len(row)))
+
+        return np.unpackbits(row, bitorder='little')[:self.num_clusters].astype(bool)
+
+
+    def cluster_pvs(self, cluster):
+        """
+        Clusters potentially visible from the given cluster.
+        If there is no visibility information, everything is considered visible, same as the engine does.
+        """
+        if cluster < 0 or self.num_clusters == 0:
+            return np.ones(max(self.num_clusters, 1), dtype=bool)
+        return self.decompress_vis(int(self.vis_offsets[cluster, 0]))
+
+
+    def get_leaf_faces(self, leaf_indices):
+        """
+        Unique BSP face indices referenced by the given leafs, through the leaf->face table.
+        """
+        leaf_indices = np.asarray(leaf_indices, dtype=np.int64)
+        table_positions = expand_ranges(self.leafs['first_leaf_face'][leaf_indices], self.leafs['num_leaf_faces'][leaf_indices])
+        return np.unique(self.leaf_faces[table_positions])
+
+
+    def get_face_areas(self):
+        """
+        Area of every BSP face, through the leafs that reference it.  A face shared by leafs of different areas goes to the lowest one.
+        Faces not referenced by any leaf (brush entities) get area 0, which is never a real area.
+        """
+        leaf_counts = self.leafs['num_leaf_faces'].astype(np.int64)
+        table_positions = expand_ranges(self.leafs['first_leaf_face'], leaf_counts)
+        table_areas = np.repeat(self.leafs['area'].astype(np.int64), leaf_counts)
+
+        face_areas = np.full(len(self.faces), np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(face_areas, self.leaf_faces[table_positions].astype(np.int64), table_areas)
+        face_areas[face_areas == np.iinfo(np.int64).max] = 0
+        return face_areas
+
+
+    def get_area_neighbours(self, area):
+        """
+        Areas directly connected to the given one through area portals.
+        """
+        if area <= 0 or area >= len(self.areas):
+            return []
+        first = int(self.areas['first_area_portal'][area])
+        portals = self.area_portals[first : first + int(self.areas['num_area_portals'][area])]
+        return sorted(set(int(other) for other in portals['other_area']))
+
+
+    def get_visible_faces(self, point):
+        """
+        BSP face indices in all the clusters potentially visible from the leaf containing the point.
+        """
+        leaf = self.find_leaf(point)
+        cluster = int(self.leafs['cluster'][leaf])
+        print(f"Point {tuple(point)} is in leaf {leaf}, cluster {cluster}")
+
+        leaf_clusters = self.leafs['cluster'].astype(np.int64)
+        if cluster < 0 or self.num_clusters == 0:
+            visible_leafs = np.arange(len(self.leafs))
+        else:
+            pvs = self.cluster_pvs(cluster)
+            visible_leafs = np.flatnonzero((leaf_clusters >= 0) & pvs[np.clip(leaf_clusters, 0, None)])
+
+        return self.get_leaf_faces(visible_leafs)
@@ -1,6 +1,7 @@
 from dataclasses import dataclass, fields
 from typing import List, Any
 from pathlib import Path
+import numpy as np
 
 
 ################# Data types are not always the "C" types, since shorts, etc... are meaningless in Python
@@ -132,6 +133,119 @@ class bsp_leaf:
 
 
 
+########## Content flags (leaf brush_or, brush contents) ############
+CONTENTS_SOLID = 1
+CONTENTS_WINDOW = 2
+CONTENTS_AUX = 4
+CONTENTS_LAVA = 8
+CONTENTS_SLIME = 16
+CONTENTS_WATER = 32
+CONTENTS_MIST = 64
+CONTENTS_PLAYERCLIP = 0x10000
+CONTENTS_MONSTERCLIP = 0x20000
+CONTENTS_ORIGIN = 0x1000000
+CONTENTS_DETAIL = 0x8000000
+CONTENTS_TRANSLUCENT = 0x10000000
+CONTENTS_LADDER = 0x20000000
+
+# Brush contents that can be picked for importing brushes
+BRUSH_CONTENTS = {
+    'SOLID': CONTENTS_SOLID,
+    'WINDOW': CONTENTS_WINDOW,
+    'LAVA': CONTENTS_LAVA,
+    'SLIME': CONTENTS_SLIME,
+    'WATER': CONTENTS_WATER,
+    'MIST': CONTENTS_MIST,
+    'PLAYERCLIP': CONTENTS_PLAYERCLIP,
+    'MONSTERCLIP': CONTENTS_MONSTERCLIP,
+    'LADDER': CONTENTS_LADDER,
+}
+
+
+########## Surface flags (texture info flags) ############
+SURF_LIGHT = 0x1            # Value will hold the light strength
+SURF_SLICK = 0x2
+SURF_SKY = 0x4              # Don't draw, but add to skybox
+SURF_WARP = 0x8             # Turbulent water warp
+SURF_TRANS33 = 0x10
+SURF_TRANS66 = 0x20
+SURF_FLOWING = 0x40         # Scroll towards angle
+SURF_NODRAW = 0x80          # Don't bother referencing the texture
+SURF_HINT = 0x100           # Make a primary bsp splitter
+SURF_SKIP = 0x200           # Completely ignore, allowing non-closed brushes
+
+# How faces are handled on import, from their surface flags
+FACE_CLASS_SOLID = 0
+FACE_CLASS_SKY = 1
+FACE_CLASS_LIQUID = 2
+FACE_CLASS_TRANSLUCENT = 3
+FACE_CLASS_NODRAW = 4       # Hint, skip, nodraw: never rendered by the engine
+FACE_CLASS_NAMES = ["Solid", "Sky", "Liquid", "Translucent", "NoDraw"]
+
+
+########## Array layouts of the "logical" lumps, same fields as above, read with np.frombuffer ############
+bsp_face_dtype = np.dtype([
+    ('plane', '<u2'),
+    ('plane_side', '<u2'),
+    ('first_edge', '<u4'),
+    ('num_edges', '<u2'),
+    ('texture_info', '<u2'),
+    ('lightmap_styles', 'u1', 4),
+    ('lightmap_offset', '<u4'),
+])
+
+bsp_plane_dtype = np.dtype([
+    ('normal', '<f4', 3),
+    ('distance', '<f4'),
+    ('type', '<i4'),
+])
+
+bsp_node_dtype = np.dtype([
+    ('plane', '<i4'),
+    ('front_child', '<i4'),     # NEGATIVE value indicates Leaf, leaf index is -(child + 1)
+    ('back_child', '<i4'),
+    ('bbox_min', '<i2', 3),
+    ('bbox_max', '<i2', 3),
+    ('first_face', '<u2'),
+    ('num_faces', '<u2'),
+])
+
+bsp_leaf_dtype = np.dtype([
+    ('brush_or', '<i4'),
+    ('cluster', '<i2'),
+    ('area', '<i2'),
+    ('bbox_min', '<i2', 3),
+    ('bbox_max', '<i2', 3),
+    ('first_leaf_face', '<u2'),
+    ('num_leaf_faces', '<u2'),
+    ('first_leaf_brush', '<u2'),
+    ('num_leaf_brushes', '<u2'),
+])
+
+
+bsp_brush_dtype = np.dtype([
+    ('first_side', '<i4'),      # Index of the first side (in the brush side array)
+    ('num_sides', '<i4'),
+    ('contents', '<i4'),        # CONTENTS_* flags
+])
+
+bsp_brush_side_dtype = np.dtype([
+    ('plane', '<u2'),           # Plane of the side, its normal points out of the brush
+    ('texture_info', '<i2'),
+])
+
+
+bsp_area_dtype = np.dtype([
+    ('num_area_portals', '<i4'),
+    ('first_area_portal', '<i4'),
+])
+
+bsp_area_portal_dtype = np.dtype([
+    ('portal_num', '<i4'),      # Index used by the game to open/close the portal (e.g. a door)
+    ('other_area', '<i4'),      # Area on the other side of the portal
+])
+
+
 @dataclass
 class bsp_header:
     magic_number: int           # Must be "IBSP" or 1347633737
@@ -196,46 +310,161 @@ class bsp_header:
 
 
 
-class BSP_OBJECT(object):
-    folder_path = ""
-    name = ""
-    obj = {}
-    mesh = {}
-    header = {}
-    vertices = list()
-    edges = list()
-    faces = list()
-    textures = list()
-
-    face_verts_list = list()
-    bsp_face_indices = list()
-
-    texture_obj_dict = dict()
-    material_texture_dict = dict()
-    texture_material_index_dict = dict()
-    texture_resolution_dict = dict()
-
-    animation_textures = list()
-    lightmap_images = list()
-    lightmap_atlas = {}
-
-    @classmethod
-    def reset(cls):
-        cls.folder_path = ""
-        cls.name = ""
-        cls.obj = {}
-        cls.mesh = {}
-        cls.header = {}
-        cls.vertices = []
-        cls.edges = []
-        cls.faces = []
-        cls.textures = []
-        cls.face_verts_list = []
-        cls.bsp_face_indices = []
-        cls.texture_obj_dict = {}
-        cls.material_texture_dict = {}
-        cls.texture_material_index_dict = {}
-        cls.texture_resolution_dict = {}
-        cls.animation_textures = []
-        cls.lightmap_images = []
-        cls.lightmap_atlas = {}
\ No newline at end of file
+@dataclass
+class bsp_import_options:
+    """
+    Every import option, as on the import operator.  Plain values only, so a set of options can be handed to a background thread.
+    """
+    model_scale: float = 0.01
+    apply_transforms: bool = True
+    search_from_parent: bool = False
+    apply_lightmaps: bool = False
+    lightmap_influence: int = 100
+    collapse_uniform_lightmaps: bool = False
+    lightmap_mode: str = 'ATLAS'
+    smooth_vertex_lightmaps: bool = False
+    show_entities: bool = False
+    pvs_cull: str = 'NONE'
+    region: Any = None                  # ((min x, y, z), (max x, y, z)) in scene units, or None
+    area_import: str = 'NONE'
+    areas: str = ""
+    skip_nodraw: bool = True
+    separate_special_faces: bool = False
+    optimize_mesh: bool = False
+    weld_distance: float = 0.01
+    chunk_mode: str = 'NONE'
+    chunk_size: float = 10.0
+    chunk_depth: int = 4
+    reimport: bool = False
+    shared_library: bool = False
+    use_paks: bool = True
+    pak_map: str = ""
+    texture_mip: int = 0
+    cache_textures: bool = False
+    texture_atlas: bool = False
+    texture_cache_dir: str = ""
+    geometry_only: bool = False
+    use_import_cache: bool = False
+    import_cache_dir: str = ""
+    low_memory: bool = False
+    import_brushes: bool = False
+    brush_contents: int = CONTENTS_SOLID | CONTENTS_WINDOW
+    triangulate: bool = False
+
+
+
+@dataclass
+class bsp_brush_mesh:
+    """
+    The convex volumes of a map's brushes as one mesh, in BSP units, laid out like bsp_import_context's geometry arrays.
+    """
+    vertices: np.ndarray
+    loop_vertices: np.ndarray
+    loop_starts: np.ndarray
+    loop_totals: np.ndarray
+    poly_brushes: np.ndarray        # Brush index of every polygon
+    poly_contents: np.ndarray       # CONTENTS_* flags of every polygon's brush
+
+
+
+class bsp_import_context(object):
+    """
+    State of one import.  A new one is created for every import and passed through the pipeline, so nothing is shared
+    between imports (several can run side by side, e.g. from a batch script), and release() drops the large parts once
+    the import is done.
+    The geometry is kept as flat numpy arrays, laid out like Blender's mesh loops:
+        vertices:                   (N, 3) coordinates, in BSP units
+        loop_vertices:              vertex index of every polygon corner
+        loop_starts, loop_totals:   first corner and number of corners of every polygon
+        bsp_face_indices:           BSP face every polygon came from
+    faces is the face lump as a bsp_face_dtype array, textures the (few) texture infos as bsp_texture_info.
+    uvs and lightmap_uvs are per loop, lightmap_pixels is the packed lightmap atlas (rows bottom up like Blender's image
+    pixels, RGBA bytes) and lit_faces the BSP faces that have a place in it.  Vertex color lightmaps (lightmap_colors) are
+    RGBA bytes per loop instead.
+    texture_atlases are the pages of the optional texture atlas (rows bottom up, RGBA bytes), texture_atlas_rects the page
+    and tile (u, v offset, u, v scale) of every texture in it.
+    """
+    __slots__ = ("folder_path", "name", "obj", "mesh", "header", "tree",
+                 "vertices", "faces", "textures", "loop_vertices", "loop_starts", "loop_totals", "bsp_face_indices", "face_classes",
+                 "lightmap_extents", "texture_obj_dict", "texture_resolution_dict", "texture_material_dict", "texture_source_dict", "texture_file_paths",
+                 "decoded_textures", "texture_atlases", "texture_atlas_rects",
+                 "animation_chains", "texinfo_chains", "uvs", "brush_mesh",
+                 "lightmap_pixels", "lightmap_uvs", "lightmap_colors", "lit_faces", "lightmap_atlas", "objects", "library", "paks")
+
+    def __init__(self, name="", folder_path=""):
+        self.folder_path = folder_path
+        self.name = name
+        self.obj = None
+        self.mesh = None
+        self.header = None
+        self.tree = None
+
+        self.vertices = np.zeros((0, 3), dtype=np.float64)
+        self.faces = np.zeros(0, dtype=bsp_face_dtype)
+        self.textures = []
+        self.loop_vertices = np.zeros(0, dtype=np.int64)
+        self.loop_starts = np.zeros(0, dtype=np.int64)
+        self.loop_totals = np.zeros(0, dtype=np.int64)
+        self.bsp_face_indices = np.zeros(0, dtype=np.int64)
+        self.face_classes = None
+        self.lightmap_extents = None        # (min s, min t, width, height) of every face's lightmap block, in samples
+
+        self.texture_obj_dict = {}
+        self.texture_resolution_dict = {}
+        self.texture_material_dict = {}
+        self.texture_source_dict = {}        # texture name -> (path, PAK member or "")
+        self.texture_file_paths = None      # Texture files in the search folder, only listed if something has to be looked up
+        self.decoded_textures = {}          # texture name -> (wal_image, RGBA pixels), decoded ahead of creating the image
+        self.texture_atlases = []
+        self.texture_atlas_rects = {}       # texture name -> (page, u offset, v offset, u scale, v scale)
+        self.animation_chains = []          # Frame texinfo indices of every texture animation
+        self.texinfo_chains = []            # Animation chain of every texinfo, -1 if not animated
+        self.uvs = None
+        self.brush_mesh = None              # bsp_brush_mesh, if brushes are imported
+
+        self.lightmap_pixels = None
+        self.lightmap_uvs = None
+        self.lightmap_colors = None
+        self.lit_faces = None
+        self.lightmap_atlas = None
+
+        self.objects = []
+        self.library = None
+        self.paks = None
+
+    # Not sent to or back from a worker process: open files (PAKs, and the tree's views on the map) and Blender datablocks
+    UNPICKLED_SLOTS = ("obj", "mesh", "tree", "lightmap_atlas", "objects", "library", "paks")
+
+    def __getstate__(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__ if slot not in self.UNPICKLED_SLOTS}
+
+    def __setstate__(self, state):
+        self.__init__()
+        for slot, value in state.items():
+            setattr(self, slot, value)
+
+    def release(self):
+        """
+        Drops the file data and arrays, keeping only the name and the created objects.
+        """
+        self.header = None
+        self.tree = None
+        self.vertices = self.faces = None
+        self.loop_vertices = self.loop_starts = self.loop_totals = self.bsp_face_indices = None
+        self.face_classes = self.lightmap_extents = None
+        self.textures = []
+        self.texture_obj_dict = {}
+        self.texture_resolution_dict = {}
+        self.texture_material_dict = {}
+        self.texture_source_dict = {}
+        self.texture_file_paths = None
+        self.decoded_textures = {}
+        self.texture_atlases = []
+        self.texture_atlas_rects = {}
+        self.uvs = None
+        self.brush_mesh = None
+        self.lightmap_pixels = self.lightmap_uvs = self.lightmap_colors = self.lit_faces = None
+        self.library = None
+        if self.paks:
+            self.paks.close()
+        self.paks = None
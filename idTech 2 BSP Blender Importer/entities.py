@@ -1,7 +1,7 @@
 import bpy
-import re
 import mathutils
-from .custom_types import BSP_OBJECT
+
+from .bsp_preprocess import get_entity_text, parse_bsp_entities
 
 
 _HANDLER_NAME = "entity_viewbillboard_handler"
@@ -111,41 +111,11 @@ def create_empty(location, text_string, name_empty, name_text, collection, text_
     # print(f"Created Empty '{name_empty}' at {location} and Text '{name_text}' with content: {text_string}")
 
 
-def get_entity_text(bytes):
-    return bytes[BSP_OBJECT.header.entity_offset : BSP_OBJECT.header.entity_offset + BSP_OBJECT.header.entity_length].decode('ascii')
-
-
-def parse_bsp_entities(text):
-    print("Parsing entity text into objects...")
-    entities = []
-    # Split text into blocks using curly braces
-    blocks = re.findall(r'\{([^}]*)\}', text)
-    for block in blocks:
-        entity = {}
-        # Parse each line in the block
-        for line in block.splitlines():
-            line = line.strip()
-            if not line:
-                continue
-            # Split on first space to get key and value
-            parts = line.split(None, 1)
-            if len(parts) == 2:
-                key, value = parts
-                # Remove surrounding quotes if present
-                key = key.strip('"')
-                value = value.strip('"')
-                entity[key] = value
-        if entity:
-            entities.append(entity)
-            # print(entity)
-    return entities
-
-
-def populate_entities(bytes, scale):
-    entity_text = get_entity_text(bytes)
+def populate_entities(bytes, header, map_name, scale):
+    entity_text = get_entity_text(bytes, header)
     entities = parse_bsp_entities(entity_text)
 
-    coll = get_or_create_collection(f"{BSP_OBJECT.name}_Entities")
+    coll = get_or_create_collection(f"{map_name}_Entities")
 
     for entity in entities:
         if "origin" in entity.keys():      # Only create entityes when we have a location to do so
@@ -157,4 +127,4 @@ def populate_entities(bytes, scale):
                     x, y, z = [coord * scale for coord in map(float, value.split())]
                     # print(f"X, Y, Z: {x,y,z}")
             if x and y and z:
-                create_empty((x,y,z), this_empty_text, f"Empty_{i}", f"Text_{i}", coll)
\ No newline at end of file
+                create_empty((x,y,z), this_empty_text, f"Empty_{i}", f"Text_{i}", coll)
@@ -1,523 +1,552 @@
 import bpy
-from dataclasses import dataclass, fields
-import struct
 import os
 import io
-import math
-import mathutils
+import threading
 
 import numpy as np
-from collections import defaultdict
-from pathlib import Path
 import traceback
 
 from .custom_types import *
 from .utils import *
 from .wal import *
-from .entities import populate_entities
+from .entities import populate_entities, get_or_create_collection
+from .bsp_tree import bsp_tree
+from .mesh_split import split_object, fill_mesh
+from .mesh_optimize import *
+from .texture_library import texture_library
+from .pak import pak_file
+from .bsp_animate import add_animation_frames
+from .bsp_preprocess import *
 
 import PIL
-from PIL import Image, ImagePath
+from PIL import Image
 
 
-SAMPLE_STEP = 16.0  # world units per lightmap sample
-pad = 0
-atlas_max_width = 4096
 use_closest_for_debug = False
-flip_v = True
+VERTEX_LIGHTMAP_ATTRIBUTE = "Lightmap"
+SURFACE_NODE_GROUP = "BSP Surface"
+SURFACE_NODE_NAME = "BSP_Surface"
+TEXTURE_NODE_NAME = "BSP_Texture"
+LIGHTMAP_SOURCE_NODES = ("LM_UVMap", "LM_Atlas_Tex", "LM_Color_Attribute")
+ATLAS_WRAP_NODE_GROUP = "BSP Atlas Wrap"
+ATLAS_OFFSET_ATTRIBUTE = "bsp_atlas_offset"
+ATLAS_SCALE_ATTRIBUTE = "bsp_atlas_scale"
 
 
-def build_all_face_lightmaps_in_memory(file_bytes):
-    BSP_OBJECT.lightmap_images = []  # list of dicts: {'fi': int, 'img': PIL.Image, 'w':int, 'h':int}
-    lm_base_offset = getattr(BSP_OBJECT.header, "lightmaps_offset", 0)
-    total_bytes = len(file_bytes)
+def create_and_assign_atlas_lightmap(ctx, influence_pct, reuse_existing=False):
+    """
+    Puts the packed atlas (see pack_lightmap_atlas) in Blender: the atlas image, the LightmapUV layer, and a multiply by the
+    atlas in the material of every lit face.
+    """
+    if ctx.lightmap_pixels is None:
+        print("No lightmap atlas on the import context; aborting.")
+        return
 
-    def get_vertex_pos(vidx):
-        v = BSP_OBJECT.vertices[vidx]
-        return (v.x, v.y, v.z)
+    atlas_name = f"{ctx.name}_atlas"
+    height, width = ctx.lightmap_pixels.shape[:2]
+    existing_atlas = bpy.data.images.get(atlas_name) if reuse_existing else None
+    if existing_atlas:
+        # Updating an existing import: the materials' atlas nodes keep pointing at the same image
+        ctx.lightmap_atlas = existing_atlas
+        if tuple(existing_atlas.size) != (width, height):
+            existing_atlas.scale(width, height)
+    else:
+        ctx.lightmap_atlas = bpy.data.images.new(atlas_name, width=width, height=height, alpha=True)
 
-    def dot3(a, b):
-        return a[0]*b.x + a[1]*b.y + a[2]*b.z
+    # Normalize pixel values (0-255 → 0.0-1.0) and assign them to the Blender image, straight to float32 without a float64 copy
+    ctx.lightmap_atlas.pixels.foreach_set(np.divide(ctx.lightmap_pixels, 255.0, dtype=np.float32).ravel())
 
-    for fi, face in enumerate(BSP_OBJECT.faces):
-        vert_indices = BSP_OBJECT.face_verts_list[fi]
-        if not vert_indices:
-            continue
+    # Pack the image to embed it in the .blend file
+    ctx.lightmap_atlas.pack()
 
-        texinfo = BSP_OBJECT.textures[face.texture_info]
+    # Multiply action needs to be linear, lightmap represents intensity, not actual "color"
+    ctx.lightmap_atlas.colorspace_settings.name = 'Non-Color'
+    if use_closest_for_debug:
+        try:
+            ctx.lightmap_atlas.use_alpha = True
+        except:
+            pass
 
-        s_vals = []
-        t_vals = []
-        for vidx in vert_indices:
-            vx, vy, vz = get_vertex_pos(vidx)
-            v = (vx, vy, vz)
-            s_real = dot3(v, bsp_vertex(*texinfo.u_axis)) - texinfo.u_offset
-            t_real = dot3(v, bsp_vertex(*texinfo.v_axis)) - texinfo.v_offset
-            s_vals.append(s_real / SAMPLE_STEP)
-            t_vals.append(t_real / SAMPLE_STEP)
+    # Create LightmapUV
+    mesh = ctx.mesh
+    lm_uv_name = "LightmapUV"
+    if lm_uv_name in mesh.uv_layers:
+        lm_uv = mesh.uv_layers[lm_uv_name]
+    else:
+        lm_uv = mesh.uv_layers.new(name=lm_uv_name)
+    mesh.uv_layers.active = lm_uv
+    lm_uv.data.foreach_set("uv", ctx.lightmap_uvs.ravel())
 
-        min_s = math.floor(min(s_vals))
-        max_s = math.ceil(max(s_vals))
-        min_t = math.floor(min(t_vals))
-        max_t = math.ceil(max(t_vals))
+    def add_atlas_nodes(nodes, links):
+        uv_map_node = nodes.new('ShaderNodeUVMap')
+        uv_map_node.name = "LM_UVMap"
+        uv_map_node.uv_map = lm_uv_name
 
-        width = int(max_s - min_s)
-        height = int(max_t - min_t)
+        atlas_tex = nodes.new('ShaderNodeTexImage')
+        atlas_tex.name = "LM_Atlas_Tex"
+        atlas_tex.image = ctx.lightmap_atlas
+        atlas_tex.extension = 'CLIP'
+        if use_closest_for_debug:
+            try:
+                atlas_tex.interpolation = 'Closest'
+            except:
+                pass
 
-        if width <= 0 or height <= 0:
-            print(f"Skipping face {fi}: degenerate lightmap size {width}x{height}")
-            continue
+        # Connect UV -> atlas_tex
+        links.new(uv_map_node.outputs['UV'], atlas_tex.inputs['Vector'])
+        return atlas_tex.outputs['Color']
 
-        byte_offset = lm_base_offset + face.lightmap_offset
-        expected_bytes = width * height * 3
-        if byte_offset < 0 or byte_offset + expected_bytes > total_bytes:
-            print(f"Face {fi}: invalid lightmap offset/size (offset={byte_offset}, bytes_needed={expected_bytes}), skipping")
-            continue
+    add_lightmap_nodes(ctx, influence_pct, "LM_Atlas_Tex", add_atlas_nodes)
+    print(f"Applied lightmap atlas ({width}x{height}), LightmapUV and patched materials. Atlas image: {ctx.lightmap_atlas.name}")
 
-        rgb_bytes = file_bytes[byte_offset: byte_offset + expected_bytes]
 
-        img = Image.frombytes('RGB', (width, height), rgb_bytes)
+def create_vertex_lightmap(ctx, influence_pct):
+    """
+    Puts the baked vertex lightmaps (see bake_vertex_lightmaps) in Blender, with no atlas: a "Lightmap" color attribute on the
+    face corners, set in one go, and a multiply by it in the material of every lit face.
+    """
+    if ctx.lightmap_colors is None:
+        print("No vertex lightmaps on the import context; aborting.")
+        return
 
-        # optionally flip vertically to match Quake rows
-        if flip_v:
-            img = img.transpose(Image.FLIP_TOP_BOTTOM)
+    mesh = ctx.mesh
+    if VERTEX_LIGHTMAP_ATTRIBUTE in mesh.attributes:
+        mesh.attributes.remove(mesh.attributes[VERTEX_LIGHTMAP_ATTRIBUTE])
+    # Bytes are plenty for lightmaps, and take a quarter of the memory of float colors.  Lightmaps are intensities, set as they are.
+    attribute = mesh.attributes.new(name=VERTEX_LIGHTMAP_ATTRIBUTE, type='BYTE_COLOR', domain='CORNER')
+    attribute.data.foreach_set("color", np.divide(ctx.lightmap_colors, 255.0, dtype=np.float32).ravel())
 
-        BSP_OBJECT.lightmap_images.append({'fi': fi, 'img': img, 'w': img.width, 'h': img.height})
+    def add_color_attribute_node(nodes, links):
+        color_node = nodes.new('ShaderNodeVertexColor')
+        color_node.name = "LM_Color_Attribute"
+        color_node.layer_name = VERTEX_LIGHTMAP_ATTRIBUTE
+        return color_node.outputs['Color']
 
-    print(f"Built {len(BSP_OBJECT.lightmap_images)} in-memory face lightmaps")
+    add_lightmap_nodes(ctx, influence_pct, "LM_Color_Attribute", add_color_attribute_node)
+    print(f"Applied vertex color lightmaps ({VERTEX_LIGHTMAP_ATTRIBUTE} attribute) and patched materials")
 
 
-def create_and_assign_atlas_lightmap(influence_pct):
-    print("Creating atlas lightmap (in-memory only)...")
-    face_images = getattr(BSP_OBJECT, 'lightmap_images', None)
-    if not face_images:
-        print("No in-memory lightmaps found on BSP_OBJECT.lightmap_images; aborting.")
-        return
+def add_lightmap_nodes(ctx, influence_pct, source_name, add_lightmap_source):
+    """
+    Multiplies every lit face's material by its lightmap: the lightmap color add_lightmap_source(nodes, links) adds to a material
+    (an output socket of its node source_name) goes into the Lightmap input of its surface group (see get_surface_node_group),
+    which does the rest.  The influence is the group's, one value for every material.
+    Materials patched already are left as they are, unless they were patched for the other lightmap mode (updating an import).
+    """
+    set_lightmap_influence(influence_pct)
 
-    # Ensure Pillow RGBA and w/h present
-    face_images = [{'fi': r['fi'], 'img': r['img'].convert('RGBA'), 'w': r.get('w', r['img'].width), 'h': r.get('h', r['img'].height)} for r in face_images]
-
-    # packer prep
-    face_images.sort(key=lambda r: r['h'], reverse=True)
-    def next_pow2(x): return 1 << (x - 1).bit_length()
-    max_w = max(r['w'] for r in face_images)
-    atlas_w = min(atlas_max_width, next_pow2(max_w))
-    atlas_w = max(atlas_w, 64)
-
-    placements = []
-    cur_x = 0
-    cur_y = 0
-    row_h = 0
-
-    # pack rects into rows; do NOT assume atlas_h yet
-    print("Packing atlas rectangles...")
-    for r in face_images:
-        w = r['w'] + 2 * pad
-        h = r['h'] + 2 * pad
-        # if rect (including pad) wider than atlas, try to expand atlas_w (within max)
-        if w > atlas_w:
-            if w <= atlas_max_width:
-                atlas_w = min(atlas_max_width, next_pow2(w))
-            else:
-                print(f"Face {r['fi']} too wide for atlas_max_width; skipping")
+    # Only materials of lightmapped faces need patching, e.g. sky materials don't
+    lit_texinfos = np.unique(ctx.faces['texture_info'][ctx.lit_faces]).tolist()
+    lit_materials = {ctx.texture_material_dict.get(ctx.textures[texture_idx].texture_name) for texture_idx in lit_texinfos}
+    lit_material_names = {mat.name for mat in lit_materials if mat}
+
+    print("Adding lightmap material nodes...")
+    for mat in ctx.obj.data.materials:
+        if mat is None or mat.name not in lit_material_names or not mat.use_nodes:
+            continue
+        surface = mat.node_tree.nodes.get(SURFACE_NODE_NAME)
+        if surface is None:
+            print(f"Material {mat.name} has no {SURFACE_NODE_GROUP} node (made by an older version?), not adding the lightmap")
+            continue
+        # Detect if we've already applied the patch
+        if surface.inputs['Lightmap'].is_linked:
+            if surface.inputs['Lightmap'].links[0].from_node.name == source_name:
                 continue
-        if cur_x + w > atlas_w:
-            cur_y += row_h
-            cur_x = 0
-            row_h = 0
-        placements.append({'fi': r['fi'], 'img': r['img'], 'x': cur_x, 'y': cur_y, 'w': r['w'], 'h': r['h']})
-        cur_x += w
-        row_h = max(row_h, h)
-
-    atlas_h = cur_y + row_h
-    if atlas_h <= 0:
-        print("Atlas height computed zero; aborting.")
-        return
+            for node_name in LIGHTMAP_SOURCE_NODES:
+                node = mat.node_tree.nodes.get(node_name)
+                if node:
+                    mat.node_tree.nodes.remove(node)
+        mat.node_tree.links.new(add_lightmap_source(mat.node_tree.nodes, mat.node_tree.links), surface.inputs['Lightmap'])
 
-    # Create atlas image in Pillow and paste using pad offset
-    print("Creating & saving actual image...")
-    atlas_img_pil = Image.new('RGBA', (atlas_w, atlas_h), (255, 255, 255, 255))
-    for p in placements:
-        paste_x = p['x'] + pad
-        paste_y = p['y'] + pad
-        atlas_img_pil.paste(p['img'], (paste_x, paste_y), p['img'])
 
-    # Save single atlas to disk (allowed) and load into Blender
-    atlas_name = f"{BSP_OBJECT.name}_atlas"
+def create_brush_object(ctx, reuse_existing=False):
+    """
+    The brush volumes (ctx.brush_mesh) as an object of their own, "<map>_brushes", with every polygon's brush index
+    ("bsp_brush_index") and contents flags ("bsp_brush_contents") as attributes.  Updating an import rebuilds its mesh in place.
+    """
+    brush_mesh = ctx.brush_mesh
+    name = f"{ctx.name}_brushes"
+    obj = bpy.data.objects.get(name) if reuse_existing else None
+    if obj and obj.type == 'MESH':
+        mesh = obj.data
+        mesh.clear_geometry()
+        obj.matrix_basis.identity()
+    else:
+        mesh = bpy.data.meshes.new(name)
+        obj = bpy.data.objects.new(name, mesh)
+        bpy.data.collections[0].objects.link(obj)
+        # Shows the volumes without hiding the map's faces
+        obj.display_type = 'WIRE'
 
-    atlas_bytes_io = io.BytesIO()
-    atlas_img_pil.save(atlas_bytes_io, format='PNG')
+    print(f"Creating brushes: {name}")
+    fill_mesh(mesh, brush_mesh.vertices, brush_mesh.loop_vertices, brush_mesh.loop_starts, brush_mesh.loop_totals)
+    for attribute_name, values in (("bsp_brush_index", brush_mesh.poly_brushes), ("bsp_brush_contents", brush_mesh.poly_contents)):
+        attribute = mesh.attributes.get(attribute_name) or mesh.attributes.new(name=attribute_name, type='INT', domain='FACE')
+        attribute.data.foreach_set("value", values.astype(np.int32))
+    return obj
 
-    width, height = atlas_img_pil.size
-    BSP_OBJECT.lightmap_atlas = bpy.data.images.new(atlas_name, width=width, height=height, alpha=True)
 
-    # Convert PIL image to RGBA, normalize pixel values (0-255 → 0.0-1.0), and flatten
-    pixels = list(atlas_img_pil.convert('RGBA').getdata())
-    pixels = [chan / 255.0 for pixel in pixels for chan in pixel]
+def apply_import_transforms(ob, model_scale, apply_transforms):
+    ob.scale = (model_scale, model_scale, model_scale)
 
-    # Assign pixels to the Blender image
-    BSP_OBJECT.lightmap_atlas.pixels = pixels
+    if apply_transforms:
+        print(f"Applying transforms: {ob.name}")
+        mb = ob.matrix_basis
+        if hasattr(ob.data, "transform"):
+            ob.data.transform(mb)
+        for c in ob.children:
+            c.matrix_local = mb @ c.matrix_local
 
-    # Pack the image to embed it in the .blend file
-    BSP_OBJECT.lightmap_atlas.pack()
+        ob.matrix_basis.identity()
 
-    # Multiply action needs to be linear, lightmap represents intensity, not actual "color"
-    BSP_OBJECT.lightmap_atlas.colorspace_settings.name = 'Non-Color'
-    if use_closest_for_debug:
-        try:
-            BSP_OBJECT.lightmap_atlas.use_alpha = True
-        except:
-            pass
+    ob.data.update()
 
-    # Create LightmapUV
-    mesh = BSP_OBJECT.mesh
-    lm_uv_name = "LightmapUV"
-    if lm_uv_name in mesh.uv_layers:
-        lm_uv = mesh.uv_layers[lm_uv_name]
-    else:
-        lm_uv = mesh.uv_layers.new(name=lm_uv_name)
-    mesh.uv_layers.active = lm_uv
 
-    atlas_w_real, atlas_h_real = atlas_img_pil.size
-    rect_map = {}
-    for p in placements:
-        x = p['x'] + pad
-        y = p['y'] + pad
-        w = p['w']
-        h = p['h']
-        u0 = x / atlas_w_real
-        v0 = y / atlas_h_real
-        u1 = (x + w) / atlas_w_real
-        v1 = (y + h) / atlas_h_real
-        rect_map[p['fi']] = (u0, v0, u1, v1, w, h)
-
-    uv_data = lm_uv.data
-    verts = mesh.vertices
-
-    for poly in mesh.polygons:
-        fi = poly.index
-        rect = rect_map.get(fi)
-        if not rect:
-            continue
-        u0, v0, u1, v1, pw, ph = rect
-        loops_start = poly.loop_start
-        loops_total = poly.loop_total
-
-        # Build per-loop vertex 2D coordinates in polygon-local 2D space.
-        # Use the polygon's vertex coordinates projected onto the polygon plane.
-        # Compute a local 2D basis (u_axis, v_axis) on the poly normal.
-        poly_verts = [verts[idx].co for idx in poly.vertices]
-        # polygon center
-        center = sum(poly_verts, mathutils.Vector()) / len(poly_verts)
-        # get tangent axis: from first vertex to second
-        if len(poly_verts) >= 2:
-            tangent = (poly_verts[1] - poly_verts[0]).normalized()
-        else:
-            tangent = mathutils.Vector((1,0,0))
-        normal = poly.normal
-        bitangent = normal.cross(tangent).normalized()
-        tangent = tangent.normalized()
-
-        # compute 2D coords for each loop's vertex
-        loop_coords_2d = []
-        for vi in poly.vertices:
-            p = verts[vi].co
-            rel = p - center
-            x = rel.dot(tangent)
-            y = rel.dot(bitangent)
-            loop_coords_2d.append((x, y))
-
-        # find min/max in 2D to map to rectangle corners
-        xs = [c[0] for c in loop_coords_2d]
-        ys = [c[1] for c in loop_coords_2d]
-        xmin, xmax = min(xs), max(xs)
-        ymin, ymax = min(ys), max(ys)
-        xspan = xmax - xmin if xmax != xmin else 1e-6
-        yspan = ymax - ymin if ymax != ymin else 1e-6
-
-        # for each loop, compute normalized local (lx, ly) in [0,1]
-        local_uvs = []
-        for (x, y) in loop_coords_2d:
-            lx = (x - xmin) / xspan
-            ly = (y - ymin) / yspan
-            local_uvs.append((lx, ly))
-
-        # assign atlas UVs based on these local_uvs
-        for li in range(loops_total):
-            lu, lv = local_uvs[li]
-            u = u0 + lu * (u1 - u0)
-            v = v0 + lv * (v1 - v0)
-            if flip_v:
-                v = 1.0 - v
-            uv_data[loops_start + li].uv = (u, v)
-
-
-    # Augment each existing base material node tree to multiply by atlas sample into Principled Base Color
-    print("Adding lightmap material nodes...")
-    for mat in BSP_OBJECT.obj.data.materials:
-        if mat is None:
-            continue
-        if not mat.use_nodes:
-            mat.use_nodes = True
-        tree = mat.node_tree
+def get_previous_import(object_name):
+    """
+    Object from an earlier import of the same map, if it's still around (and was a single object import).
+    """
+    obj = bpy.data.objects.get(object_name)
+    if obj and obj.type == 'MESH' and "bsp_lump_hashes" in obj:
+        return obj
+    return None
 
-        nodes = tree.nodes
-        links = tree.links
 
-        # Detect if we've already applied the patch
-        if nodes.get("LM_Atlas_Tex"):
-            continue
+def get_polygon_chunks(ctx, chunk_mode, chunk_size, chunk_depth):
+    """
+    Chunk id of every polygon, and a name suffix per chunk id.
+    GRID:   cubic cells of chunk_size BSP units, by polygon center
+    NODES:  the BSP node subtree (chunk_depth levels below the root) the polygon center falls in
+    """
+    centers = get_polygon_centers(ctx)
+    if chunk_mode == 'GRID':
+        cells = np.floor(centers / chunk_size).astype(np.int64)
+        unique_cells, chunks = np.unique(cells, axis=0, return_inverse=True)
+        return chunks.ravel(), {chunk: f"_Chunk_{x}_{y}_{z}" for chunk, (x, y, z) in enumerate(unique_cells.tolist())}
+    else:
+        # Subtrees that end before chunk_depth come back as (negative) leafs
+        nodes = ctx.tree.find_nodes_at_depth(centers, chunk_depth)
+        return nodes, {node: (f"_Node_{node}" if node >= 0 else f"_Leaf_{-(node + 1)}") for node in np.unique(nodes).tolist()}
 
-        # Find Principled BSDF
-        principled = None
-        for n in nodes:
-            if n.type == 'BSDF_PRINCIPLED':
-                principled = n
-                break
-        if not principled:
-            continue
 
-        # Create nodes (idempotent by name marker)
-        uv_map_node = nodes.new('ShaderNodeUVMap')
-        uv_map_node.name = "LM_UVMap"
-        uv_map_node.uv_map = lm_uv_name
+def split_output(ctx, split_areas, split_classes, chunk_mode='NONE', chunk_size=1024.0, chunk_depth=4):
+    """
+    Splits the imported object by area, face class (sky, liquid, translucent) and/or spatial chunk, one object per combination.
+    Each object only gets the vertices, material slots and UVs its own polygons use, so its bounding box is tight and
+    Blender can cull it in the viewport.
+    Per area objects are linked into their own collection under <map>_Areas, so areas can be toggled cheaply.
+    Faces not in any area (brush entities) end up in area 0.
+    """
+    poly_faces = ctx.bsp_face_indices
+    no_split = np.zeros(len(poly_faces), dtype=np.int64)
+    poly_areas = ctx.tree.get_face_areas()[poly_faces] if split_areas else no_split
+    poly_classes = ctx.face_classes[poly_faces] if split_classes else no_split
+    poly_chunks, chunk_names = get_polygon_chunks(ctx, chunk_mode, chunk_size, chunk_depth) if chunk_mode != 'NONE' else (no_split, {})
+
+    # One group per unique (area, class, chunk) combination
+    group_keys, poly_groups = np.unique(np.stack((poly_areas, poly_classes, poly_chunks), axis=1), axis=0, return_inverse=True)
+    poly_groups = poly_groups.ravel()
+
+    if split_areas:
+        areas_collection = get_or_create_collection(f"{ctx.name}_Areas")
+    area_collections = {}
+    group_names = {}
+    group_collections = {}
+    for group, (area, face_class, chunk) in enumerate(group_keys.tolist()):
+        name = ctx.name
+
+        if split_areas:
+            name += f"_Area_{area}"
+            if area not in area_collections:
+                area_collection = bpy.data.collections.new(f"{ctx.name}_Area_{area}")
+                areas_collection.children.link(area_collection)
+                # Areas connected through area portals (doors, etc...), for reference when deciding what to show
+                area_collection["portal_areas"] = ctx.tree.get_area_neighbours(area)
+                area_collections[area] = area_collection
+            group_collections[group] = area_collections[area]
+
+        if face_class != FACE_CLASS_SOLID:
+            name += f"_{FACE_CLASS_NAMES[face_class]}"
+        name += chunk_names.get(chunk, "")
+        group_names[group] = name
+
+    return split_object(ctx.obj, poly_groups, group_names, group_collections or None)
+
+
+def new_group_socket(group, name, in_out, socket_type):
+    """
+    Adds an input or output to a node group, the 3.x or the 4.x way.  Returns it, e.g. for its default value.
+    """
+    if bpy.app.version < (4,0,0):
+        return (group.inputs if in_out == 'INPUT' else group.outputs).new(socket_type, name)
+    return group.interface.new_socket(name, in_out=in_out, socket_type=socket_type)
 
-        atlas_tex = nodes.new('ShaderNodeTexImage')
-        atlas_tex.name = "LM_Atlas_Tex"
-        atlas_tex.image = BSP_OBJECT.lightmap_atlas
-        atlas_tex.extension = 'CLIP'
-        if use_closest_for_debug:
-            try:
-                atlas_tex.interpolation = 'Closest'
-            except:
-                pass
 
-        mix_node = nodes.new('ShaderNodeMixRGB')
-        mix_node.name = "LM_Multiply"
-        mix_node.blend_type = 'MULTIPLY'
-        mix_node.inputs['Fac'].default_value = 1.0
+def get_surface_node_group():
+    """
+    The node group every imported material is an instance of: its texture color, multiplied by its lightmap (white, so
+    nothing, for unlit materials) as much as the influence says, into a Principled BSDF.  Made once per file.
+    """
+    group = bpy.data.node_groups.get(SURFACE_NODE_GROUP)
+    if group:
+        return group
+
+    group = bpy.data.node_groups.new(SURFACE_NODE_GROUP, 'ShaderNodeTree')
+    for name in ("Color", "Lightmap"):
+        new_group_socket(group, name, 'INPUT', 'NodeSocketColor').default_value = (1.0, 1.0, 1.0, 1.0)
+    new_group_socket(group, "BSDF", 'OUTPUT', 'NodeSocketShader')
+
+    nodes = group.nodes
+    links = group.links
+    group_input = nodes.new('NodeGroupInput')
+    group_output = nodes.new('NodeGroupOutput')
+
+    marker = nodes.new('ShaderNodeValue')
+    marker.name = "Lightmap_Infuence"
+    marker.label = "Lightmap Influence"
+    marker.outputs[0].default_value = 1.0
+
+    mix_node = nodes.new('ShaderNodeMixRGB')
+    mix_node.name = "LM_Multiply"
+    mix_node.blend_type = 'MULTIPLY'
+    links.new(marker.outputs[0], mix_node.inputs['Fac'])
+    links.new(group_input.outputs['Color'], mix_node.inputs['Color1'])
+    links.new(group_input.outputs['Lightmap'], mix_node.inputs['Color2'])
+
+    bsdf = nodes.new('ShaderNodeBsdfPrincipled')
+    if (bpy.app.version < (4,0,0)):
+        bsdf.inputs['Specular'].default_value = 0
+    else:
+        bsdf.inputs['Specular IOR Level'].default_value = 0
+    links.new(mix_node.outputs['Color'], bsdf.inputs['Base Color'])
+    links.new(bsdf.outputs['BSDF'], group_output.inputs['BSDF'])
 
-        marker = nodes.new('ShaderNodeValue')
-        marker.name = "Lightmap_Infuence"
-        marker.label = "Lightmap Influence"
-        marker.outputs[0].default_value = 1.0 * influence_pct
+    group_input.location = (-400, 0)
+    marker.location = (-400, 200)
+    mix_node.location = (-200, 0)
+    group_output.location = (300, 0)
+    return group
 
-        links.new(marker.outputs[0], mix_node.inputs['Fac'])
 
-        # find current incoming link to Principled Base Color, if any
-        base_color_input = principled.inputs.get('Base Color')
-        incoming_link = None
-        for l in list(tree.links):
-            if l.to_node == principled and l.to_socket == base_color_input:
-                incoming_link = l
-                break
+def set_lightmap_influence(influence_pct):
+    get_surface_node_group().nodes["Lightmap_Infuence"].outputs[0].default_value = 1.0 * influence_pct
 
-        # Connect UV -> atlas_tex, atlas -> mix color2
-        links.new(uv_map_node.outputs['UV'], atlas_tex.inputs['Vector'])
-        links.new(atlas_tex.outputs['Color'], mix_node.inputs['Color2'])
 
-        if incoming_link:
-            src_socket = incoming_link.from_socket
-            try:
-                links.remove(incoming_link)
-            except:
-                pass
-            links.new(src_socket, mix_node.inputs['Color1'])
-        else:
-            rgb = nodes.new('ShaderNodeRGB')
-            rgb.outputs[0].default_value = (1.0,1.0,1.0,1.0)
-            links.new(rgb.outputs[0], mix_node.inputs['Color1'])
-
-        links.new(mix_node.outputs['Color'], base_color_input)
-
-    print(f"Built lightmap atlas ({atlas_w_real}x{atlas_h_real}), applied LightmapUV and patched materials. Atlas image: {BSP_OBJECT.lightmap_atlas.name}")
-
-
-def load_header(bytes):
-    arguments = struct.unpack(f"<{'i'*40}", bytes[:160])
-    return bsp_header(*arguments)
-
-
-def load_file(path):
-    with open(path, "rb") as f:
-        bytes = f.read()
-    BSP_OBJECT.header = load_header(bytes)
-
-    print("--------------- HEADER VALUES -------------------")
-    for field in fields(BSP_OBJECT.header):
-        print(f"{field.name} - ", getattr(BSP_OBJECT.header, field.name))
-    print("--------------------------------------------------")
-    return bytes
-
-
-def load_verts(bytes, model_scale):
-    num_verts = len(bytes) / 12
-    BSP_OBJECT.vertices = list()
-    for i in range(int(num_verts)):
-        vertex = bsp_vertex(*list(struct.unpack("<fff", bytes[12*i : 12*i+12])))
-        # Scale the vertex
-        # scaled_vertex = bsp_vertex(
-        #     x=vertex.x * model_scale,
-        #     y=vertex.y * model_scale,
-        #     z=vertex.z * model_scale
-        # )
-        BSP_OBJECT.vertices.append(vertex)
-
-
-def load_edges(bytes):
-    num_edges = len(bytes) / 4
-    BSP_OBJECT.edges = list()
-    for i in range(int(num_edges)):
-        edge = bsp_edge(*list(struct.unpack("<HH", bytes[4*i : 4*i+4])))
-        BSP_OBJECT.edges.append(edge)
-
-
-def load_faces(bytes):
-    num_faces = len(bytes) / 20
-    BSP_OBJECT.faces = list()
-    for i in range(int(num_faces)):
-        unpacked_bytes = list(struct.unpack("<HHIHHBBBBI", bytes[20*i : 20*i+20]))
-        face = bsp_face(
-            plane = unpacked_bytes[0],
-            plane_side = unpacked_bytes[1],
-            first_edge = unpacked_bytes[2],
-            num_edges = unpacked_bytes[3],
-            texture_info = unpacked_bytes[4],
-            lightmap_styles = unpacked_bytes[5:9],          # This is an array/list, the reason for handling the properties individually
-            lightmap_offset = unpacked_bytes[9]
-        )
-        BSP_OBJECT.faces.append(face)
-
-
-def get_face_and_texture_vertices(bytes):
-    """
-    mesh.from_pydata needs the vertex indices of the faces, which will be returned from this.
-    The UVs need to be calculated per vertex, using the coordinates.
-    """
-    for idx, f in enumerate(BSP_OBJECT.faces):
-        face_vert_list = list()
-        edges = list()
-        for i in range(f.first_edge, f.first_edge + f.num_edges):
-            # Get actual edge index from face-edge array
-            edge_idx = struct.unpack("<i", bytes[BSP_OBJECT.header.face_edge_table_offset + (i*4) : BSP_OBJECT.header.face_edge_table_offset + (i*4) + 4])[0]
-            if edge_idx < 0:
-                negative_flag = True
-
-            # Bear in mind this gets the INDICES of the vertices of the edge, not the coordinates (this is what the mesh from pydata function takes in)
-            this_edge = BSP_OBJECT.edges[abs(edge_idx)]
-            edges.append(this_edge)
-
-            # Negative number indicates drawing the edge from the 2nd point instead of the 1st
-            if edge_idx < 0:
-                face_vert_list.extend(list(reversed(this_edge)))
-            else:
-                face_vert_list.extend(this_edge)
-
-        face_vert_list = remove_duplicates(face_vert_list)
-        # Adds vertex indices to a list corresponding to the particular face
-        # Used for creating mesh from pydata
-        BSP_OBJECT.face_verts_list.append(face_vert_list)
-
-        # List to be used after mesh creation to create an attribute, tying the polygons to the correct face index for material assigning
-        BSP_OBJECT.bsp_face_indices.append(idx)
-
-        # Now that we have vertices associated with faces, while we're here, get the texture_info from the face,
-        # and associate the vertices with that texture as well, for assigning UVs later
-        face_texture = BSP_OBJECT.textures[f.texture_info]
-
-
-def load_textures(bytes):
-    num_textures = len(bytes) / 76
-    all_textures = list()
-    for i in range(int(num_textures)):
-        unpacked_bytes = list(struct.unpack(f"<{'f'*8}II{'c'*32}i", bytes[76*i : 76*i+76]))
-        texture_info = bsp_texture_info(
-            u_axis = unpacked_bytes[0:3],
-            u_offset = unpacked_bytes[3],
-            v_axis = unpacked_bytes[4:7],
-            v_offset = unpacked_bytes[7],
-            flags = unpacked_bytes[8],
-            value = unpacked_bytes[9],
-            texture_name = b''.join([byte for byte in unpacked_bytes[10:42] if byte != b'\x00']).decode('utf-8'),
-            next_texinfo = unpacked_bytes[42]
-        )
-
-        BSP_OBJECT.textures.append(texture_info)
-
-    # Note animation textures
-    for t in BSP_OBJECT.textures:
-        if t.next_texinfo != -1:
-            BSP_OBJECT.animation_textures.append(t.next_texinfo)
-            print(f"Adding animation texture to list: {t.next_texinfo}")
-
-
-def get_nonfirst_animation_textures():
-    """
-    This method finds animation textures EXCEPT the first in the sequence for material creation.
-    The subsequent "non-first" textures would apply to the same face as the first texture.
-    We want to create a material from the first texture, but we don't want to create a material for all the
-    animation textures on the same face.
-
-    So, this returns the non-first textures to exclude from material creation.
-    """
-    result = []
-    in_sequence = False
-    for i, tex in enumerate(BSP_OBJECT.textures):
-        if tex.next_texinfo != -1:
-            if not in_sequence:
-                # this is the first in a new sequence — skip it and mark sequence started
-                in_sequence = True
-            else:
-                result.append(i)  # later items in same sequence
+def new_texture_material(material_name, image):
+    """
+    A thin instance of the surface group (see get_surface_node_group): just its image node feeding the group.
+    """
+    mat = bpy.data.materials.new(name = material_name)
+    mat.use_nodes = True
+    nodes = mat.node_tree.nodes
+    links = mat.node_tree.links
+    nodes.clear()
+
+    output = nodes.new('ShaderNodeOutputMaterial')
+    surface = nodes.new('ShaderNodeGroup')
+    surface.name = SURFACE_NODE_NAME
+    surface.node_tree = get_surface_node_group()
+    tex_image = nodes.new('ShaderNodeTexImage')
+    tex_image.name = TEXTURE_NODE_NAME
+    tex_image.image = image
+
+    links.new(tex_image.outputs['Color'], surface.inputs['Color'])
+    links.new(surface.outputs['BSDF'], output.inputs['Surface'])
+    tex_image.location = (-500, 0)
+    output.location = (300, 0)
+    return mat
+
+
+def get_atlas_wrap_node_group():
+    """
+    The node group texture atlas materials (see new_atlas_material) look up their image with: the UV repeated inside
+    the face's tile, fract(UV) * bsp_atlas_scale + bsp_atlas_offset, from the face attributes (see assign_atlas_tiles).
+    Made once per file.
+    """
+    group = bpy.data.node_groups.get(ATLAS_WRAP_NODE_GROUP)
+    if group:
+        return group
+
+    group = bpy.data.node_groups.new(ATLAS_WRAP_NODE_GROUP, 'ShaderNodeTree')
+    new_group_socket(group, "UV", 'INPUT', 'NodeSocketVector')
+    new_group_socket(group, "Vector", 'OUTPUT', 'NodeSocketVector')
+
+    nodes = group.nodes
+    links = group.links
+    group_input = nodes.new('NodeGroupInput')
+    group_output = nodes.new('NodeGroupOutput')
+
+    offset = nodes.new('ShaderNodeAttribute')
+    offset.attribute_type = 'GEOMETRY'
+    offset.attribute_name = ATLAS_OFFSET_ATTRIBUTE
+    scale = nodes.new('ShaderNodeAttribute')
+    scale.attribute_type = 'GEOMETRY'
+    scale.attribute_name = ATLAS_SCALE_ATTRIBUTE
+
+    fraction = nodes.new('ShaderNodeVectorMath')
+    fraction.operation = 'FRACTION'
+    links.new(group_input.outputs['UV'], fraction.inputs[0])
+
+    tile = nodes.new('ShaderNodeVectorMath')
+    tile.operation = 'MULTIPLY_ADD'
+    links.new(fraction.outputs['Vector'], tile.inputs[0])
+    links.new(scale.outputs['Vector'], tile.inputs[1])
+    links.new(offset.outputs['Vector'], tile.inputs[2])
+    links.new(tile.outputs['Vector'], group_output.inputs['Vector'])
+
+    group_input.location = (-400, 0)
+    offset.location = (-400, -300)
+    scale.location = (-400, -150)
+    fraction.location = (-200, 0)
+    tile.location = (0, 0)
+    group_output.location = (200, 0)
+    return group
+
+
+def new_atlas_material(material_name, image):
+    """
+    A material for a texture atlas page (see pack_texture_atlas): like new_texture_material, with the face's UVs
+    wrapped into its tile (see get_atlas_wrap_node_group) before looking up the page.
+    """
+    mat = new_texture_material(material_name, image)
+    nodes = mat.node_tree.nodes
+    tex_image = nodes[TEXTURE_NODE_NAME]
+
+    tex_coord = nodes.new('ShaderNodeTexCoord')
+    wrap = nodes.new('ShaderNodeGroup')
+    wrap.name = "BSP_Atlas_Wrap"
+    wrap.node_tree = get_atlas_wrap_node_group()
+    mat.node_tree.links.new(tex_coord.outputs['UV'], wrap.inputs['UV'])
+    mat.node_tree.links.new(wrap.outputs['Vector'], tex_image.inputs['Vector'])
+    tex_coord.location = (-900, 0)
+    wrap.location = (-700, 0)
+    return mat
+
+
+def create_texture_atlas_images(ctx, reuse_existing=False):
+    """
+    Puts the texture atlas pages (see pack_texture_atlas) in Blender, as "<map>_textures_<page>" images packed into the .blend.
+    Updating an existing import refills its pages in place.
+    """
+    images = []
+    for page, pixels in enumerate(ctx.texture_atlases):
+        image_name = f"{ctx.name}_textures_{page}"
+        height, width = pixels.shape[:2]
+        image = bpy.data.images.get(image_name) if reuse_existing else None
+        if image:
+            if tuple(image.size) != (width, height):
+                image.scale(width, height)
         else:
-            in_sequence = False  # sequence ended
-    return result
+            image = bpy.data.images.new(image_name, width=width, height=height, alpha=True)
+        image.pixels.foreach_set(np.divide(pixels, 255.0, dtype=np.float32).ravel())
+        image.pack()
+        images.append(image)
+    print(f"Created {len(images)} texture atlas image(s) for {len(ctx.texture_atlas_rects)} textures")
+    return images
+
+
+def assign_atlas_tiles(ctx):
+    """
+    Texture atlas tile of every polygon, as the FACE attributes the atlas materials read (see get_atlas_wrap_node_group),
+    set in one go.  Polygons of textures with their own images get the whole image, (0, 0) and (1, 1).
+    """
+    mesh = ctx.mesh
+    for name in (ATLAS_OFFSET_ATTRIBUTE, ATLAS_SCALE_ATTRIBUTE):
+        if name in mesh.attributes:
+            mesh.attributes.remove(mesh.attributes[name])
+    if not ctx.texture_atlas_rects:
+        return
 
+    texinfo_tiles = np.tile(np.array([0.0, 0.0, 1.0, 1.0], dtype=np.float32), (len(ctx.textures), 1))
+    for texture_idx, texture in enumerate(ctx.textures):
+        rect = ctx.texture_atlas_rects.get(texture.texture_name)
+        if rect:
+            texinfo_tiles[texture_idx] = rect[1:]
+    poly_tiles = texinfo_tiles[ctx.faces['texture_info'][ctx.bsp_face_indices].astype(np.int64)]
+    for name, values in ((ATLAS_OFFSET_ATTRIBUTE, poly_tiles[:, 0:2]), (ATLAS_SCALE_ATTRIBUTE, poly_tiles[:, 2:4])):
+        attribute = mesh.attributes.new(name=name, type='FLOAT2', domain='FACE')
+        attribute.data.foreach_set("vector", np.ascontiguousarray(values).ravel())
 
-def create_materials():
-    excluded_animation_texture_indices = get_nonfirst_animation_textures()
-    # print(f"EXCLUDED ANIMATION TEXTURES: {excluded_animation_texture_indices}")
 
+def create_materials(ctx, keep_existing=False, lightmapped=False, vertex_lightmaps=False, atlas_images=()):
     # If importing multiple times, axe the old material, which will still exist globally, even if the object was deleted.
-    unique_material_names = list({f"M_{tex.texture_name}" for tex in BSP_OBJECT.textures})
-    for material_name in unique_material_names:
-        if material_name in bpy.data.materials:
-            material = bpy.data.materials[material_name]
-            bpy.data.materials.remove(material)
-
-    for i in range(len(BSP_OBJECT.textures)):
-        t = BSP_OBJECT.textures[i]
-        if i in excluded_animation_texture_indices:
-            print(f"Skipping animation frame texture: {i}: {t.texture_name}")
+    # When updating an existing import, the materials are kept instead, their images are updated in place.
+    # Materials from the shared texture library are never removed here, other maps may use them.
+    if not keep_existing and not ctx.library:
+        unique_material_names = list({f"M_{tex.texture_name}" for tex in ctx.textures})
+        unique_material_names += [f"M_{ctx.name}_textures_{page}" for page in range(len(atlas_images))]
+        for material_name in unique_material_names:
+            if material_name in bpy.data.materials:
+                material = bpy.data.materials[material_name]
+                bpy.data.materials.remove(material)
+
+    used_texture_infos = get_used_texture_infos(ctx)
+
+    # One material per texture atlas page, for every texture on it.  Never shared, the pages are this map's.
+    atlas_materials = []
+    for page, image in enumerate(atlas_images):
+        material_name = f"M_{ctx.name}_textures_{page}"
+        mat = bpy.data.materials.get(material_name) if keep_existing else None
+        if not mat:
+            mat = new_atlas_material(material_name, image)
+        if mat.name not in ctx.obj.data.materials:
+            ctx.obj.data.materials.append(mat)
+        atlas_materials.append(mat)
+
+    for i in range(len(ctx.textures)):
+        if i not in used_texture_infos:
+            continue
+
+        # Animations get one material, made for their first frame (the cycle's lowest texinfo).  Texinfos leading into the
+        # cycle can come before that frame, so whichever of them comes first here makes it, the others use it.
+        chain = ctx.texinfo_chains[i]
+        frames = ctx.animation_chains[chain] if chain >= 0 else [i]
+        t = ctx.textures[frames[0]]
+        texinfo_name = ctx.textures[i].texture_name
+        if t.texture_name in ctx.texture_material_dict:
+            ctx.texture_material_dict[texinfo_name] = ctx.texture_material_dict[t.texture_name]
+            continue
+        if t.texture_name in ctx.texture_atlas_rects:
+            ctx.texture_material_dict[t.texture_name] = atlas_materials[ctx.texture_atlas_rects[t.texture_name][0]]
+            ctx.texture_material_dict[texinfo_name] = ctx.texture_material_dict[t.texture_name]
             continue
 
         try:
             material_name = f"M_{t.texture_name}"
-
-            if not material_name in bpy.data.materials:
-                mat = bpy.data.materials.new(name = material_name)
-                mat.use_nodes = True
-                # Create the shader node
-                bsdf = mat.node_tree.nodes['Principled BSDF']
-
-                if (bpy.app.version < (4,0,0)):
-                    bsdf.inputs['Specular'].default_value = 0
-                else:
-                    bsdf.inputs['Specular IOR Level'].default_value = 0
-
-                tex_image = mat.node_tree.nodes.new('ShaderNodeTexImage')
-                tex_image.image = BSP_OBJECT.texture_obj_dict.get(t.texture_name)
-
-                mat.node_tree.links.new(tex_image.outputs['Color'], bsdf.inputs['Base Color'])
+            image = ctx.texture_obj_dict.get(t.texture_name)
+
+            if ctx.library:
+                # Lightmapped materials get this map's atlas patched in, so they can't be shared with other maps.
+                # Vertex color lightmaps are on the mesh, materials multiplying by them work for any map.
+                lightmap_map = (VERTEX_LIGHTMAP_ATTRIBUTE if vertex_lightmaps else ctx.name) if lightmapped else ""
+                mat = ctx.library.find_material(t.texture_name, image, lightmap_map)
+                if not mat:
+                    mat = new_texture_material(f"{material_name}_{lightmap_map}" if lightmap_map else material_name, image)
+                    ctx.library.add_material(mat, t.texture_name, image, lightmap_map)
+                ctx.library.mark_used(mat, ctx.name)
+                if mat.name not in ctx.obj.data.materials:
+                    ctx.obj.data.materials.append(mat)
+
+            elif not material_name in bpy.data.materials:
+                mat = new_texture_material(material_name, image)
 
                 # Add the new material to the mesh/object
-                BSP_OBJECT.obj.data.materials.append(mat)
+                ctx.obj.data.materials.append(mat)
             else:
                 mat = bpy.data.materials.get(material_name)
+                if mat.name not in ctx.obj.data.materials:
+                    ctx.obj.data.materials.append(mat)
 
-            BSP_OBJECT.texture_material_index_dict[t.texture_name] = bpy.data.materials.find(material_name)
+            if len(frames) > 1 and not mat.get("bsp_animation_frames"):
+                add_animation_frames(mat, [ctx.texture_obj_dict.get(ctx.textures[frame].texture_name) for frame in frames], t.texture_name,
+                                     bpy.context.scene)
 
-        except Exception as e:
+            ctx.texture_material_dict[t.texture_name] = ctx.texture_material_dict[texinfo_name] = mat
+            if t.texture_name in ctx.texture_source_dict:
+                # Where the texture is, for loading it later (e.g. after a geometry only import)
+                mat["bsp_texture_path"], mat["bsp_texture_member"] = ctx.texture_source_dict[t.texture_name]
+
+        except Exception:
             print(f"ERROR creating material for texture: {t.texture_name}")
             traceback.print_exc()
         else:
@@ -525,93 +554,171 @@ def create_materials():
             continue
 
 
-def assign_materials():
-    bpy.context.tool_settings.mesh_select_mode = [False, False, True]
-
-    for face in BSP_OBJECT.mesh.polygons:
-        try:
-            bsp_index = BSP_OBJECT.mesh.attributes["bsp_face_index"].data[face.index].value
-
-            texture_idx = BSP_OBJECT.faces[bsp_index].texture_info
-            texture_name = BSP_OBJECT.textures[texture_idx].texture_name
+def assign_materials(ctx):
+    """
+    Material slot of every polygon, from its face's texture, set in one go.
+    """
+    slots = ctx.mesh.materials[:]
+    texinfo_slots = np.zeros(len(ctx.textures), dtype=np.int32)
+    missing = []
+    for texture_idx, texture in enumerate(ctx.textures):
+        material = ctx.texture_material_dict.get(texture.texture_name)
+        if material in slots:
+            texinfo_slots[texture_idx] = slots.index(material)
+        else:
+            missing.append(texture_idx)
 
-            material_name = f"M_{texture_name}"
-            material = bpy.data.materials.get(material_name)
-            slot_index = BSP_OBJECT.obj.data.materials[:].index(material)
+    poly_texinfos = ctx.faces['texture_info'][ctx.bsp_face_indices].astype(np.int64)
+    missing_polys = np.count_nonzero(np.isin(poly_texinfos, missing))
+    if missing_polys:
+        print(f"ERROR assigning materials, no material for {missing_polys} polygons (texture infos: {missing})")
+        print("This can happen if the texture the material would have been created from couldn't be found.")
 
-            BSP_OBJECT.obj.data.polygons[face.index].material_index = slot_index
-        except Exception as e:
-            print(f"ERROR assigning material {material_name}, BSP INDEX: {bsp_index}\n{e}")
-            print("This can happen if the texture the material would have been created from is only used as an animation texture.")
+    ctx.mesh.polygons.foreach_set("material_index", texinfo_slots[poly_texinfos])
 
 
-def create_uvs(model_scale):
+def create_uvs(ctx, model_scale):
     print("Creating UVs...")
-    BSP_OBJECT.obj.select_set(True)
+    ctx.obj.select_set(True)
 
-    uv_layer = BSP_OBJECT.mesh.uv_layers.new()
-    BSP_OBJECT.mesh.uv_layers.active = uv_layer
+    uv_layer = ctx.mesh.uv_layers.new()
+    ctx.mesh.uv_layers.active = uv_layer
 
     bpy.ops.object.mode_set(mode='OBJECT')
+    uv_layer.data.foreach_set("uv", ctx.uvs.ravel())
 
-    for face in BSP_OBJECT.mesh.polygons:
-        for (vert_idx, loop_idx) in zip(face.vertices, face.loop_indices):
-            # vert_idx = BSP_OBJECT.obj.data.loops[loop_idx].vertex_index
-            # texture = BSP_OBJECT.vert_texture_dict[vert_idx]
-            texture_info = BSP_OBJECT.faces[face.index].texture_info
-            texture = BSP_OBJECT.textures[texture_info]
 
-            # Could omit animation textures, but probably pointless...
-            vert_vector = BSP_OBJECT.vertices[vert_idx]
+def get_image_texture_size(image):
+    """
+    Size of the texture an image was made from.  Proxy images (lower WAL mip levels) are smaller, but UVs need the full size.
+    """
+    return tuple(image.get("bsp_texture_size", image.size))
 
-            x = vert_vector.x
-            y = vert_vector.y
-            z = vert_vector.z
 
-            bsp_u = x * texture.u_axis[0] + y * texture.u_axis[1] + z * texture.u_axis[2] + texture.u_offset
-            bsp_v = x * texture.v_axis[0] + y * texture.v_axis[1] + z * texture.v_axis[2] + texture.v_offset
+def set_wal_pixels(image_name, wal_object, existing_img=None, pixels=None):
+    """
+    Fills an image with a decoded WAL, at whatever mip level it was decoded.  An existing image is resized and refilled in place,
+    so materials keep pointing at it, otherwise a new one is created.  WALs aren't something Blender can load, so the image is packed.
+    pixels are the WAL's get_wal_pixels, if they were already decoded (see decode_textures).
+    """
+    if pixels is None:
+        pixels = get_wal_pixels(wal_object)
+    pixels = pixels.astype(np.float32) / 255.0
+
+    if existing_img:
+        blender_img = existing_img
+        if tuple(blender_img.size) != (wal_object.mip_width, wal_object.mip_height):
+            blender_img.scale(wal_object.mip_width, wal_object.mip_height)
+    else:
+        blender_img = bpy.data.images.new(name=image_name,
+                                        width=wal_object.mip_width,
+                                        height=wal_object.mip_height)
 
-            try:
-                texture_res = BSP_OBJECT.texture_resolution_dict[texture.texture_name]
-                if not texture_res:
-                    print(f"ERROR:  No resolution found for {texture.texture_name}")
+    blender_img.pixels.foreach_set(pixels.ravel())
+    blender_img.pack()
 
-                u = bsp_u / texture_res[0]
-                v = (1 - bsp_v / texture_res[1])    # Invert y-axis for Blender
+    blender_img["bsp_mip_level"] = wal_object.mip_level
+    blender_img["bsp_texture_size"] = (wal_object.width, wal_object.height)
+    return blender_img
 
-                uv_layer.data[loop_idx].uv = [u,v]
-            except Exception as e:
-                print(f"Skipping {texture.texture_name} (may be .atd file or non-image)\n{e}")
-                continue
 
+def get_texture_cache_dir(cache_dir=""):
+    if cache_dir:
+        return bpy.path.abspath(cache_dir)
+    return bpy.utils.user_resource('DATAFILES', path="idtech2_bsp_texture_cache", create=True)
 
-def get_texture_images(search_from_parent):
-    valid_extensions = ['.tga','.png','.bmp','.jpg','.wal']
-    file_paths = []
 
-    # For Quake/Quake II, the default folder layout often places the .BSP files in a folder adjacent the textures,
-    # instead of in a subfolder.  This option allows searching from the parent folder to find those textures.
-    texture_search_folder = BSP_OBJECT.folder_path
-    if search_from_parent:
-        texture_search_folder = Path(BSP_OBJECT.folder_path).parent
+def get_import_cache_dir(cache_dir=""):
+    if cache_dir:
+        return bpy.path.abspath(cache_dir)
+    return bpy.utils.user_resource('DATAFILES', path="idtech2_bsp_import_cache", create=True)
 
-    print(f"Searching for appropriate texture image files in: {texture_search_folder}")
-    actual_texture_path = ""
 
-    for root, dirs, files in os.walk(texture_search_folder):
-        for file in files:
-            if any(file.endswith(ext.casefold()) for ext in valid_extensions):
-                file_paths.append(os.path.join(root, file))
+def load_cached_wal(image_name, data, mip_level, cache_dir, existing_img=None):
+    """
+    Decodes a WAL to a PNG in the cache folder once (see write_cached_wal), and loads that file instead of filling (and packing) pixels.
+    Blender only reads the pixels of a file backed image when it's actually displayed, and doesn't store them in the .blend.
+    """
+    width, height = read_wal_size(data)
+    cache_path = write_cached_wal(image_name, data, mip_level, cache_dir)
+
+    if existing_img:
+        blender_img = existing_img
+        blender_img.filepath = cache_path
+        blender_img.reload()
+    else:
+        blender_img = bpy.data.images.load(cache_path, check_existing=True)
+        if blender_img.name != image_name and not bpy.data.images.get(image_name):
+            blender_img.name = image_name
 
-    file_paths_map = {file_path.casefold(): file_path for file_path in file_paths}
+    blender_img["bsp_mip_level"] = mip_level
+    blender_img["bsp_texture_size"] = (width, height)
+    blender_img["bsp_cache_dir"] = cache_dir
+    return blender_img
 
-    for i, t in enumerate(BSP_OBJECT.textures):
-        texture_name_casefold = t.texture_name.casefold()
-        actual_texture_path = ""
-        for casefolded_path, original_path in file_paths_map.items():
-            if texture_name_casefold.replace('\\','/') in casefolded_path.replace('\\','/'):
-                actual_texture_path = original_path
-                break
+
+def upgrade_proxy_textures(images=None):
+    """
+    Reloads WAL textures imported as proxies (lower mip level) at full resolution, in place, from the file or PAK they came from.
+    Returns the number of images upgraded.
+    """
+    upgraded = 0
+    paks = {}
+    try:
+        for image in list(images if images is not None else bpy.data.images):
+            if not image.get("bsp_mip_level"):
+                continue
+            try:
+                wal_path, wal_member = image["bsp_wal_path"], image.get("bsp_wal_member", "")
+                if wal_member:
+                    if wal_path not in paks:
+                        paks[wal_path] = pak_file(wal_path)
+                    data = paks[wal_path].read(wal_member)
+                    if data is None:
+                        raise FileNotFoundError(f"{wal_member} not in {wal_path}")
+                else:
+                    with open(wal_path, "rb") as f:
+                        data = f.read()
+                if image.get("bsp_cache_dir") and not image.packed_file:
+                    load_cached_wal(image.name, data, 0, image["bsp_cache_dir"], image)
+                else:
+                    set_wal_pixels(image.name, wal_image(data), image)
+                data = None
+                upgraded += 1
+            except Exception as e:
+                print(f"ERROR upgrading proxy texture {image.name}: {e}")
+    finally:
+        for pak in paks.values():
+            pak.close()
+
+    print(f"Upgraded {upgraded} proxy textures to full resolution")
+    return upgraded
+
+
+def load_texture_images(ctx, search_from_parent, refresh_changed=False, shared_library=False, texture_mip=0, texture_cache_dir=None,
+                        skip_names=()):
+    """
+    Finds and loads the image for every texture used, yielding (textures done, total) before each one.  Images already in the file are reused by name, unless refresh_changed is set
+    and the file on disk changed since it was loaded, in which case the image is updated in place (so materials keep pointing at it).
+    Loose files in the search folder come first, then the PAKs (ctx.paks), if any.
+    texture_mip > 0 decodes WALs at that mip level, as proxies (see upgrade_proxy_textures).  Existing images are only
+    reused if they're at least that detailed.
+    With texture_cache_dir, WALs are decoded to PNG files there once and loaded from those (see load_cached_wal), instead of packed.
+    WALs already decoded by decode_textures are used as they are.  Textures in skip_names (e.g. in the texture atlas) get no image.
+    """
+    texture_search_folder = get_texture_search_folder(ctx, search_from_parent)
+    used_texture_infos = sorted(get_used_texture_infos(ctx))
+
+    if shared_library:
+        ctx.library = texture_library(texture_search_folder)
+
+    for done, i in enumerate(used_texture_infos):
+        yield done, len(used_texture_infos)
+        t = ctx.textures[i]
+        if t.texture_name in skip_names:
+            continue
+        actual_texture_path, pak_member = resolve_texture(ctx, t.texture_name, texture_search_folder)
+        texture_data = ctx.paks.read(pak_member) if pak_member else None
 
         try:
             if not actual_texture_path:
@@ -621,160 +728,410 @@ def get_texture_images(search_from_parent):
             # Use the exact naming you want for the blender image datablock
             image_name = f"{t.texture_name}"
 
-            # If an image datablock with that name already exists, reuse it
-            existing_img = bpy.data.images.get(image_name)
-            if existing_img:
-                BSP_OBJECT.texture_obj_dict[t.texture_name] = existing_img
+            if ctx.library:
+                # Shared library: same file contents -> same image, whatever the texture or map.  Never reuse/overwrite by name,
+                # the name may belong to another game's texture.
+                existing_img = None
+                library_img, source_signature, content_hash = ctx.library.find_image(actual_texture_path,
+                                                                                      ctx.paks.get_signature(pak_member) if pak_member else None,
+                                                                                      texture_data)
+                if library_img and library_img.get("bsp_mip_level", 0) <= texture_mip:
+                    ctx.texture_obj_dict[t.texture_name] = library_img
+                    ctx.library.mark_used(library_img, ctx.name)
+                    if t.texture_name not in ctx.texture_resolution_dict:
+                        ctx.texture_resolution_dict[t.texture_name] = get_image_texture_size(library_img)
+                    continue
+                # A coarser proxy than wanted gets refilled in place
+                existing_img = library_img
+            else:
+                # If an image datablock with that name already exists, reuse it
+                existing_img = bpy.data.images.get(image_name)
+                source_signature = ctx.paks.get_signature(pak_member) if pak_member else get_file_signature(actual_texture_path)
+            if existing_img and existing_img.get("bsp_mip_level", 0) <= texture_mip and \
+                    (not refresh_changed or existing_img.get("bsp_source") == source_signature):
+                ctx.texture_obj_dict[t.texture_name] = existing_img
                 # ensure resolution recorded
-                if t.texture_name not in BSP_OBJECT.texture_resolution_dict:
-                    BSP_OBJECT.texture_resolution_dict[t.texture_name] = (existing_img.size[0], existing_img.size[1])
+                if t.texture_name not in ctx.texture_resolution_dict:
+                    ctx.texture_resolution_dict[t.texture_name] = get_image_texture_size(existing_img)
                 continue
+            elif existing_img:
+                print(f"Texture changed on disk (or wanted at a higher resolution), updating image in place: {image_name}")
 
             # Not already created: create/load now
             if actual_texture_path.lower().endswith('.wal'):
-                wal_object = wal_image(actual_texture_path)
-                with wal_object.image as pil_img:
-                    new_image = pil_img.convert('RGBA')
-                    pixels = np.array(new_image).astype(np.float32) / 255.0
-
-                    if t.texture_name not in BSP_OBJECT.texture_resolution_dict:
-                        BSP_OBJECT.texture_resolution_dict[t.texture_name] = (wal_object.width, wal_object.height)
-
-                    png_bytes_io = io.BytesIO()
-                    new_image.save(png_bytes_io, format='PNG')
-                    png_bytes = png_bytes_io.getvalue()
+                decoded = ctx.decoded_textures.pop(t.texture_name, None)
+                if texture_cache_dir and not (existing_img and existing_img.packed_file):
+                    wal_data = read_texture_data(ctx, actual_texture_path, pak_member)
+                    blender_img = load_cached_wal(image_name, wal_data, texture_mip, texture_cache_dir, existing_img)
+                    wal_data = None
+                elif decoded and decoded[0].mip_level == texture_mip:
+                    blender_img = set_wal_pixels(image_name, decoded[0], existing_img, decoded[1])
+                else:
+                    wal_object = wal_image(texture_data if pak_member else actual_texture_path, texture_mip)
+                    blender_img = set_wal_pixels(image_name, wal_object, existing_img)
+                decoded = None
 
-                    blender_img = bpy.data.images.new(name=image_name,
-                                                    width=wal_object.width,
-                                                    height=wal_object.height)
+                # Always the full (mip 0) size, so UVs stay right for proxies
+                if t.texture_name not in ctx.texture_resolution_dict:
+                    ctx.texture_resolution_dict[t.texture_name] = get_image_texture_size(blender_img)
 
-                    blender_img.pixels.foreach_set(pixels.ravel())
-                    blender_img.pack()
+                # Where to get the full resolution from later
+                blender_img["bsp_wal_path"] = ctx.paks.index[pak_member].path if pak_member else actual_texture_path
+                blender_img["bsp_wal_member"] = pak_member or ""
 
             else:
-                # Non-WAL: attempt to load from disk
-                try:
-                    blender_img = bpy.data.images.load(actual_texture_path)
-                    # rename to your desired image_name if that name isn't taken
-                    if blender_img.name != image_name and not bpy.data.images.get(image_name):
-                        blender_img.name = image_name
-                except Exception:
-                    # PIL fallback: create new image datablock with your name
-                    with PIL.Image.open(actual_texture_path) as pil_img:
+                blender_img = None
+                if not pak_member:
+                    # Non-WAL: attempt to load from disk
+                    try:
+                        if existing_img:
+                            blender_img = existing_img
+                            blender_img.filepath = actual_texture_path
+                            blender_img.reload()
+                        else:
+                            blender_img = bpy.data.images.load(actual_texture_path)
+                        # rename to your desired image_name if that name isn't taken
+                        if blender_img.name != image_name and not bpy.data.images.get(image_name):
+                            blender_img.name = image_name
+                    except Exception:
+                        blender_img = None
+
+                if blender_img is None:
+                    # PIL fallback (and PAK members, which Blender can't load by path): create new image datablock with your name
+                    with PIL.Image.open(io.BytesIO(texture_data) if pak_member else actual_texture_path) as pil_img:
                         width, height = pil_img.size
-                        if t.texture_name not in BSP_OBJECT.texture_resolution_dict:
-                            BSP_OBJECT.texture_resolution_dict[t.texture_name] = (width, height)
-
-                        blender_img = bpy.data.images.new(name=image_name,
-                                                        width=width,
-                                                        height=height,
-                                                        alpha=pil_img.mode in ('RGBA', 'LA'))
+                        if t.texture_name not in ctx.texture_resolution_dict:
+                            ctx.texture_resolution_dict[t.texture_name] = (width, height)
+
+                        if existing_img:
+                            blender_img = existing_img
+                            if tuple(blender_img.size) != (width, height):
+                                blender_img.scale(width, height)
+                        else:
+                            blender_img = bpy.data.images.new(name=image_name,
+                                                            width=width,
+                                                            height=height,
+                                                            alpha=pil_img.mode in ('RGBA', 'LA'))
                         pil_rgba = pil_img.convert('RGBA')
                         pixels = list(pil_rgba.getdata())
                         float_pixels = [chan / 255.0 for px in pixels for chan in px]
                         blender_img.pixels[:] = float_pixels
+                        if pak_member:
+                            # There's no file to load it back from
+                            blender_img.pack()
 
             # store the created image datablock
-            BSP_OBJECT.texture_obj_dict[t.texture_name] = blender_img
+            ctx.texture_obj_dict[t.texture_name] = blender_img
+            blender_img["bsp_source"] = source_signature
+            if ctx.library:
+                ctx.library.add_image(blender_img, source_signature, content_hash)
+                ctx.library.mark_used(blender_img, ctx.name)
 
             # ensure resolution stored for non-wal loaded images
-            if t.texture_name not in BSP_OBJECT.texture_resolution_dict:
-                BSP_OBJECT.texture_resolution_dict[t.texture_name] = (blender_img.size[0], blender_img.size[1])
+            if t.texture_name not in ctx.texture_resolution_dict:
+                ctx.texture_resolution_dict[t.texture_name] = get_image_texture_size(blender_img)
 
         except Exception as e:
             print(f"ERROR getting {t.texture_name}, attempted path: {actual_texture_path}")
             print(f"Exception: {e}")
 
 
+def missing_file(self, context):
+    self.layout.label(text="File does not exist in currently selected directory! Perhaps you didn't select the correct .bsp file?")
 
-def load_idtech2_bsp(bsp_path, model_scale, apply_transforms, search_from_parent, apply_lightmaps, lightmap_influence, show_entities):
-    if not os.path.isfile(bsp_path):
-        bpy.context.window_manager.popup_menu(missing_file, title="Error", icon='ERROR')
-        return {'FINISHED'} 
-
-    print("Loading idtech2 .bsp...")
-    try:
-        BSP_OBJECT.reset()
-
-        file_bytes = load_file(bsp_path)
-        BSP_OBJECT.folder_path = os.path.dirname(bsp_path)
-
-        # Create the mesh
-        filename = os.path.basename(bsp_path)
-        object_name = filename.split('.')[0]        # trim off the .bsp extension
 
-        print(f"Creating mesh: {object_name}")
-        BSP_OBJECT.name = object_name
+class bsp_import_job(object):
+    """
+    One import, in three steps, so the slow part can run without blocking Blender:
+        prepare():      main thread, checks the file and reads what the import needs from Blender (3D cursor, previous import, folders...)
+        preprocess():   no bpy at all (see bsp_preprocessor), so it can run in a background thread (preprocess_in_background)
+                        or a worker process (see batch_import)
+        build():        main thread, creates the datablocks.  A generator, yielding between batches (e.g. every texture image),
+                        so a timer can spread it out and the UI stays responsive.
+    run() does all of it in a row.  stage and progress (0-1) tell how far it got, cancel() stops it at the next stage or batch.
+    """
 
-        BSP_OBJECT.mesh = bpy.data.meshes.new(object_name)
-        BSP_OBJECT.obj = bpy.data.objects.new(object_name, BSP_OBJECT.mesh)
+    def __init__(self, bsp_path, options):
+        self.preprocessor = bsp_preprocessor(bsp_path, options)
+        self.previous_obj = None
+        self.thread = None
+        self.error = None
 
-        load_verts(file_bytes[BSP_OBJECT.header.vertices_offset : BSP_OBJECT.header.vertices_offset+BSP_OBJECT.header.vertices_length], model_scale)
-        load_edges(file_bytes[BSP_OBJECT.header.edge_offset : BSP_OBJECT.header.edge_offset+BSP_OBJECT.header.edge_length])
-        load_textures(file_bytes[BSP_OBJECT.header.texture_info_offset : BSP_OBJECT.header.texture_info_offset+BSP_OBJECT.header.texture_info_length])
-        load_faces(file_bytes[BSP_OBJECT.header.faces_offset : BSP_OBJECT.header.faces_offset+BSP_OBJECT.header.faces_length])
 
-        get_texture_images(search_from_parent)
+    @property
+    def ctx(self):
+        return self.preprocessor.ctx
 
-        # faces_by_verts = get_face_and_texture_vertices(file_bytes)
-        get_face_and_texture_vertices(file_bytes)
 
-        print("Creating mesh...")
-        BSP_OBJECT.mesh.from_pydata(BSP_OBJECT.vertices, [], BSP_OBJECT.face_verts_list)
+    @property
+    def options(self):
+        return self.preprocessor.options
 
-        # create an int polygon attribute and fill with our BSP face indices
-        if "bsp_face_index" in BSP_OBJECT.mesh.attributes:
-            pa = BSP_OBJECT.mesh.attributes["bsp_face_index"]
-        else:
-            pa = BSP_OBJECT.mesh.attributes.new(name="bsp_face_index", type='INT', domain='FACE')
 
-        # Sanity: mesh.polygons order is what mesh.attributes uses; we must map.
-        # We assume mesh.polygons has same length as face_verts_list; if not, handle accordingly.
-        pa.data.foreach_set("value", BSP_OBJECT.bsp_face_indices)
+    @property
+    def stage(self):
+        return self.preprocessor.stage
 
-        create_materials()
 
-        main_collection = bpy.data.collections[0]
-        main_collection.objects.link(BSP_OBJECT.obj)
-        bpy.context.view_layer.objects.active = BSP_OBJECT.obj
+    @property
+    def progress(self):
+        return self.preprocessor.progress
 
-        create_uvs(model_scale)
-        assign_materials()
 
-        if apply_lightmaps:
-            # save_all_face_lightmaps(file_bytes, float(lightmap_influence / 100))
-            build_all_face_lightmaps_in_memory(file_bytes)
-            create_and_assign_atlas_lightmap(float(lightmap_influence / 100))
+    def cancel(self):
+        self.preprocessor.cancel()
 
-        if show_entities:
-            populate_entities(file_bytes, model_scale)
 
+    def prepare(self):
+        """
+        Returns False if there's nothing to import.
+        """
+        pre, opts = self.preprocessor, self.options
+        if not os.path.isfile(pre.bsp_path):
+            bpy.context.window_manager.popup_menu(missing_file, title="Error", icon='ERROR')
+            return False
 
-        print("Applying scale...")
-        BSP_OBJECT.obj.scale = (model_scale, model_scale, model_scale)
+        print("Loading idtech2 .bsp...")
+        filename = os.path.basename(opts.pak_map.replace('\\', '/') if opts.pak_map else pre.bsp_path)
+        object_name = filename.split('.')[0]        # trim off the .bsp extension
 
+        # Everything this import works on lives here, and goes away with it
+        pre.ctx = bsp_import_context(object_name, os.path.dirname(pre.bsp_path))
 
-        if apply_transforms:
-            print("Applying transforms...")
-            context = bpy.context
-            ob = context.object
-            mb = ob.matrix_basis
-            if hasattr(ob.data, "transform"):
-                ob.data.transform(mb)
-            for c in ob.children:
-                c.matrix_local = mb @ c.matrix_local
+        pre.split_requested = opts.area_import == 'SPLIT' or opts.separate_special_faces or opts.chunk_mode != 'NONE'
+        if opts.geometry_only and opts.apply_lightmaps:
+            print("Geometry only import, skipping lightmaps")
+            opts.apply_lightmaps = False
 
-            ob.matrix_basis.identity()
+        self.previous_obj = get_previous_import(object_name) if opts.reimport else None
+        if self.previous_obj and pre.split_requested:
+            print("Updating an existing import only works for single object imports, importing as new")
+            self.previous_obj = None
+        if self.previous_obj:
+            pre.previous_keys = (self.previous_obj["bsp_lump_hashes"].to_dict(),
+                                 self.previous_obj.get("bsp_geometry_key"), self.previous_obj.get("bsp_lighting_key"))
 
-        BSP_OBJECT.mesh.update()
+        pre.cursor = tuple(bpy.context.scene.cursor.location)
+        pre.texture_cache_dir = get_texture_cache_dir(opts.texture_cache_dir) if opts.cache_textures else None
+        pre.import_cache_dir = get_import_cache_dir(opts.import_cache_dir) if opts.use_import_cache else None
+        pre.existing_images = set() if self.previous_obj else {image.name for image in bpy.data.images}
+        return True
 
 
-    except Exception as e:
-        print(f"ERROR loading .BSP file: {e}")
-        traceback.print_exc()
+    def preprocess(self):
+        self.preprocessor.preprocess()
 
-    return {'FINISHED'}
 
+    def preprocess_in_background(self):
+        """
+        Starts preprocess() in a background thread.  Once preprocessing is False, error has whatever it raised (if anything).
+        """
+        def preprocess_thread():
+            try:
+                self.preprocess()
+            except import_cancelled as e:
+                self.error = e
+            except Exception as e:
+                print(f"ERROR loading .BSP file: {e}")
+                traceback.print_exc()
+                self.error = e
+
+        self.error = None
+        self.thread = threading.Thread(target=preprocess_thread, name=f"BSP import: {self.ctx.name}", daemon=True)
+        self.thread.start()
+
+
+    @property
+    def preprocessing(self):
+        return self.thread is not None and self.thread.is_alive()
+
+
+    def build(self):
+        pre, ctx, opts = self.preprocessor, self.ctx, self.options
+        # Preprocessed in a worker process, its open files stayed there (see bsp_import_context)
+        if ctx.paks is None:
+            pre.open_paks()
+        if pre.split_requested and ctx.tree is None:
+            ctx.tree = bsp_tree(pre.file_bytes, ctx.header)
+        pre.set_stage("Creating images", 0.7)
+        if self.previous_obj:
+            ctx.obj = self.previous_obj
+            ctx.mesh = self.previous_obj.data
+        else:
+            print(f"Creating mesh: {ctx.name}")
+            ctx.mesh = bpy.data.meshes.new(ctx.name)
+            ctx.obj = bpy.data.objects.new(ctx.name, ctx.mesh)
+
+        if not opts.geometry_only:
+            for done, total in load_texture_images(ctx, opts.search_from_parent, refresh_changed=bool(self.previous_obj),
+                                                   shared_library=opts.shared_library, texture_mip=opts.texture_mip,
+                                                   texture_cache_dir=pre.texture_cache_dir, skip_names=set(ctx.texture_atlas_rects)):
+                pre.set_progress(0.7 + 0.15 * done / max(total, 1))
+                yield
+        # Empty unless packed (see pack_texture_atlas)
+        atlas_images = create_texture_atlas_images(ctx, reuse_existing=bool(self.previous_obj)) if ctx.texture_atlases else []
+        if opts.low_memory:
+            ctx.texture_atlases = []
+
+        if pre.geometry_changed:
+            pre.set_stage("Creating mesh", 0.85)
+            if self.previous_obj:
+                # Rewrite the existing mesh in place, the object and its material slots stay as they are
+                print("Clearing existing mesh...")
+                ctx.mesh.clear_geometry()
+
+            print("Creating mesh...")
+            fill_mesh(ctx.mesh, ctx.vertices, ctx.loop_vertices, ctx.loop_starts, ctx.loop_totals)
+
+            # create an int polygon attribute and fill with our BSP face indices
+            if "bsp_face_index" in ctx.mesh.attributes:
+                pa = ctx.mesh.attributes["bsp_face_index"]
+            else:
+                pa = ctx.mesh.attributes.new(name="bsp_face_index", type='INT', domain='FACE')
+
+            # Polygons are created in loop array order, so this lines up 1:1
+            pa.data.foreach_set("value", ctx.bsp_face_indices.astype(np.int32))
+            if opts.low_memory and not pre.split_requested:
+                # In the mesh now, only splitting would still need them
+                ctx.vertices = ctx.loop_vertices = ctx.loop_starts = ctx.loop_totals = None
+            yield
+
+        pre.set_stage("Creating materials", 0.9)
+        create_materials(ctx, keep_existing=bool(self.previous_obj), lightmapped=opts.apply_lightmaps,
+                         vertex_lightmaps=opts.lightmap_mode == 'VERTEX', atlas_images=atlas_images)
+
+        if not self.previous_obj:
+            main_collection = bpy.data.collections[0]
+            main_collection.objects.link(ctx.obj)
+        bpy.context.view_layer.objects.active = ctx.obj
+
+        if pre.geometry_changed:
+            create_uvs(ctx, opts.model_scale)
+            assign_materials(ctx)
+            assign_atlas_tiles(ctx)
+        if opts.low_memory:
+            ctx.uvs = None
+        yield
+
+        if pre.build_lightmaps:
+            pre.set_stage("Applying lightmaps", 0.93)
+            if opts.lightmap_mode == 'VERTEX':
+                create_vertex_lightmap(ctx, float(opts.lightmap_influence / 100))
+            else:
+                create_and_assign_atlas_lightmap(ctx, float(opts.lightmap_influence / 100), reuse_existing=bool(self.previous_obj))
+            if opts.low_memory:
+                ctx.lightmap_pixels = ctx.lightmap_uvs = ctx.lightmap_colors = None
+            yield
+
+        if opts.show_entities:
+            pre.set_stage("Creating entities", 0.95)
+            populate_entities(pre.file_bytes, ctx.header, ctx.name, opts.model_scale)
+            yield
+
+        ctx.objects = [ctx.obj]
+        if pre.split_requested:
+            pre.set_stage("Splitting", 0.97)
+            # chunk_size is in scene units, like the other sizes the user sees
+            ctx.objects = split_output(ctx, opts.area_import == 'SPLIT', opts.separate_special_faces, opts.chunk_mode,
+                                       opts.chunk_size / opts.model_scale, opts.chunk_depth)
+            yield
 
+        print("Applying scale...")
+        for ob in ctx.objects:
+            if not pre.geometry_changed:
+                # Kept as is from the previous import, which already has the scale/transforms
+                continue
+            apply_import_transforms(ob, opts.model_scale, opts.apply_transforms)
+
+        if ctx.brush_mesh is not None:
+            pre.set_stage("Creating brushes", 0.98)
+            brush_obj = create_brush_object(ctx, reuse_existing=bool(self.previous_obj))
+            apply_import_transforms(brush_obj, opts.model_scale, opts.apply_transforms)
+            ctx.objects.append(brush_obj)
+            if opts.low_memory:
+                ctx.brush_mesh = None
+            yield
+
+        for ob in ctx.objects:
+            # Lets the texture library tell which maps are still in the file
+            ob["bsp_map"] = ctx.name
+
+        if not pre.split_requested:
+            # Stored for updating this import later, after the map gets recompiled
+            ctx.obj["bsp_lump_hashes"] = pre.lump_hashes
+            ctx.obj["bsp_geometry_key"] = pre.geometry_key
+            ctx.obj["bsp_lighting_key"] = pre.lighting_key
+        pre.stage = "Done"
+        pre.progress = 1.0
+
+
+    def abort(self):
+        """
+        After a cancel or an error during build(): removes the objects this import created so far.  An updated previous import is kept.
+        """
+        if self.ctx is None or self.previous_obj:
+            return
+        for ob in set(self.ctx.objects) | {self.ctx.obj}:
+            if ob is not None and ob.name in bpy.data.objects:
+                mesh = ob.data
+                bpy.data.objects.remove(ob)
+                if mesh is not None and mesh.users == 0:
+                    bpy.data.meshes.remove(mesh)
+        self.ctx.objects = []
+        self.ctx.obj = self.ctx.mesh = None
+
+
+    def finish(self):
+        # Nothing should hold on to the file data/arrays after the import, the created objects are all that's left
+        self.preprocessor.file_bytes = None
+        if self.ctx:
+            self.preprocessor.memory.report(self.ctx.name)
+            self.ctx.release()
+
+
+    def run(self):
+        try:
+            if self.prepare():
+                self.preprocess()
+                for _ in self.build():
+                    pass
+        except Exception as e:
+            print(f"ERROR loading .BSP file: {e}")
+            traceback.print_exc()
+        finally:
+            self.finish()
 
 
+def load_idtech2_bsp(bsp_path, model_scale, apply_transforms, search_from_parent, apply_lightmaps, lightmap_influence, show_entities,
+                     pvs_cull='NONE', region=None, area_import='NONE', areas="", skip_nodraw=True, separate_special_faces=False,
+                     optimize_mesh=False, weld_distance=0.01, chunk_mode='NONE', chunk_size=10.0, chunk_depth=4, reimport=False,
+                     shared_library=False, use_paks=True, pak_map="", texture_mip=0, cache_textures=False, texture_cache_dir="",
+                     geometry_only=False, use_import_cache=False, import_cache_dir="", low_memory=False, import_brushes=False,
+                     brush_contents=CONTENTS_SOLID | CONTENTS_WINDOW, triangulate=False, collapse_uniform_lightmaps=False,
+                     lightmap_mode='ATLAS', smooth_vertex_lightmaps=False, texture_atlas=False):
+    """
+    Imports a .bsp file, or with pak_map (e.g. "base1" or "maps/base1.bsp") the map out of the .pak files in bsp_path's folder.
+    With use_import_cache, the preprocessed map (everything up to creating the mesh) is saved as a snapshot in import_cache_dir,
+    and imported straight from that the next time, as long as the map, the import options and the texture sizes are the same.
+    low_memory lets go of every intermediate (file data, decoded textures, arrays) as soon as it's been used, for big maps.
+    import_brushes adds the convex volumes of the brushes with any of the brush_contents CONTENTS_* flags, as "<map>_brushes".
+    triangulate imports (fan) triangles instead of the BSP's polygons.
+    collapse_uniform_lightmaps packs lightmaps of a single color as 1 texel (identical lightmaps are always packed once).
+    lightmap_mode 'VERTEX' bakes the lightmaps to a "Lightmap" color attribute instead of an atlas, averaged over every vertex's
+    faces with smooth_vertex_lightmaps.
+    texture_atlas packs the (not animated) textures into a few atlas images, with a material per atlas (see pack_texture_atlas).
+    Runs the whole import right away, see bsp_import_job for running it in steps.
+    """
+    options = bsp_import_options(model_scale=model_scale, apply_transforms=apply_transforms, search_from_parent=search_from_parent,
+                                 apply_lightmaps=apply_lightmaps, lightmap_influence=lightmap_influence, show_entities=show_entities,
+                                 pvs_cull=pvs_cull, region=region, area_import=area_import, areas=areas, skip_nodraw=skip_nodraw,
+                                 separate_special_faces=separate_special_faces, optimize_mesh=optimize_mesh, weld_distance=weld_distance,
+                                 chunk_mode=chunk_mode, chunk_size=chunk_size, chunk_depth=chunk_depth, reimport=reimport,
+                                 shared_library=shared_library, use_paks=use_paks, pak_map=pak_map, texture_mip=texture_mip,
+                                 cache_textures=cache_textures, texture_cache_dir=texture_cache_dir, geometry_only=geometry_only,
+                                 use_import_cache=use_import_cache, import_cache_dir=import_cache_dir, low_memory=low_memory,
+                                 import_brushes=import_brushes, brush_contents=brush_contents, triangulate=triangulate,
+                                 collapse_uniform_lightmaps=collapse_uniform_lightmaps, lightmap_mode=lightmap_mode,
+                                 smooth_vertex_lightmaps=smooth_vertex_lightmaps, texture_atlas=texture_atlas)
+    bsp_import_job(bsp_path, options).run()
+    return {'FINISHED'}
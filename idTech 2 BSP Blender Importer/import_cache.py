@@ -0,0 +1,96 @@
+import os
+import re
+import zipfile
+import numpy as np
+
+from .utils import hash_bytes
+
+
+# Bump whenever what's stored (or how it's computed) changes, older snapshots are then just not found anymore
+IMPORT_CACHE_VERSION = 2
+
+# Import context arrays as they are once the map is preprocessed, right before the mesh is created
+CACHED_ARRAYS = ("vertices", "loop_vertices", "loop_starts", "loop_totals", "bsp_face_indices", "faces", "face_classes", "lightmap_extents", "uvs")
+CACHED_LIGHTMAP_ARRAYS = ("lightmap_pixels", "lightmap_uvs", "lightmap_colors", "lit_faces")
+
+
+def get_import_cache_key(*inputs):
+    """
+    Key of a snapshot: everything the preprocessed import depends on (lump hashes, import options, texture search folder...).
+    """
+    return hash_bytes(repr((IMPORT_CACHE_VERSION, *inputs)).encode())
+
+
+def get_import_cache_path(cache_dir, map_name, key):
+    safe_name = re.sub(r'[^\w.-]', '_', map_name)
+    return os.path.join(cache_dir, f"{safe_name}.{key}.npz")
+
+
+def save_import_cache(path, ctx):
+    """
+    Writes a snapshot of the preprocessed import: geometry and UV arrays, the packed lightmap atlas or vertex colors (if any), and where every
+    texture was found along with its size.  Written to a temporary file first, so an interrupted save never leaves a broken snapshot.
+    """
+    arrays = {name: getattr(ctx, name) for name in CACHED_ARRAYS}
+    arrays.update({name: getattr(ctx, name) for name in CACHED_LIGHTMAP_ARRAYS if getattr(ctx, name) is not None})
+
+    texture_names = sorted(ctx.texture_source_dict)
+    arrays["texture_names"] = np.array(texture_names, dtype=str)
+    arrays["texture_paths"] = np.array([ctx.texture_source_dict[name][0] for name in texture_names], dtype=str)
+    arrays["texture_members"] = np.array([ctx.texture_source_dict[name][1] for name in texture_names], dtype=str)
+
+    sized_names = sorted(ctx.texture_resolution_dict)
+    arrays["sized_texture_names"] = np.array(sized_names, dtype=str)
+    arrays["texture_sizes"] = np.array([ctx.texture_resolution_dict[name] for name in sized_names], dtype=np.int64).reshape(-1, 2)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"ERROR saving import cache {path}: {e}")
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+        return
+    print(f"Saved import cache: {path} ({os.path.getsize(path) // 1024} KB)")
+
+
+def load_import_cache(path):
+    """
+    The arrays of a snapshot by name, or None if there isn't one (or it can't be read).
+    """
+    if not os.path.isfile(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            cached = {name: data[name] for name in data.files}
+    except (OSError, ValueError, zipfile.BadZipFile) as e:
+        print(f"ERROR reading import cache {path}, ignoring it: {e}")
+        return None
+
+    missing = [name for name in CACHED_ARRAYS if name not in cached]
+    if missing:
+        print(f"Import cache {path} is missing {missing}, ignoring it")
+        return None
+    print(f"Loaded import cache: {path}")
+    return cached
+
+
+def restore_import_cache(ctx, cached):
+    """
+    Puts a snapshot's arrays back on the import context, as if it had just been preprocessed.  Texture sources go into
+    ctx.texture_source_dict, so they're used instead of searching for the files again.
+    Returns the texture sizes the snapshot's UVs were computed with, name -> (width, height).
+    """
+    for name in CACHED_ARRAYS:
+        setattr(ctx, name, cached[name])
+    for name in CACHED_LIGHTMAP_ARRAYS:
+        if name in cached:
+            setattr(ctx, name, cached[name])
+
+    ctx.texture_source_dict = {name: (path, member) for name, path, member in zip(cached["texture_names"].tolist(),
+                                                                                 cached["texture_paths"].tolist(),
+                                                                                 cached["texture_members"].tolist())}
+    return {name: tuple(size) for name, size in zip(cached["sized_texture_names"].tolist(), cached["texture_sizes"].tolist())}
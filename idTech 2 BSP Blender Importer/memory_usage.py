@@ -0,0 +1,126 @@
+import os
+import sys
+import ctypes
+
+try:
+    import resource
+except ImportError:     # Windows
+    resource = None
+
+
+def get_windows_memory_counters():
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [("cb", wintypes.DWORD),
+                    ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t),
+                    ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t),
+                    ("PeakPagefileUsage", ctypes.c_size_t)]
+
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    get_current_process = ctypes.windll.kernel32.GetCurrentProcess
+    get_current_process.restype = wintypes.HANDLE
+    if not ctypes.windll.psapi.GetProcessMemoryInfo(get_current_process(), ctypes.byref(counters), counters.cb):
+        return None
+    return counters
+
+
+def read_proc_status(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field):
+                return int(line.split()[1]) * 1024
+    return None
+
+
+def get_peak_rss():
+    """
+    Most memory (resident set size, in bytes) this process has used so far, or None if unknown.  The kernel's counter is
+    never reset here: it belongs to the whole process (Blender and everything else in it).
+    """
+    try:
+        if sys.platform.startswith("linux"):
+            return read_proc_status("VmHWM:")
+        elif sys.platform == "win32":
+            counters = get_windows_memory_counters()
+            return counters.PeakWorkingSetSize if counters else None
+        elif resource:
+            # Bytes on macOS (kilobytes on Linux, handled above)
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except (OSError, ValueError, AttributeError):
+        pass
+    return None
+
+
+def get_current_rss():
+    """
+    Memory (resident set size, in bytes) this process uses right now, or None if unknown (macOS).
+    """
+    try:
+        if sys.platform.startswith("linux"):
+            return read_proc_status("VmRSS:")
+        elif sys.platform == "win32":
+            counters = get_windows_memory_counters()
+            return counters.WorkingSetSize if counters else None
+    except (OSError, ValueError, AttributeError):
+        pass
+    return None
+
+
+def format_size(size):
+    return "unknown" if size is None else f"{size / (1024 * 1024):.0f} MB"
+
+
+class stage_memory_log(object):
+    """
+    Peak memory of every stage of an import, as how much it grew over what the process used when the stage began.
+    The process' peak can only go up, so a stage's own peak is exact when it set a new one; otherwise it's only known to
+    be at most the peak so far (shown with "<=").  Without the current memory use (macOS) only the process' peak is shown.
+    It's the whole process: Blender and anything else running in it, except for stages run in a worker process.
+    """
+
+    def __init__(self):
+        self.stages = []            # (stage, growth bytes or None, exact, process peak bytes or None, process id)
+        self.stage = None
+        self.start_rss = None
+        self.start_peak = None
+
+
+    def begin(self, stage):
+        self.end()
+        self.stage = stage
+        self.start_rss = get_current_rss()
+        self.start_peak = get_peak_rss()
+
+
+    def end(self):
+        if self.stage is None:
+            return
+        peak = get_peak_rss()
+        exact = peak is not None and self.start_peak is not None and peak > self.start_peak
+        growth = None
+        if peak is not None and self.start_rss is not None:
+            growth = max(peak - self.start_rss, 0)
+        self.stages.append((self.stage, growth, exact, peak, os.getpid()))
+        self.stage = None
+
+
+    def report(self, name):
+        self.end()
+        if not self.stages:
+            return
+        print(f"{name}: peak memory per stage (growth over the stage's start, process peak)")
+        for stage, growth, exact, peak, pid in self.stages:
+            where = "" if pid == os.getpid() else f" (worker process {pid})"
+            bound = "" if exact else "<= "
+            if growth is None:
+                print(f"    {stage + ':':<24}{bound}{format_size(peak)}{where}")
+            else:
+                print(f"    {stage + ':':<24}{bound}+{format_size(growth)}, {format_size(peak)}{where}")
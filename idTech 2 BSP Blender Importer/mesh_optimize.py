@@ -0,0 +1,279 @@
+import numpy as np
+
+
+def lists_to_loops(face_verts_list):
+    """
+    List of vertex index lists (one per polygon) -> flat loop arrays: loop vertices, loop start and loop total per polygon.
+    """
+    loop_totals = np.array([len(vert_indices) for vert_indices in face_verts_list], dtype=np.int64)
+    loop_vertices = np.fromiter((vidx for vert_indices in face_verts_list for vidx in vert_indices), dtype=np.int64, count=int(loop_totals.sum()))
+    return loop_vertices, np.cumsum(loop_totals) - loop_totals, loop_totals
+
+
+def loops_to_lists(loop_vertices, loop_starts, loop_totals):
+    loop_vertices = loop_vertices.tolist()
+    return [loop_vertices[start : start + total] for start, total in zip(loop_starts.tolist(), loop_totals.tolist())]
+
+
+def get_next_loops(loop_starts, loop_totals):
+    """
+    Index of the next loop within the same polygon, wrapping around at the end of each polygon.
+    """
+    loop_indices = np.arange(int(loop_totals.sum()))
+    poly_starts = np.repeat(loop_starts, loop_totals)
+    return poly_starts + (loop_indices - poly_starts + 1) % np.repeat(loop_totals, loop_totals)
+
+
+def fan_triangulate(loop_starts, loop_totals):
+    """
+    Fan triangulation of convex polygons: the first corner of each with every pair of neighbouring corners after it.
+    Returns (the 3 loops of every triangle as a (triangles, 3) array, the polygon of every triangle).
+    """
+    tri_counts = np.maximum(loop_totals - 2, 0)
+    tri_polys = np.repeat(np.arange(len(loop_totals)), tri_counts)
+    tri_offsets = np.arange(len(tri_polys)) - np.repeat(np.cumsum(tri_counts) - tri_counts, tri_counts)
+    first_loops = loop_starts[tri_polys]
+    return np.stack((first_loops, first_loops + tri_offsets + 1, first_loops + tri_offsets + 2), axis=1), tri_polys
+
+
+def weld_vertices(coords, loop_vertices, loop_starts, loop_totals, tolerance):
+    """
+    Merges vertices that land in the same tolerance sized grid cell, then removes the repeated corners that can leave
+    in a polygon.  Polygons with fewer than 3 corners left are dropped.
+    Returns (coords, loop_vertices, loop_starts, loop_totals, kept polygon indices).
+    """
+    keys = np.round(np.asarray(coords, dtype=np.float64) / tolerance).astype(np.int64)
+    _, first_indices, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    loop_vertices = inverse.ravel()[loop_vertices]
+
+    # A corner welded onto the next one in the same polygon is now a zero length edge
+    keep_loops = loop_vertices != loop_vertices[get_next_loops(loop_starts, loop_totals)]
+    poly_of_loop = np.repeat(np.arange(len(loop_totals)), loop_totals)
+    loop_totals = np.bincount(poly_of_loop[keep_loops], minlength=len(loop_totals))
+    loop_vertices = loop_vertices[keep_loops]
+
+    kept_polys = np.flatnonzero(loop_totals >= 3)
+    keep_loops = np.repeat(loop_totals >= 3, loop_totals)
+    loop_vertices = loop_vertices[keep_loops]
+    loop_totals = loop_totals[kept_polys]
+
+    # Compact, so vertices nothing uses anymore don't end up in the mesh
+    used_verts, loop_vertices = np.unique(loop_vertices, return_inverse=True)
+    coords = np.asarray(coords)[first_indices][used_verts]
+
+    return coords, loop_vertices.ravel(), np.cumsum(loop_totals) - loop_totals, loop_totals, kept_polys
+
+
+def merge_loops(loop_a, loop_b, v0, v1):
+    """
+    Joins 2 polygons sharing the edge v0 -> v1 (in loop_a, so v1 -> v0 in loop_b).
+    If they share a longer chain of edges, the inner vertices of the chain are removed as well.
+    Returns None if they don't actually share it (anymore), or the result would touch itself.
+    """
+    n_a, n_b = len(loop_a), len(loop_b)
+    for i in range(n_a):
+        if loop_a[i] == v0 and loop_a[(i + 1) % n_a] == v1:
+            break
+    else:
+        return None
+    for j in range(n_b):
+        if loop_b[j] == v1 and loop_b[(j + 1) % n_b] == v0:
+            break
+    else:
+        return None
+
+    # loop_a from v1 around to v0, then loop_b from v0 around to v1 without repeating either end
+    merged = [loop_a[(i + 1 + k) % n_a] for k in range(n_a)] + [loop_b[(j + 2 + k) % n_b] for k in range(n_b - 2)]
+
+    # Any other shared edge shows up as a back and forth "spike" (x, y, x), remove those until there are none left
+    spike_found = True
+    while spike_found and len(merged) >= 3:
+        spike_found = False
+        n = len(merged)
+        for k in range(n):
+            if merged[k - 1] == merged[(k + 1) % n]:
+                merged = [vidx for idx, vidx in enumerate(merged) if idx not in (k, (k + 1) % n)]
+                spike_found = True
+                break
+
+    if len(merged) < 3 or len(set(merged)) != len(merged):
+        return None
+    return merged
+
+
+def is_convex(coords, loop, normal, epsilon=1e-4):
+    corners = coords[loop]
+    edges = np.roll(corners, -1, axis=0) - corners
+    turns = np.cross(edges, np.roll(edges, -1, axis=0)) @ normal
+    scale = np.linalg.norm(edges, axis=1) * np.linalg.norm(np.roll(edges, -1, axis=0), axis=1)
+    return bool(np.all(turns >= -epsilon * scale) or np.all(turns <= epsilon * scale))
+
+
+def get_components(num_items, links_a, links_b):
+    """
+    Connected components of items joined by links (pairs of item indices), all at once: every item's component,
+    named after its lowest item.  Roots are hooked onto the lower of every link's two roots, then paths are halved, until
+    every link is within one component.
+    """
+    labels = np.arange(num_items)
+    while len(links_a):
+        roots_a, roots_b = labels[links_a], labels[links_b]
+        if np.array_equal(roots_a, roots_b):
+            break
+        lower = np.minimum(roots_a, roots_b)
+        np.minimum.at(labels, roots_a, lower)
+        np.minimum.at(labels, roots_b, lower)
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+    return labels
+
+
+def get_component_outlines(coords, edge_starts, edge_ends, loop_components, boundary_loops, component_normals, epsilon=1e-4):
+    """
+    The outline of every component of joined polygons, from its boundary loops (the ones no other polygon of it runs back along).
+    Returns {component: outline vertices} for the components whose boundary is one simple, convex loop, i.e. the ones the
+    polygons can become in one go.  The others (holes, pinched corners, concave) are left out.
+    """
+    num_verts = len(coords)
+    components = loop_components[boundary_loops]
+    starts, ends = edge_starts[boundary_loops], edge_ends[boundary_loops]
+
+    # Every corner of a simple outline has 1 edge leaving it, which the edge before ends at
+    start_keys = components * num_verts + starts
+    order = np.argsort(start_keys, kind='stable')
+    sorted_keys = start_keys[order]
+    repeated = sorted_keys[1:] == sorted_keys[:-1]
+    bad = set(components[order[1:][repeated]].tolist())
+    end_keys = components * num_verts + ends
+    found = np.minimum(np.searchsorted(sorted_keys, end_keys), len(sorted_keys) - 1)
+    successors = order[found]
+    missing = sorted_keys[found] != end_keys
+    bad.update(components[missing].tolist())
+    successors[missing] = np.flatnonzero(missing)
+
+    # Convex: every corner turns the same way (straight ones, where the polygons met the outline, are fine)
+    predecessors = np.empty_like(successors)
+    predecessors[successors] = np.arange(len(successors))
+    edges_out = coords[ends] - coords[starts]
+    edges_in = edges_out[predecessors]
+    lengths = np.linalg.norm(edges_in, axis=1) * np.linalg.norm(edges_out, axis=1)
+    turns = np.einsum('ij,ij->i', np.cross(edges_in, edges_out), component_normals[components]) / np.maximum(lengths, 1e-12)
+    min_turns = np.full(len(loop_components), np.inf)
+    max_turns = np.full(len(loop_components), -np.inf)
+    np.minimum.at(min_turns, components, turns)
+    np.maximum.at(max_turns, components, turns)
+    convex = (min_turns >= -epsilon) | (max_turns <= epsilon)
+
+    # Walk every outline from its first boundary loop; coming back early means more than one loop (a hole)
+    outlines = {}
+    counts = np.bincount(components, minlength=len(loop_components))
+    successors = successors.tolist()
+    starts = starts.tolist()
+    for component, first in zip(*np.unique(components, return_index=True)):
+        component = int(component)
+        if component in bad or not convex[component]:
+            continue
+        outline = []
+        index = int(first)
+        while True:
+            outline.append(starts[index])
+            index = successors[index]
+            if index == first or len(outline) > counts[component]:
+                break
+        if len(outline) == counts[component] and len(outline) >= 3:
+            outlines[component] = outline
+    return outlines
+
+
+def merge_coplanar_polygons(coords, loop_vertices, loop_starts, loop_totals, poly_groups, poly_normals, poly_mergeable):
+    """
+    Merges neighbouring polygons that share an edge and the same group (same plane, side and texture info), as long as
+    they stay convex.  Only polygons flagged in poly_mergeable are considered (e.g. lightmapped ones only where their
+    lightmaps allow it).
+    The polygons joined by shared edges are found all at once; where their outline is one convex loop (most of them:
+    the BSP compiler cut up a convex face) that's the merged polygon.  Only the rest are merged greedily, a pair at a time.
+    Returns (loop_vertices, loop_starts, loop_totals, kept polygon indices).  Merged polygons keep the lowest polygon index.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    next_loops = get_next_loops(loop_starts, loop_totals)
+    poly_of_loop = np.repeat(np.arange(len(loop_totals)), loop_totals)
+    edge_starts = loop_vertices
+    edge_ends = loop_vertices[next_loops]
+
+    # Find pairs of loops running along the same edge, by sorting an undirected edge key
+    num_verts = len(coords)
+    edge_keys = np.minimum(edge_starts, edge_ends) * num_verts + np.maximum(edge_starts, edge_ends)
+    candidates = np.flatnonzero(poly_mergeable[poly_of_loop])
+    order = candidates[np.argsort(edge_keys[candidates], kind='stable')]
+    same_edge = edge_keys[order[:-1]] == edge_keys[order[1:]]
+    first, second = order[:-1][same_edge], order[1:][same_edge]
+
+    # Opposite directions (consistent winding) and same group
+    valid = (edge_starts[first] == edge_ends[second]) & \
+            (poly_groups[poly_of_loop[first]] == poly_groups[poly_of_loop[second]]) & \
+            (poly_of_loop[first] != poly_of_loop[second])
+    first, second = first[valid], second[valid]
+
+    # Components of polygons joined by shared edges, and their outlines: the loops not paired with another one.
+    # A loop paired twice (more than 2 polygons on an edge) leaves its component to the greedy merge.
+    components = get_components(len(loop_totals), poly_of_loop[first], poly_of_loop[second])
+    loop_components = components[poly_of_loop]
+    pair_counts = np.bincount(np.concatenate((first, second)), minlength=len(loop_vertices))
+    joined = np.bincount(components, minlength=len(loop_totals))[loop_components] > 1
+    boundary_loops = np.flatnonzero(joined & (pair_counts == 0))
+    outlines = get_component_outlines(coords, edge_starts, edge_ends, loop_components, boundary_loops, poly_normals)
+    for component in np.unique(loop_components[pair_counts > 1]).tolist():
+        outlines.pop(component, None)
+
+    loops = dict(outlines)
+    parents = np.arange(len(loop_totals))
+    merged_at_once = np.isin(components, list(outlines))
+    parents[merged_at_once] = components[merged_at_once]
+    def find(poly):
+        while parents[poly] != poly:
+            parents[poly] = parents[parents[poly]]
+            poly = parents[poly]
+        return poly
+
+    # The rest, a pair at a time.  A merge that would be concave now may work out once its neighbours are merged
+    # (e.g. an L of 3), so rejected pairs are retried as long as one of their polygons has grown since
+    greedy = ~merged_at_once[poly_of_loop[first]]
+    pending = list(zip(first[greedy].tolist(), second[greedy].tolist()))
+    grown = None
+    while pending:
+        rejected = []
+        newly_grown = set()
+        for loop_a, loop_b in pending:
+            poly_a, poly_b = find(poly_of_loop[loop_a]), find(poly_of_loop[loop_b])
+            if poly_a == poly_b:
+                continue
+            if grown is not None and poly_a not in grown and poly_b not in grown:
+                rejected.append((loop_a, loop_b))
+                continue
+            for poly in (poly_a, poly_b):
+                if poly not in loops:
+                    loops[poly] = loop_vertices[loop_starts[poly] : loop_starts[poly] + loop_totals[poly]].tolist()
+
+            merged = merge_loops(loops[poly_a], loops[poly_b], int(edge_starts[loop_a]), int(edge_ends[loop_a]))
+            if merged is None or not is_convex(coords, merged, poly_normals[poly_a]):
+                rejected.append((loop_a, loop_b))
+                continue
+
+            keep, drop = min(poly_a, poly_b), max(poly_a, poly_b)
+            loops[keep] = merged
+            del loops[drop]
+            parents[drop] = keep
+            newly_grown.add(keep)
+        if not newly_grown:
+            break
+        pending = rejected
+        grown = newly_grown
+
+    kept_polys = np.flatnonzero(parents == np.arange(len(loop_totals)))
+    new_loops = [loops[poly] if poly in loops else loop_vertices[loop_starts[poly] : loop_starts[poly] + loop_totals[poly]].tolist()
+                 for poly in kept_polys.tolist()]
+    loop_vertices, loop_starts, loop_totals = lists_to_loops(new_loops)
+    return loop_vertices, loop_starts, loop_totals, kept_polys
@@ -0,0 +1,170 @@
+import bpy
+import numpy as np
+
+from .utils import expand_ranges
+
+
+# Attribute data types -> the property foreach_get/foreach_set works on, and its number of components
+ATTRIBUTE_LAYOUTS = {
+    'FLOAT': ('value', 1),
+    'INT': ('value', 1),
+    'INT8': ('value', 1),
+    'BOOLEAN': ('value', 1),
+    'FLOAT2': ('vector', 2),
+    'FLOAT_VECTOR': ('vector', 3),
+    'FLOAT_COLOR': ('color', 4),
+    'BYTE_COLOR': ('color', 4),
+}
+
+ATTRIBUTE_NUMPY_TYPES = {
+    'FLOAT': np.float32,
+    'INT': np.int32,
+    'INT8': np.int8,
+    'BOOLEAN': bool,
+    'FLOAT2': np.float32,
+    'FLOAT_VECTOR': np.float32,
+    'FLOAT_COLOR': np.float32,
+    'BYTE_COLOR': np.float32,
+}
+
+
+def read_mesh_arrays(mesh):
+    """
+    Pulls everything needed to rebuild (parts of) a mesh out in bulk with foreach_get:
+    vertex positions, polygon loop ranges, loop vertices, material indices, UV layers and the custom attributes
+    (e.g. bsp_face_index), so nothing has to be recomputed per part.
+    """
+    co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", co)
+
+    loop_starts = np.empty(len(mesh.polygons), dtype=np.int32)
+    loop_totals = np.empty(len(mesh.polygons), dtype=np.int32)
+    material_indices = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get("loop_start", loop_starts)
+    mesh.polygons.foreach_get("loop_total", loop_totals)
+    mesh.polygons.foreach_get("material_index", material_indices)
+
+    loop_vertices = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get("vertex_index", loop_vertices)
+
+    uv_layers = {}
+    for uv_layer in mesh.uv_layers:
+        uvs = np.empty(len(mesh.loops) * 2, dtype=np.float32)
+        uv_layer.data.foreach_get("uv", uvs)
+        uv_layers[uv_layer.name] = uvs.reshape(-1, 2)
+
+    attributes = {}
+    for attribute in mesh.attributes:
+        # Skip internal/built in layers and the UV maps, which are already handled above
+        if attribute.name.startswith('.') or attribute.name in uv_layers or attribute.name in ("position", "material_index"):
+            continue
+        if attribute.domain not in ('POINT', 'FACE', 'CORNER') or attribute.data_type not in ATTRIBUTE_LAYOUTS:
+            continue
+        prop, components = ATTRIBUTE_LAYOUTS[attribute.data_type]
+        values = np.empty(len(attribute.data) * components, dtype=ATTRIBUTE_NUMPY_TYPES[attribute.data_type])
+        attribute.data.foreach_get(prop, values)
+        attributes[attribute.name] = (attribute.domain, attribute.data_type, values.reshape(len(attribute.data), components))
+
+    return {
+        'co': co.reshape(-1, 3),
+        'loop_starts': loop_starts,
+        'loop_totals': loop_totals,
+        'material_indices': material_indices,
+        'loop_vertices': loop_vertices,
+        'uv_layers': uv_layers,
+        'active_uv': mesh.uv_layers.active.name if mesh.uv_layers.active else None,
+        'attributes': attributes,
+    }
+
+
+def fill_mesh(mesh, coords, loop_vertices, loop_starts, loop_totals):
+    """
+    Writes vertices and polygons (as flat loop arrays) into an empty mesh with foreach_set,
+    instead of going through from_pydata's per polygon lists.
+    """
+    mesh.vertices.add(len(coords))
+    mesh.vertices.foreach_set("co", np.asarray(coords, dtype=np.float32).ravel())
+
+    mesh.loops.add(len(loop_vertices))
+    mesh.loops.foreach_set("vertex_index", np.asarray(loop_vertices, dtype=np.int32))
+
+    mesh.polygons.add(len(loop_totals))
+    mesh.polygons.foreach_set("loop_start", np.asarray(loop_starts, dtype=np.int32))
+    if (bpy.app.version < (4,0,0)):
+        mesh.polygons.foreach_set("loop_total", np.asarray(loop_totals, dtype=np.int32))
+
+    mesh.update(calc_edges=True)
+
+
+def build_mesh_from_arrays(name, arrays, poly_indices, materials):
+    """
+    Creates a new mesh from the given polygons of the arrays from read_mesh_arrays.
+    Only the vertices and materials those polygons use are kept, so the mesh (and its bounding box) is as tight as it can be.
+    """
+    poly_indices = np.asarray(poly_indices, dtype=np.int64)
+    loop_totals = arrays['loop_totals'][poly_indices]
+    loop_indices = expand_ranges(arrays['loop_starts'][poly_indices], loop_totals)
+
+    used_verts, loop_vertices = np.unique(arrays['loop_vertices'][loop_indices], return_inverse=True)
+    used_materials, material_indices = np.unique(arrays['material_indices'][poly_indices], return_inverse=True)
+
+    mesh = bpy.data.meshes.new(name)
+    fill_mesh(mesh, arrays['co'][used_verts], loop_vertices, np.cumsum(loop_totals) - loop_totals, loop_totals)
+    mesh.polygons.foreach_set("material_index", material_indices.astype(np.int32))
+
+    for material_index in used_materials:
+        mesh.materials.append(materials[material_index] if material_index < len(materials) else None)
+
+    for uv_name, uvs in arrays['uv_layers'].items():
+        uv_layer = mesh.uv_layers.new(name=uv_name)
+        uv_layer.data.foreach_set("uv", uvs[loop_indices].ravel())
+    if arrays['active_uv'] in mesh.uv_layers:
+        mesh.uv_layers.active = mesh.uv_layers[arrays['active_uv']]
+
+    domain_indices = {'POINT': used_verts, 'FACE': poly_indices, 'CORNER': loop_indices}
+    for attribute_name, (domain, data_type, values) in arrays['attributes'].items():
+        attribute = mesh.attributes.new(name=attribute_name, type=data_type, domain=domain)
+        prop = ATTRIBUTE_LAYOUTS[data_type][0]
+        attribute.data.foreach_set(prop, values[domain_indices[domain]].ravel())
+
+    return mesh
+
+
+def split_object(obj, poly_groups, group_names, group_collections=None):
+    """
+    Replaces obj with one object per group of polygons.
+    poly_groups:        group id for every polygon of obj's mesh
+    group_names:        dict of group id -> object name
+    group_collections:  optional dict of group id -> collection to link that object into (default: obj's collections)
+    Returns the list of new objects.  The original object and mesh are removed first, so a part can take over its name.
+    """
+    arrays = read_mesh_arrays(obj.data)
+    materials = list(obj.data.materials)
+    collections = list(obj.users_collection)
+    obj_name = obj.name
+    matrix_world = obj.matrix_world.copy()
+    poly_groups = np.asarray(poly_groups)
+
+    old_mesh = obj.data
+    bpy.data.objects.remove(obj, do_unlink=True)
+    bpy.data.meshes.remove(old_mesh)
+
+    # Sort once, then every group is a contiguous run of polygon indices
+    order = np.argsort(poly_groups, kind='stable')
+    groups, group_starts = np.unique(poly_groups[order], return_index=True)
+    group_ends = np.append(group_starts[1:], len(order))
+
+    new_objects = []
+    for group, start, end in zip(groups, group_starts, group_ends):
+        name = group_names.get(group.item(), f"{obj_name}_{group}")
+        mesh = build_mesh_from_arrays(name, arrays, order[start:end], materials)
+        new_obj = bpy.data.objects.new(name, mesh)
+        new_obj.matrix_world = matrix_world
+
+        target_collections = [group_collections[group.item()]] if group_collections else collections
+        for collection in target_collections:
+            collection.objects.link(new_obj)
+        new_objects.append(new_obj)
+
+    print(f"Split {obj_name} ({len(poly_groups)} polygons) into {len(new_objects)} objects")
+    return new_objects
@@ -0,0 +1,184 @@
+import os
+import re
+import mmap
+import struct
+import numpy as np
+
+
+PAK_MAGIC = b"PACK"
+
+# Directory entry: 56 byte name, then offset and length of the member in the .pak
+pak_entry_dtype = np.dtype([
+    ('name', 'S56'),
+    ('offset', '<i4'),
+    ('length', '<i4'),
+])
+
+
+def normalize_member_name(name):
+    return name.replace('\\', '/').lstrip('/').casefold()
+
+
+class pak_file(object):
+    """
+    One .pak archive, memory mapped.  The directory table is read into a dict (normalized member name -> (offset, length)),
+    and members are served as memoryview slices of the map, so nothing is extracted or copied until it's actually used.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.file = open(self.path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+
+        magic, dir_offset, dir_length = struct.unpack_from("<4sii", self.map, 0)
+        if magic != PAK_MAGIC:
+            self.close()
+            raise ValueError(f"Not a PAK file (magic {magic}): {path}")
+
+        entries = np.frombuffer(self.map, dtype=pak_entry_dtype, count=dir_length // pak_entry_dtype.itemsize, offset=dir_offset)
+        self.members = {}
+        for name, offset, length in zip(entries['name'].tolist(), entries['offset'].tolist(), entries['length'].tolist()):
+            self.members[normalize_member_name(name.split(b'\x00', 1)[0].decode('ascii', 'ignore'))] = (offset, length)
+        del entries
+
+        stat = os.stat(self.path)
+        self.signature = f"{os.path.normcase(self.path)}|{stat.st_size}|{stat.st_mtime_ns}"
+        print(f"PAK {self.path}: {len(self.members)} files")
+
+
+    def read(self, name):
+        """
+        Member contents as a zero-copy memoryview, or None if the PAK doesn't have it.
+        """
+        entry = self.members.get(normalize_member_name(name))
+        if entry is None:
+            return None
+        offset, length = entry
+        return self.view[offset : offset + length]
+
+
+    def close(self):
+        try:
+            self.view.release()
+            self.map.close()
+        except BufferError:
+            # Something still holds a slice, the map is closed once that goes away
+            print(f"PAK still in use, leaving it open: {self.path}")
+        self.file.close()
+
+
+def get_pak_paths(folder):
+    """
+    The .pak files of a game folder, in the order the engine loads them: pak0, pak1, ... numerically, then any others by name.
+    Later ones override earlier ones.
+    """
+    if not folder or not os.path.isdir(folder):
+        return []
+    paks = [file for file in os.listdir(folder) if file.casefold().endswith(".pak") and os.path.isfile(os.path.join(folder, file))]
+
+    def load_order(file):
+        numbered = re.fullmatch(r"pak(\d+)\.pak", file.casefold())
+        return (0, int(numbered.group(1)), "") if numbered else (1, 0, file.casefold())
+
+    return [os.path.join(folder, file) for file in sorted(paks, key=load_order)]
+
+
+class pak_collection(object):
+    """
+    Several PAKs layered in priority order, like the engine's search path: a member in a later PAK hides the same member
+    in an earlier one.  Lookups are one dict lookup, the index is built once when opening.
+    """
+
+    def __init__(self, paths):
+        self.paks = []
+        for path in paths:
+            try:
+                self.paks.append(pak_file(path))
+            except Exception as e:
+                print(f"ERROR opening PAK {path}: {e}")
+
+        # Member name -> PAK it comes from, highest priority wins
+        self.index = {}
+        for pak in self.paks:
+            for name in pak.members:
+                self.index[name] = pak
+
+        # Member name without its top folder (e.g. "e1u1/floor1_1.wal" for "textures/e1u1/floor1_1.wal"), to find textures by
+        # the name the BSP uses for them
+        self.stem_index = {}
+        for name, pak in self.index.items():
+            if '/' in name:
+                self.stem_index[name.split('/', 1)[1]] = name
+
+
+    @classmethod
+    def from_folder(cls, folder):
+        return cls(get_pak_paths(folder))
+
+
+    def __bool__(self):
+        return bool(self.paks)
+
+
+    def find(self, name):
+        """
+        Normalized member name if any PAK has it, None otherwise.
+        """
+        name = normalize_member_name(name)
+        return name if name in self.index else None
+
+
+    def find_texture(self, texture_name, extensions):
+        """
+        Member for a texture name as used in the BSP (e.g. "e1u1/floor1_1"), trying the extensions in order.
+        """
+        texture_name = normalize_member_name(texture_name)
+        for ext in extensions:
+            for name in (f"textures/{texture_name}{ext}", f"{texture_name}{ext}"):
+                if name in self.index:
+                    return name
+            if f"{texture_name}{ext}" in self.stem_index:
+                return self.stem_index[f"{texture_name}{ext}"]
+        return None
+
+
+    def find_map(self, map_name):
+        """
+        Member of a map, given as a full member name ("maps/base1.bsp") or just the map name ("base1").
+        """
+        for name in (map_name, f"maps/{map_name}", f"maps/{map_name}.bsp", f"{map_name}.bsp"):
+            member = self.find(name)
+            if member:
+                return member
+        return None
+
+
+    def read(self, name):
+        name = normalize_member_name(name)
+        pak = self.index.get(name)
+        return pak.read(name) if pak else None
+
+
+    def get_path(self, name):
+        """
+        Readable "path" of a member, for messages: the PAK's path followed by the member name.
+        """
+        name = normalize_member_name(name)
+        return os.path.join(self.index[name].path, name)
+
+
+    def get_signature(self, name):
+        """
+        Same idea as get_file_signature for a member: changes whenever the PAK holding it changes.
+        """
+        name = normalize_member_name(name)
+        return f"{self.index[name].signature}|{name}"
+
+
+    def close(self):
+        for pak in self.paks:
+            pak.close()
+        self.paks = []
+        self.index = {}
+        self.stem_index = {}
@@ -0,0 +1,116 @@
+import bpy
+import os
+
+from .utils import get_file_signature, hash_bytes
+
+
+class texture_library(object):
+    """
+    Images and materials shared by every map imported from the same game root (the texture search folder).
+    Images are matched by the content hash of their source file and materials by texture name + image, so a second map
+    using the same textures reuses them instead of decoding and building them again, and nothing gets deleted under
+    an earlier map.  Every datablock also lists the maps using it ("bsp_used_by"), so cleaning up is safe.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.normcase(os.path.abspath(root))
+        self.images_by_signature = {}
+        self.images_by_hash = {}
+        self.materials = {}
+
+        for image in bpy.data.images:
+            if image.get("bsp_library_root") == self.root:
+                self.images_by_signature[image.get("bsp_source")] = image
+                self.images_by_hash[image.get("bsp_content_hash")] = image
+
+        for mat in bpy.data.materials:
+            if mat.get("bsp_library_root") == self.root:
+                self.materials[self.material_key(mat["bsp_texture_name"], mat["bsp_content_hash"], mat.get("bsp_lightmap_map", ""))] = mat
+
+        print(f"Texture library {self.root}: {len(self.images_by_hash)} images, {len(self.materials)} materials")
+
+
+    @staticmethod
+    def material_key(texture_name, content_hash, lightmap_map):
+        return (texture_name.casefold(), content_hash, lightmap_map)
+
+
+    def find_image(self, path, signature=None, data=None):
+        """
+        Returns (image or None, file signature, content hash) for a texture file.
+        The file is only read (not decoded) to hash it if its signature (path, size, time) isn't known yet.
+        For textures that aren't files of their own (e.g. in a PAK), pass their signature and contents.
+        """
+        signature = signature or get_file_signature(path)
+        image = self.images_by_signature.get(signature)
+        if image:
+            return image, signature, image["bsp_content_hash"]
+
+        if data is None:
+            with open(path, "rb") as f:
+                data = f.read()
+        content_hash = hash_bytes(data)
+        return self.images_by_hash.get(content_hash), signature, content_hash
+
+
+    def add_image(self, image, signature, content_hash):
+        image["bsp_library_root"] = self.root
+        image["bsp_source"] = signature
+        image["bsp_content_hash"] = content_hash
+        self.images_by_signature[signature] = image
+        self.images_by_hash[content_hash] = image
+
+
+    def find_material(self, texture_name, image, lightmap_map=""):
+        """
+        Material for a texture using this exact image.  Lightmapped materials carry their map's lightmap atlas,
+        so those are only shared with the map they were made for (lightmap_map), the decoded image is still shared.
+        Materials without an image (texture not found, geometry only imports) go by the texture name alone.
+        """
+        content_hash = image.get("bsp_content_hash") if image else ""
+        return self.materials.get(self.material_key(texture_name, content_hash, lightmap_map))
+
+
+    def add_material(self, mat, texture_name, image, lightmap_map=""):
+        mat["bsp_library_root"] = self.root
+        mat["bsp_texture_name"] = texture_name
+        mat["bsp_content_hash"] = image.get("bsp_content_hash") if image else ""
+        mat["bsp_lightmap_map"] = lightmap_map
+        self.materials[self.material_key(texture_name, mat["bsp_content_hash"], lightmap_map)] = mat
+
+
+    def mark_used(self, id_block, map_name):
+        used_by = list(id_block.get("bsp_used_by", []))
+        if map_name not in used_by:
+            used_by.append(map_name)
+            id_block["bsp_used_by"] = used_by
+
+
+def cleanup_library():
+    """
+    Drops maps that aren't in the file anymore from every library datablock's "bsp_used_by" list, then removes the
+    materials and images no remaining map uses.  Datablocks still used by some other object are left alone.
+    Returns (materials removed, images removed).
+    """
+    present_maps = {obj.get("bsp_map") for obj in bpy.data.objects if obj.get("bsp_map")}
+    materials_in_use = {mat for obj in bpy.data.objects if obj.type == 'MESH' for mat in obj.data.materials if mat}
+
+    def update_users(id_block):
+        used_by = [map_name for map_name in id_block.get("bsp_used_by", []) if map_name in present_maps]
+        id_block["bsp_used_by"] = used_by
+        return used_by
+
+    removed_materials = 0
+    for mat in [mat for mat in bpy.data.materials if "bsp_library_root" in mat]:
+        if not update_users(mat) and mat not in materials_in_use:
+            bpy.data.materials.remove(mat)
+            removed_materials += 1
+
+    removed_images = 0
+    for image in [image for image in bpy.data.images if "bsp_library_root" in image]:
+        if not update_users(image) and image.users == 0:
+            bpy.data.images.remove(image)
+            removed_images += 1
+
+    print(f"Texture library cleanup: removed {removed_materials} materials, {removed_images} images")
+    return removed_materials, removed_images
@@ -1,6 +1,7 @@
 import os
 import glob
 import math
+import numpy as np
 from PIL import Image
 
 
@@ -40,4 +41,43 @@ def normalize_vector(vector):
 
 
 def remove_duplicates(lst):
-    return list(dict.fromkeys(lst))
\ No newline at end of file
+    return list(dict.fromkeys(lst))
+
+
+def expand_ranges(starts, counts):
+    """
+    Expands (start, count) pairs into one flat array of indices, e.g. ([0, 10], [2, 3]) -> [0, 1, 10, 11, 12].
+    Used for face edge ranges, polygon loop ranges, leaf face ranges, etc... without a Python loop.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    range_starts = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + (np.arange(int(counts.sum())) - range_starts)
+
+
+def parse_index_list(text):
+    """
+    Parses a list of indices typed in by the user, e.g. "1, 3-5" -> {1, 3, 4, 5}
+    """
+    indices = set()
+    for part in text.replace(' ', '').split(','):
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            indices.update(range(int(first), int(last) + 1))
+        else:
+            indices.add(int(part))
+    return indices
+
+
+def get_file_signature(path):
+    """
+    Cheap "has this file changed" key, without reading the file.
+    """
+    stat = os.stat(path)
+    return f"{os.path.normcase(os.path.abspath(path))}|{stat.st_size}|{stat.st_mtime_ns}"
+
+
+def hash_bytes(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
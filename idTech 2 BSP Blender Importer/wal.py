@@ -12,6 +12,16 @@ ADDON_DIR = Path(__file__).parent
 quake2_colormap = ADDON_DIR / "quake2.lmp"
 
 
+WAL_HEADER_SIZE = 100
+
+
+def read_wal_size(data):
+    """
+    Width and height from a WAL header, without decoding anything.
+    """
+    return struct.unpack_from("<II", data, 32)
+
+
 @dataclass
 class wal_image(object):
     texture_name: str
@@ -28,9 +38,17 @@ class wal_image(object):
     mipmap_level2_size: int
     mipmap_level3_size: int
 
+    mip_level: int      # Mip level decoded into image, width/height stay the full (mip 0) size
+    mip_width: int
+    mip_height: int
+
     image: Image    # PIL Image
 
-    def __init__(self, file_path):
+    def __init__(self, file_path, mip_level=0):
+        """
+        file_path can also be the file contents (bytes, or a memoryview of e.g. a PAK member), nothing is read from disk then.
+        mip_level 1, 2 or 3 decodes the smaller mip maps (1/4, 1/16, 1/64 of the pixels) instead of the full image.
+        """
         super().__init__()
 
         # load palette from quake2.lmp
@@ -43,32 +61,37 @@ class wal_image(object):
         # take first 768 bytes and reshape into (256,3)
         palette = np.frombuffer(lmp_bytes[:768], dtype=np.uint8).reshape((256, 3))
 
-        with open(file_path, 'rb') as f:
-            f.seek(0)
-            self.texture_name = f.read(32).decode("ascii", "ignore").rstrip("\x00")
-            self.width = struct.unpack("<I", f.read(4))[0]
-            self.height = struct.unpack("<I", f.read(4))[0]
-            self.mip_level_offsets = struct.unpack("<IIII", f.read(16))
-            self.anim_name = f.read(32).decode("ascii", "ignore").rstrip("\x00")
-            self.flags = struct.unpack("<i", f.read(4))[0]
-            self.contents = struct.unpack("<i", f.read(4))[0]
-            self.value = struct.unpack("<i", f.read(4))[0]
-
-            self.mipmap_level0_size = self.width * self.height
-            self.mipmap_level1_size = self.mip_level_offsets[2] - self.mip_level_offsets[1]
-            self.mipmap_level2_size = self.mip_level_offsets[3] - self.mip_level_offsets[2]
-
-            f.seek(0,2)
-            self.eof_offset = f.tell()
-            self.mipmap_level3_size = self.eof_offset - self.mip_level_offsets[3]
-
-            f.seek(self.mip_level_offsets[0])
-            self.raw_data = list(f.read(self.mipmap_level0_size))
-
-            self.pixel_cmap_indices = np.array(self.raw_data, dtype=np.uint8).reshape(self.height, self.width)
-            self.image_rgb = palette[self.pixel_cmap_indices]
-
-            self.image = Image.fromarray(np.uint8(self.image_rgb), 'RGB')
+        if isinstance(file_path, (bytes, bytearray, memoryview)):
+            data = file_path
+        else:
+            with open(file_path, 'rb') as f:
+                data = f.read()
+
+        self.texture_name = bytes(data[0:32]).decode("ascii", "ignore").split("\x00")[0]
+        self.width, self.height = struct.unpack_from("<II", data, 32)
+        self.mip_level_offsets = struct.unpack_from("<IIII", data, 40)
+        self.anim_name = bytes(data[56:88]).decode("ascii", "ignore").split("\x00")[0]
+        self.flags, self.contents, self.value = struct.unpack_from("<iii", data, 88)
+
+        self.mipmap_level0_size = self.width * self.height
+        self.mipmap_level1_size = self.mip_level_offsets[2] - self.mip_level_offsets[1]
+        self.mipmap_level2_size = self.mip_level_offsets[3] - self.mip_level_offsets[2]
+
+        self.eof_offset = len(data)
+        self.mipmap_level3_size = self.eof_offset - self.mip_level_offsets[3]
+
+        # Each mip level halves both dimensions
+        self.mip_level = mip_level
+        self.mip_width = max(1, self.width >> mip_level)
+        self.mip_height = max(1, self.height >> mip_level)
+
+        # Palette lookup copies, so the indices can stay a view on the data
+        self.pixel_cmap_indices = np.frombuffer(data, dtype=np.uint8, count=self.mip_width * self.mip_height,
+                                                offset=self.mip_level_offsets[mip_level]).reshape(self.mip_height, self.mip_width)
+        self.image_rgb = palette[self.pixel_cmap_indices]
+        self.pixel_cmap_indices = None
+
+        self.image = Image.fromarray(np.uint8(self.image_rgb), 'RGB')
 
 
 if __name__ == "__main__":
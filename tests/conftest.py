@@ -0,0 +1,55 @@
+"""
+The add-on's folder isn't an importable name, so its modules are loaded as the "idtech2_bsp_importer" package here.
+Tests of what an import makes in Blender need Blender's own bpy module (pip install bpy) and are skipped without it.
+"""
+import importlib
+import os
+import sys
+import types
+
+import pytest
+
+
+ADDON_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "idTech 2 BSP Blender Importer")
+ADDON_PACKAGE = "idtech2_bsp_importer"
+
+
+def load_addon_module(name):
+    if ADDON_PACKAGE not in sys.modules:
+        package = types.ModuleType(ADDON_PACKAGE)
+        package.__path__ = [ADDON_DIR]
+        sys.modules[ADDON_PACKAGE] = package
+    return importlib.import_module(f"{ADDON_PACKAGE}.{name}")
+
+
+def import_map(path, **options):
+    """
+    Imports the map at path into the current Blender scene, at scale 1 and with nothing but the given options.
+    """
+    idtech2_bsp = load_addon_module("idtech2_bsp")
+    arguments = dict(model_scale=1.0, apply_transforms=False, search_from_parent=True, apply_lightmaps=False, lightmap_influence=100,
+                     show_entities=False)
+    arguments.update(options)
+    idtech2_bsp.load_idtech2_bsp(str(path), **arguments)
+
+
+@pytest.fixture
+def blender(monkeypatch):
+    """
+    Blender's bpy module, with a new scene of nothing but its default collection.
+    """
+    bpy = pytest.importorskip("bpy")
+    # Add-on modules first loaded by a test standing in for bpy would otherwise keep the stand-in
+    for name, module in list(sys.modules.items()):
+        if name.startswith(f"{ADDON_PACKAGE}.") and getattr(module, "bpy", bpy) is not bpy:
+            monkeypatch.setattr(module, "bpy", bpy)
+    bpy.ops.wm.read_factory_settings()
+    for obj in list(bpy.data.objects):
+        bpy.data.objects.remove(obj)
+    return bpy
+
+
+@pytest.fixture
+def map_path(tmp_path):
+    from synthetic_bsp import write_map
+    return write_map(tmp_path)
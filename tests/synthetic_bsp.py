@@ -0,0 +1,156 @@
+"""
+A tiny but complete Quake II map, built in memory for the tests:
+
+    Two 128 unit rooms side by side (x -128..0 and 0..128), each a floor ("e1u1/floor") and a ceiling ("e1u1/ceil") quad,
+    every face with its own 10x10 lightmap of random samples.  One node splits them at x = 0, one leaf (cluster, area) per room,
+    and a solid leaf.  Cluster 0 only sees itself, cluster 1 sees both.  Areas 1 and 2 are connected by an area portal.
+    Brushes: a 16 unit slab under each room (CONTENTS_SOLID) and a small CONTENTS_WATER box in room A.
+    Entities: worldspawn and an info_player_start in room B.
+    Animated maps add a 3rd texinfo ("e1u1/lava"): the ceiling and it are a 2 frame animation, the floor leads into it.
+"""
+import struct
+
+import numpy as np
+
+
+LIGHTMAP_SIZE = 10          # samples per side of every face's lightmap
+TEXTURE_NAMES = ("e1u1/floor", "e1u1/ceil")
+ANIMATION_TEXTURE = "e1u1/lava"
+ANIMATION_NEXT_TEXINFOS = (1, 2, 1)
+BRUSH_BOXES = (((-128, 0, -16), (0, 128, 0), 1), ((0, 0, -16), (128, 128, 0), 1), ((-64, 32, 0), (-32, 64, 32), 32))
+PLAYER_START = (64, 64, 32)
+
+
+def face_lightmap(face):
+    return np.random.default_rng(face).integers(0, 255, LIGHTMAP_SIZE * LIGHTMAP_SIZE * 3, dtype=np.uint8)
+
+
+def build_bsp(texture_flags=(0, 0), lightmaps=None, animated=False):
+    """
+    The map's file bytes.  texture_flags are the SURF_* flags of the floor and ceiling texinfos, lightmaps optionally
+    replaces the samples of every face (4 arrays of LIGHTMAP_SIZE * LIGHTMAP_SIZE * 3 bytes).
+    """
+    vertices = []
+    edges = [(0, 0)]
+    surf_edges = []
+    faces = []
+    light = bytearray()
+
+    def add_face(corners, texinfo, plane):
+        first_edge = len(surf_edges)
+        base = len(vertices)
+        vertices.extend(corners)
+        for k in range(4):
+            edges.append((base + k, base + (k + 1) % 4))
+            surf_edges.append(len(edges) - 1)
+        face = len(faces)
+        light_offset = len(light)
+        light.extend(bytes(lightmaps[face] if lightmaps is not None else face_lightmap(face)))
+        faces.append(struct.pack("<HHIHHBBBBI", plane, 0, first_edge, 4, texinfo, 0, 255, 255, 255, light_offset))
+
+    for x0 in (-128, 0):
+        add_face([(x0, 0, 0), (x0 + 128, 0, 0), (x0 + 128, 128, 0), (x0, 128, 0)], 0, 1)
+        add_face([(x0, 0, 128), (x0, 128, 128), (x0 + 128, 128, 128), (x0 + 128, 0, 128)], 1, 2)
+
+    planes = [((1, 0, 0), 0, 0), ((0, 0, 1), 0, 2), ((0, 0, 1), 128, 2)]
+    brushes = []
+    brush_sides = []
+    for low, high, contents in BRUSH_BOXES:
+        first_side = len(brush_sides)
+        for axis in range(3):
+            for sign, distance in ((1, high[axis]), (-1, -low[axis])):
+                normal = [0, 0, 0]
+                normal[axis] = sign
+                planes.append((tuple(normal), distance, 3))
+                brush_sides.append((len(planes) - 1, 0))
+        brushes.append((first_side, 6, contents))
+
+    texinfo_names, texinfo_flags, next_texinfos = TEXTURE_NAMES, texture_flags, (-1, -1)
+    if animated:
+        texinfo_names, texinfo_flags = TEXTURE_NAMES + (ANIMATION_TEXTURE,), tuple(texture_flags) + (0,)
+        next_texinfos = ANIMATION_NEXT_TEXINFOS
+    texinfos = [struct.pack("<8fII32si", 1, 0, 0, 0, 0, 1, 0, 0, flags, 0, name.encode(), next_texinfo)
+                for name, flags, next_texinfo in zip(texinfo_names, texinfo_flags, next_texinfos)]
+    nodes = [struct.pack("<iii3h3hHH", 0, 1, 2, -128, 0, 0, 128, 128, 128, 0, 0),
+             struct.pack("<iii3h3hHH", 1, -2, -1, 0, 0, -16, 128, 128, 128, 2, 1),
+             struct.pack("<iii3h3hHH", 1, -3, -1, -128, 0, -16, 0, 128, 128, 0, 1)]
+    leafs = [struct.pack("<ihh3h3hHHHH", 1, -1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0),
+             struct.pack("<ihh3h3hHHHH", 0, 1, 1, 0, 0, 0, 128, 128, 128, 0, 2, 0, 1),
+             struct.pack("<ihh3h3hHHHH", 0, 0, 2, -128, 0, 0, 0, 128, 128, 2, 2, 1, 2)]
+    leaf_faces = struct.pack("<4H", 2, 3, 0, 1)
+    leaf_brushes = struct.pack("<3H", 1, 0, 2)
+    visibility = struct.pack("<i", 2) + struct.pack("<4i", 20, 20, 21, 21) + bytes([1, 3])
+    entities = ('{\n"classname" "worldspawn"\n}\n{\n"classname" "info_player_start"\n"origin" "%d %d %d"\n}\n\x00' % PLAYER_START).encode()
+    models = struct.pack("<9f3i", -128, 0, 0, 128, 128, 128, 0, 0, 0, 0, 0, 4)
+    areas = struct.pack("<6i", 0, 0, 1, 0, 1, 1)
+    area_portals = struct.pack("<4i", 1, 2, 1, 1)
+
+    lumps = [entities,
+             b"".join(struct.pack("<3ffi", *normal, distance, plane_type) for normal, distance, plane_type in planes),
+             b"".join(struct.pack("<3f", *vertex) for vertex in vertices),
+             visibility, b"".join(nodes), b"".join(texinfos), b"".join(faces), bytes(light),
+             b"".join(leafs), leaf_faces, leaf_brushes,
+             b"".join(struct.pack("<HH", *edge) for edge in edges),
+             b"".join(struct.pack("<i", surf_edge) for surf_edge in surf_edges),
+             models,
+             b"".join(struct.pack("<3i", *brush) for brush in brushes),
+             b"".join(struct.pack("<Hh", *side) for side in brush_sides),
+             b"", areas, area_portals]
+
+    body = bytearray()
+    table = []
+    header_size = 8 + len(lumps) * 8
+    for lump in lumps:
+        table.append((header_size + len(body), len(lump)))
+        body += lump
+        body += bytes(-len(body) % 4)
+    header = struct.pack("<ii", 0x50534249, 38) + b"".join(struct.pack("<ii", *entry) for entry in table)
+    return header + bytes(body)
+
+
+def build_wal(name, width, height, seed=1):
+    """
+    A WAL texture of random palette indices, with all 4 mip levels.
+    """
+    rng = np.random.default_rng(seed)
+    offsets = []
+    mips = []
+    offset = 100
+    for mip in range(4):
+        offsets.append(offset)
+        mips.append(rng.integers(0, 224, (height >> mip, width >> mip), dtype=np.uint8).tobytes())
+        offset += len(mips[-1])
+    return struct.pack("<32sII4I32sIII", name.encode(), width, height, *offsets, b"", 0, 0, 0) + b"".join(mips)
+
+
+def build_pak(members):
+    """
+    A .pak holding the given members (name -> bytes), directory at the end.
+    """
+    data = bytearray(12)
+    directory = bytearray()
+    for name, contents in members.items():
+        directory += struct.pack("<56sii", name.encode(), len(data), len(contents))
+        data += contents
+    struct.pack_into("<4sii", data, 0, b"PACK", len(data), len(directory))
+    return bytes(data + directory)
+
+
+def write_map(folder, texture_flags=(0, 0), lightmaps=None, animated=False):
+    """
+    Writes the map and its textures (a 64x32 floor .wal, a 48x24 ceiling .png, a 32x32 lava .png) to folder.  Returns the map's path.
+    """
+    from PIL import Image
+
+    texture_folder = folder / "textures" / "e1u1"
+    texture_folder.mkdir(parents=True, exist_ok=True)
+    (texture_folder / "floor.wal").write_bytes(build_wal("e1u1/floor", 64, 32))
+    pixels = np.random.default_rng(2).integers(0, 256, (24, 48, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(texture_folder / "ceil.png")
+    pixels = np.random.default_rng(3).integers(0, 256, (32, 32, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(texture_folder / "lava.png")
+
+    bsp_path = folder / "maps" / "test.bsp"
+    bsp_path.parent.mkdir(parents=True, exist_ok=True)
+    bsp_path.write_bytes(build_bsp(texture_flags, lightmaps, animated))
+    return bsp_path
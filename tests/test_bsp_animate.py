@@ -0,0 +1,45 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from conftest import import_map, load_addon_module
+from synthetic_bsp import ANIMATION_TEXTURE, write_map
+
+
+bsp_animate = load_addon_module("bsp_animate")
+
+
+@pytest.mark.parametrize("next_texinfos, chains, texinfo_chains", [
+    ([-1, -1], [], [-1, -1]),
+    ([1, 2, 0, -1], [[0, 1, 2]], [0, 0, 0, -1]),
+    ([2, 0, 1], [[0, 2, 1]], [0, 0, 0]),                       # Frames start from the lowest texinfo
+    ([1, 2, 1], [[1, 2]], [0, 0, 0]),                          # 0 leads into the cycle, it comes before the cycle's start
+    ([3, 2, 1, 2, 7], [[1, 2]], [0, 0, 0, 0, -1]),             # Out of range links aren't animated
+    ([0, 2, 1], [[0], [1, 2]], [0, 1, 1]),
+])
+def test_get_animation_chains(next_texinfos, chains, texinfo_chains):
+    assert bsp_animate.get_animation_chains(next_texinfos) == (chains, texinfo_chains)
+
+
+def test_add_animation_frames_drives_the_frame_with_a_simple_expression():
+    image_node = MagicMock(type='TEX_IMAGE')
+    mat = MagicMock()
+    mat.node_tree.nodes.__iter__.return_value = iter([image_node])
+
+    bsp_animate.add_animation_frames(mat, [MagicMock(), MagicMock(), MagicMock()], "e1u1/lava", MagicMock())
+    driver = mat.node_tree.nodes.new.return_value.outputs[0].driver_add.return_value.driver
+    # No %, Blender only evaluates expressions with it through Python
+    assert driver.expression == f"fmod(floor(frame * {bsp_animate.ANIMATION_FPS} / fps), 3)"
+    mat.__setitem__.assert_called_with("bsp_animation_frames", 3)
+
+
+def test_texinfos_leading_into_an_animation_get_its_material(blender, tmp_path):
+    import_map(write_map(tmp_path, animated=True))
+    # The floor (texinfo 0) leads into the ceiling/lava cycle, which starts at texinfo 1: one material for all of it
+    obj = blender.data.objects["test"]
+    assert [mat.name for mat in obj.data.materials] == ["M_e1u1/ceil"]
+    assert "M_e1u1/floor" not in blender.data.materials
+    mat = obj.data.materials[0]
+    assert mat["bsp_animation_frames"] == 2
+    images = {node.image.name for node in mat.node_tree.nodes if node.type == 'TEX_IMAGE'}
+    assert images == {"e1u1/ceil", ANIMATION_TEXTURE}
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from conftest import import_map, load_addon_module
+from synthetic_bsp import BRUSH_BOXES, build_bsp
+
+
+bsp_brushes = load_addon_module("bsp_brushes")
+bsp_preprocess = load_addon_module("bsp_preprocess")
+custom_types = load_addon_module("custom_types")
+
+
+def brush_mesh(contents_mask):
+    data = build_bsp()
+    return bsp_brushes.build_brush_mesh(data, bsp_preprocess.load_header(data), contents_mask)
+
+
+def check_outward_faces(corners, loop_vertices, loop_totals, center):
+    """
+    Every face of a convex hull: flat, convex, counter-clockwise seen from outside.
+    """
+    start = 0
+    for total in loop_totals:
+        face = corners[loop_vertices[start : start + total]]
+        start += total
+        normal = np.sum(np.cross(face, np.roll(face, -1, axis=0)), axis=0)
+        normal /= np.linalg.norm(normal)
+        assert normal @ (face.mean(axis=0) - center) > 0
+        assert np.allclose((face - face[0]) @ normal, 0, atol=1e-6)
+        edges = np.roll(face, -1, axis=0) - face
+        assert np.all(np.cross(edges, np.roll(edges, -1, axis=0)) @ normal > 0)
+
+
+@pytest.mark.parametrize("contents_mask, brushes", [
+    (custom_types.CONTENTS_SOLID, [0, 1]),
+    (custom_types.CONTENTS_WATER, [2]),
+    (custom_types.CONTENTS_SOLID | custom_types.CONTENTS_WATER, [0, 1, 2]),
+])
+def test_build_brush_mesh(contents_mask, brushes):
+    mesh = brush_mesh(contents_mask)
+    assert np.unique(mesh.poly_brushes).tolist() == brushes
+    assert len(mesh.vertices) == 8 * len(brushes)
+    assert np.all(mesh.loop_totals == 4) and len(mesh.loop_totals) == 6 * len(brushes)
+    assert np.array_equal(mesh.loop_starts, np.cumsum(mesh.loop_totals) - mesh.loop_totals)
+
+    for brush in brushes:
+        low, high, contents = BRUSH_BOXES[brush]
+        polys = np.flatnonzero(mesh.poly_brushes == brush)
+        assert np.all(mesh.poly_contents[polys] == contents)
+        loops = np.concatenate([mesh.loop_vertices[mesh.loop_starts[p] : mesh.loop_starts[p] + 4] for p in polys])
+        corners = mesh.vertices[loops]
+        assert np.allclose(corners.min(axis=0), low) and np.allclose(corners.max(axis=0), high)
+        check_outward_faces(mesh.vertices, loops, mesh.loop_totals[polys], (np.array(low) + np.array(high)) / 2)
+
+
+def test_build_brush_mesh_without_matching_brushes():
+    assert brush_mesh(custom_types.CONTENTS_LAVA) is None
+
+
+def test_build_brush_batch_pyramid():
+    """
+    A square pyramid: its 4 slopes meet in 1 corner.  The sides also list the base's plane twice and a bevel plane that
+    only touches the apex, neither of which is a face of its own.
+    """
+    normals = np.array([(0, 0, -1), (1, 0, 1), (-1, 0, 1), (0, 1, 1), (0, -1, 1), (0, 0, 1)], dtype=np.float64)
+    normals[1:5] /= np.sqrt(2)
+    distances = np.array([0, 1 / np.sqrt(2), 1 / np.sqrt(2), 1 / np.sqrt(2), 1 / np.sqrt(2), 1])
+    side_planes = np.array([[0, 1, 2, 3, 4, 0, 5]])
+
+    corners, loop_vertices, loop_totals, poly_brushes = bsp_brushes.build_brush_batch(np.array([7]), 7, side_planes, normals, distances)
+    assert len(corners) == 5
+    assert sorted(loop_totals.tolist()) == [3, 3, 3, 3, 4]
+    assert poly_brushes.tolist() == [7] * 5
+    check_outward_faces(corners, loop_vertices, loop_totals, np.array([0, 0, 0.25]))
+
+
+def test_import_brushes(blender, map_path):
+    import_map(map_path, model_scale=0.5, import_brushes=True, brush_contents=custom_types.CONTENTS_SOLID | custom_types.CONTENTS_WATER)
+    obj = blender.data.objects["test_brushes"]
+    assert obj.display_type == 'WIRE' and tuple(obj.scale) == (0.5, 0.5, 0.5)
+    brushes = [value.value for value in obj.data.attributes["bsp_brush_index"].data]
+    contents = [value.value for value in obj.data.attributes["bsp_brush_contents"].data]
+    assert sorted(set(zip(brushes, contents))) == [(brush, box[2]) for brush, box in enumerate(BRUSH_BOXES)]
+    assert len(obj.data.polygons) == 6 * len(BRUSH_BOXES) and len(obj.data.vertices) == 8 * len(BRUSH_BOXES)
@@ -0,0 +1,118 @@
+import io
+import json
+import struct
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from conftest import load_addon_module
+from synthetic_bsp import face_lightmap
+
+
+bsp_convert = load_addon_module("bsp_convert")
+custom_types = load_addon_module("custom_types")
+
+FLOOR_SIZE = (64, 32)           # The floor texture, e1u1/floor.wal
+LIGHTMAP_BLOCK = 8              # Samples per side of every face's block: 128 units / 16
+
+
+def convert(map_path, tmp_path, file_format, **options):
+    output_path = tmp_path / f"test.{file_format.lower()}"
+    options = custom_types.bsp_import_options(search_from_parent=True, use_paks=False, model_scale=1.0, **options)
+    bsp_convert.convert_bsp(str(map_path), str(output_path), options, file_format)
+    return output_path
+
+
+def read_glb(path):
+    data = path.read_bytes()
+    magic, version, length = struct.unpack_from("<III", data)
+    assert (magic, version, length) == (bsp_convert.GLB_MAGIC, 2, len(data))
+    json_length, chunk_type = struct.unpack_from("<II", data, 12)
+    assert chunk_type == bsp_convert.GLB_CHUNK_JSON
+    gltf = json.loads(data[20 : 20 + json_length])
+    binary = data[20 + json_length + 8:]
+
+    def accessor(index):
+        accessor = gltf["accessors"][index]
+        view = gltf["bufferViews"][accessor["bufferView"]]
+        dtype = {bsp_convert.GLTF_FLOAT: np.float32, bsp_convert.GLTF_UNSIGNED_INT: np.uint32,
+                 bsp_convert.GLTF_UNSIGNED_BYTE: np.uint8}[accessor["componentType"]]
+        width = {"SCALAR": 1, "VEC2": 2, "VEC3": 3, "VEC4": 4}[accessor["type"]]
+        offset = view["byteOffset"] + accessor.get("byteOffset", 0)
+        return np.frombuffer(binary, dtype=dtype, count=accessor["count"] * width, offset=offset).reshape(-1, width)
+
+    def image(index):
+        view = gltf["bufferViews"][gltf["images"][index]["bufferView"]]
+        return np.asarray(Image.open(io.BytesIO(binary[view["byteOffset"] : view["byteOffset"] + view["byteLength"]])))
+
+    return gltf, accessor, image
+
+
+def test_glb_round_trip(map_path, tmp_path):
+    gltf, accessor, image = read_glb(convert(map_path, tmp_path, 'GLB', apply_lightmaps=True))
+    primitives = gltf["meshes"][0]["primitives"]
+    assert [gltf["materials"][p["material"]]["name"] for p in primitives] == ["M_e1u1/floor", "M_e1u1/ceil"]
+
+    attributes = primitives[0]["attributes"]
+    positions = accessor(attributes["POSITION"])
+    uvs = accessor(attributes["TEXCOORD_0"])
+    lightmap_uvs = accessor(attributes["TEXCOORD_1"])
+    # 4 quads, none sharing a corner (each has its own UVs and lightmap), as 2 triangles each
+    assert len(positions) == len(uvs) == len(lightmap_uvs) == 16
+    triangles = np.concatenate([accessor(p["indices"]).reshape(-1, 3) for p in primitives])
+    assert len(triangles) == 8 and triangles.max() == 15
+
+    # Back to BSP coordinates (glTF is Y up: (x, y, z) -> (x, z, -y))
+    bsp_positions = np.column_stack((positions[:, 0], -positions[:, 2], positions[:, 1]))
+
+    # glTF's UV origin is the top left like Quake's s/t: t grows down the texture with the texinfo's v axis (y here)
+    floor_triangles = accessor(primitives[0]["indices"]).reshape(-1, 3)
+    floor_vertices = np.unique(floor_triangles)
+    assert np.allclose(uvs[floor_vertices] * FLOOR_SIZE, bsp_positions[floor_vertices, :2])
+
+    # Every triangle's middle samples its own face's lightmap where it is, in the atlas image (rows top down)
+    atlas = image(gltf["textures"][gltf["materials"][0]["extras"]["lightmap"]["index"]]["source"])
+    atlas_size = np.array(atlas.shape[1::-1])
+    for triangle in triangles:
+        center = bsp_positions[triangle].mean(axis=0)
+        face = int(center[0] > 0) * 2 + int(center[2] > 64)
+        block = face_lightmap(face)[:LIGHTMAP_BLOCK * LIGHTMAP_BLOCK * 3].reshape(LIGHTMAP_BLOCK, LIGHTMAP_BLOCK, 3)
+        s, t = np.floor(center[:2] / 16).astype(int) - ((-LIGHTMAP_BLOCK if face < 2 else 0), 0)
+        x, y = np.floor(lightmap_uvs[triangle].mean(axis=0) * atlas_size).astype(int)
+        assert atlas[y, x, :3].tolist() == block[t, s].tolist()
+
+
+@pytest.mark.parametrize("options", [{"lightmap_mode": 'VERTEX'}, {"optimize_mesh": True}], ids=repr)
+def test_glb_round_trip_options(map_path, tmp_path, options):
+    gltf, accessor, image = read_glb(convert(map_path, tmp_path, 'GLB', apply_lightmaps=True, **options))
+    primitives = gltf["meshes"][0]["primitives"]
+    attributes = primitives[0]["attributes"]
+    triangles = np.concatenate([accessor(p["indices"]).reshape(-1, 3) for p in primitives])
+    if "lightmap_mode" in options:
+        assert "TEXCOORD_1" not in attributes
+        assert accessor(attributes["COLOR_0"]).shape == (16, 4)
+        assert len(triangles) == 8
+    else:
+        # Every face's lightmap is different, so nothing merges
+        assert len(accessor(attributes["POSITION"])) == 16 and len(triangles) == 8
+
+
+def test_obj_round_trip(map_path, tmp_path):
+    output_path = convert(map_path, tmp_path, 'OBJ')
+    lines = output_path.read_text().splitlines()
+    positions = np.array([line.split()[1:] for line in lines if line.startswith("v ")], dtype=np.float64)
+    uvs = np.array([line.split()[1:] for line in lines if line.startswith("vt ")], dtype=np.float64)
+    faces = [[tuple(int(i) - 1 for i in corner.split("/")) for corner in line.split()[1:]] for line in lines if line.startswith("f ")]
+    assert len(positions) == 16 and len(faces) == 4
+    assert all(len(face) == 4 for face in faces)
+    assert max(uv for face in faces for vertex, uv in face) < len(uvs)
+    assert [line for line in lines if line.startswith("usemtl")] == ["usemtl M_e1u1/floor", "usemtl M_e1u1/ceil"]
+    assert (tmp_path / "test.mtl").is_file()
+
+    # OBJ's UV origin is the bottom left (like Blender's): v = 1 - t / height
+    bsp_positions = np.column_stack((positions[:, 0], -positions[:, 2], positions[:, 1]))
+    for face in faces[:2]:
+        vertices, face_uvs = np.array(face).T
+        texels = np.column_stack((uvs[face_uvs, 0], 1.0 - uvs[face_uvs, 1])) * FLOOR_SIZE
+        assert np.allclose(texels, bsp_positions[vertices, :2], atol=1e-3)
@@ -0,0 +1,147 @@
+import numpy as np
+import pytest
+
+from conftest import load_addon_module
+from synthetic_bsp import TEXTURE_NAMES, face_lightmap, write_map
+
+
+bsp_preprocess = load_addon_module("bsp_preprocess")
+custom_types = load_addon_module("custom_types")
+
+
+def lightmap_samples(*blocks):
+    """
+    The given (width, height, RGB samples) blocks one after another, as get_face_lightmap_blocks would list them.
+    """
+    samples = []
+    listed = []
+    offset = 0
+    for fi, (width, height, block) in enumerate(blocks):
+        block = np.asarray(block, dtype=np.uint8).reshape(-1)
+        listed.append((fi, offset, width, height))
+        samples.append(block)
+        offset += len(block)
+    return listed, np.concatenate(samples)
+
+
+def test_get_lightmap_slots_packs_identical_blocks_once():
+    gradient = np.arange(2 * 2 * 3)
+    blocks, samples = lightmap_samples((2, 2, gradient), (2, 2, gradient), (2, 2, gradient + 1),
+                                       (4, 1, gradient),                   # Same samples, other shape
+                                       (2, 2, np.full(12, 7)), (1, 3, np.full(9, 7)))
+    slots, block_slots = bsp_preprocess.get_lightmap_slots(blocks, samples)
+    assert block_slots == [0, 0, 1, 2, 3, 4]
+    assert slots == [(0, 2, 2, False), (24, 2, 2, False), (36, 4, 1, False), (48, 2, 2, False), (60, 1, 3, False)]
+
+
+def test_get_lightmap_slots_collapses_uniform_blocks():
+    gradient = np.arange(2 * 2 * 3)
+    blocks, samples = lightmap_samples((2, 2, np.tile((7, 8, 9), 4)), (1, 3, np.tile((7, 8, 9), 3)),
+                                       (2, 2, np.tile((7, 8, 8), 4)), (2, 2, gradient))
+    slots, block_slots = bsp_preprocess.get_lightmap_slots(blocks, samples, collapse_uniform=True)
+    # Both (7, 8, 9) blocks share 1 texel whatever their size, the slightly different color gets its own
+    assert block_slots == [0, 0, 1, 2]
+    assert slots == [(0, 1, 1, True), (21, 1, 1, True), (33, 2, 2, False)]
+
+
+
+def baked_context(folder, smooth=False, texture_flags=(0, 0), optimize_mesh=False):
+    """
+    The synthetic map preprocessed and its lightmaps baked to vertex colors.
+    """
+    map_path = write_map(folder, texture_flags)
+    ctx = custom_types.bsp_import_context("test", str(map_path.parent))
+    data = bsp_preprocess.load_file(ctx, str(map_path))
+    bsp_preprocess.load_textures(ctx, data[ctx.header.texture_info_offset : ctx.header.texture_info_offset + ctx.header.texture_info_length])
+    bsp_preprocess.preprocess_geometry(ctx, data, 1.0, True, 'NONE', None, 'NONE', "", False, optimize_mesh, 0.1)
+    bsp_preprocess.bake_vertex_lightmaps(ctx, data, smooth)
+    return ctx
+
+
+def test_bake_vertex_lightmaps_samples_every_corner(tmp_path):
+    ctx = baked_context(tmp_path, texture_flags=(0, custom_types.SURF_SKY))
+    assert ctx.lit_faces.tolist() == [0, 2]
+    block = 8       # 128 units / 16, the last sample row and column are the far corners'
+    for poly, (start, total) in enumerate(zip(ctx.loop_starts.tolist(), ctx.loop_totals.tolist())):
+        face = int(ctx.bsp_face_indices[poly])
+        corners = ctx.vertices[ctx.loop_vertices[start : start + total]]
+        colors = ctx.lightmap_colors[start : start + total]
+        assert (colors[:, 3] == 255).all()
+        if face not in (0, 2):
+            # Sky: white, multiplying by it changes nothing
+            assert (colors == 255).all()
+            continue
+        samples = face_lightmap(face)[:block * block * 3].reshape(block, block, 3)
+        s, t = np.minimum((corners[:, :2] - corners[:, :2].min(axis=0)) / 16, block - 1).astype(np.int64).T
+        assert colors[:, :3].tolist() == samples[t, s].tolist()
+
+
+def test_bake_vertex_lightmaps_smooths_over_shared_vertices(tmp_path):
+    # Welded, the floors and the ceilings each share their 2 corners on x = 0
+    sharp = baked_context(tmp_path, optimize_mesh=True).lightmap_colors.astype(np.float64)
+    ctx = baked_context(tmp_path, smooth=True, optimize_mesh=True)
+    for vertex in np.unique(ctx.loop_vertices).tolist():
+        loops = np.flatnonzero(ctx.loop_vertices == vertex)
+        assert np.allclose(ctx.lightmap_colors[loops], sharp[loops].mean(axis=0), atol=0.5)
+    shared = np.flatnonzero(np.bincount(ctx.loop_vertices) > 1)
+    assert len(shared) == 4
+    assert not np.array_equal(ctx.lightmap_colors, sharp)
+
+
+def test_pack_rows():
+    sizes = [(10, 4), (30, 8), (40, 6), (20, 8), (80, 2)]
+    positions, width, page_heights = bsp_preprocess.pack_rows(sizes, 256)
+    assert width == 128
+    # Tallest first, left to right: the 8s, then the 6 and 4 still fit in the first row, the 80 wide one starts the next
+    assert positions == [(0, 90, 0), (0, 0, 0), (0, 50, 0), (0, 30, 0), (0, 0, 8)]
+    assert page_heights == [10]
+
+    # Rows at least min_width wide, but never over max_width: what doesn't fit at all gets no place
+    positions, width, page_heights = bsp_preprocess.pack_rows([(3, 3), (100, 1)], 64, min_width=16)
+    assert width == 64
+    assert positions == [(0, 0, 0), None]
+    assert page_heights == [3]
+
+
+def test_pack_rows_never_overlaps():
+    sizes = [tuple(size) for size in np.random.default_rng(3).integers(1, 40, (200, 2)).tolist()]
+    positions, width, (height,) = bsp_preprocess.pack_rows(sizes, 512)
+    used = np.zeros((height, width), dtype=np.int64)
+    for (page, x, y), (w, h) in zip(positions, sizes):
+        used[y : y + h, x : x + w] += 1
+    assert used.max() == 1
+    assert used.sum() == sum(w * h for w, h in sizes)
+
+
+def test_pack_rows_starts_new_pages():
+    sizes = [(40, 30), (40, 30), (40, 20), (40, 20), (20, 10), (100, 100)]
+    positions, width, page_heights = bsp_preprocess.pack_rows(sizes, 64, max_height=50)
+    assert width == 64
+    # 1 rectangle a row but for the 20 wide one: a 30 and a 20 make it to 50 on a page, 2 30s don't
+    assert positions == [(0, 0, 0), (1, 0, 0), (1, 0, 30), (2, 0, 0), (2, 40, 0), None]
+    assert page_heights == [30, 50, 20]
+    assert all(y + sizes[i][1] <= page_heights[page] for i, (page, x, y) in enumerate(positions[:-1]))
+
+
+def test_pack_texture_atlas(map_path):
+    options = custom_types.bsp_import_options(search_from_parent=True, use_paks=False, texture_atlas=True)
+    preprocessor = bsp_preprocess.bsp_preprocessor(str(map_path), options)
+    preprocessor.ctx = ctx = custom_types.bsp_import_context("test", str(map_path.parent))
+    preprocessor.preprocess()
+
+    # floor.wal (64x32) and ceil.png (48x24) with their 2 texel gutters side by side, on one page
+    assert len(ctx.texture_atlases) == 1
+    page = ctx.texture_atlases[0]
+    page_h, page_w = page.shape[:2]
+    assert (page_w, page_h) == (128, 36)
+    for texture_name in TEXTURE_NAMES:
+        pixels = bsp_preprocess.get_texture_pixels(ctx, texture_name)
+        height, width = pixels.shape[:2]
+        page_index, u, v, u_scale, v_scale = ctx.texture_atlas_rects[texture_name]
+        assert page_index == 0
+        assert (u_scale * page_w, v_scale * page_h) == pytest.approx((width, height))
+        x, y = round(u * page_w), round(v * page_h)
+        assert np.array_equal(page[y : y + height, x : x + width], pixels)
+        # The gutters are the texture's own opposite edges
+        assert np.array_equal(page[y - 1, x : x + width], pixels[-1])
+        assert np.array_equal(page[y : y + height, x + width], pixels[:, 0])
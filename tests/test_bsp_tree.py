@@ -0,0 +1,102 @@
+import struct
+
+import numpy as np
+import pytest
+
+from conftest import load_addon_module
+from synthetic_bsp import PLAYER_START, build_bsp
+
+
+bsp_tree = load_addon_module("bsp_tree")
+custom_types = load_addon_module("custom_types")
+
+# The synthetic map's faces: floor and ceiling of room A (x < 0), then of room B
+ROOM_A_FACES = [0, 1]
+ROOM_B_FACES = [2, 3]
+
+
+@pytest.fixture
+def tree():
+    data = build_bsp()
+    return bsp_tree.bsp_tree(data, custom_types.bsp_header(*struct.unpack(f"<{'i'*40}", data[:160])))
+
+
+def test_cluster_pvs(tree):
+    assert tree.num_clusters == 2
+    assert tree.cluster_pvs(0).tolist() == [True, False]
+    assert tree.cluster_pvs(1).tolist() == [True, True]
+    # Outside the map (no cluster), everything is visible
+    assert tree.cluster_pvs(-1).tolist() == [True, True]
+
+
+def test_decompress_vis_runs(tree):
+    # 20 clusters, 3 bytes a row: 0xff, a run of one 0 byte, then 0x05
+    tree.visibility = bytes([0xff, 0x00, 0x01, 0x05, 0x00, 0x03])
+    tree.num_clusters = 20
+    assert np.flatnonzero(tree.decompress_vis(0)).tolist() == [0, 1, 2, 3, 4, 5, 6, 7, 16, 18]
+    # A row of nothing but a run
+    assert not tree.decompress_vis(4).any()
+
+
+@pytest.mark.parametrize("point, faces", [
+    ((-64, 64, 32), ROOM_A_FACES),                  # Cluster 0 only sees itself
+    (PLAYER_START, ROOM_A_FACES + ROOM_B_FACES),    # Cluster 1 sees both
+    ((64, 64, -32), ROOM_A_FACES + ROOM_B_FACES),   # In the solid leaf: no cluster, no culling
+])
+def test_get_visible_faces(tree, point, faces):
+    assert tree.get_visible_faces(point).tolist() == faces
+
+
+def test_load_bsp_tree(tmp_path):
+    path = tmp_path / "test.bsp"
+    path.write_bytes(build_bsp())
+    assert len(bsp_tree.load_bsp_tree(str(path)).nodes) == 3
+
+
+def test_find_leaf(tree):
+    points = [(64, 64, 32), (-64, 64, 32), (64, 64, -32), (-64, 64, -32)]
+    assert [tree.find_leaf(point) for point in points] == [1, 2, 0, 0]
+    assert tree.find_leafs(points).tolist() == [1, 2, 0, 0]
+
+
+@pytest.mark.parametrize("depth, nodes", [
+    (0, [0, 0, 0]),
+    (1, [1, 2, 1]),                 # Room B is node 1, room A node 2
+    (2, [-2, -3, -1]),              # Leafs (as node children) 1, 2 and the solid leaf
+    (5, [-2, -3, -1]),              # Points stop at their leaf
+])
+def test_find_nodes_at_depth(tree, depth, nodes):
+    assert tree.find_nodes_at_depth([(64, 64, 32), (-64, 64, 32), (64, 64, -32)], depth).tolist() == nodes
+
+
+@pytest.mark.parametrize("box_min, box_max, faces", [
+    ((16, 16, 16), (32, 32, 32), []),                               # Inside room B, away from its faces
+    ((16, 16, -8), (32, 32, 8), [2]),                               # Around room B's floor
+    ((-8, 16, -8), (8, 32, 136), ROOM_A_FACES + ROOM_B_FACES),      # Across the middle, floor to ceiling
+])
+def test_get_faces_in_box(tree, box_min, box_max, faces):
+    assert sorted(tree.get_faces_in_box(np.array(box_min), np.array(box_max)).tolist()) == faces
+
+
+def test_raycast(tree):
+    hit = tree.raycast((64, 64, 64), (0, 0, -1))
+    assert hit['point'].tolist() == [64, 64, 0]
+    assert hit['distance'] == 64 and hit['normal'].tolist() == [0, 0, 1]
+    assert (hit['leaf'], hit['face']) == (0, 2)
+
+    hit = tree.raycast((-96, 32, 100), (1, 0, -1))
+    # Crosses over into room B before reaching the floor
+    assert hit['face'] == 2 and np.allclose(hit['point'], (4, 32, 0))
+    # Nothing solid above the floor, or further than max_distance
+    assert tree.raycast((64, 64, 64), (0, 0, 1)) is None
+    assert tree.raycast((64, 64, 64), (0, 0, -1), max_distance=32) is None
+
+
+def test_get_face_areas(tree):
+    assert tree.get_face_areas().tolist() == [2, 2, 1, 1]
+
+
+def test_get_area_neighbours(tree):
+    assert tree.get_area_neighbours(1) == [2]
+    # Area 0 is never a real area
+    assert tree.get_area_neighbours(0) == [] and tree.get_area_neighbours(7) == []
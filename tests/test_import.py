@@ -0,0 +1,116 @@
+"""
+Whole imports of the synthetic map in Blender, checking what they make.
+"""
+import numpy as np
+import pytest
+
+from conftest import import_map, load_addon_module
+from synthetic_bsp import write_map
+
+
+custom_types = load_addon_module("custom_types")
+
+
+def face_indices(obj):
+    return [value.value for value in obj.data.attributes["bsp_face_index"].data]
+
+
+def get_objects(bpy):
+    """
+    The BSP faces of every object in the scene, by name.
+    """
+    return {obj.name: face_indices(obj) for obj in bpy.data.objects}
+
+
+@pytest.mark.parametrize("areas, faces", [("1", [2, 3]), ("2", [0, 1]), ("1, 2", [0, 1, 2, 3]), ("3", [])])
+def test_import_selected_areas(blender, map_path, areas, faces):
+    import_map(map_path, area_import='SELECTED', areas=areas)
+    assert face_indices(blender.data.objects["test"]) == faces
+
+
+def test_import_split_by_area(blender, map_path):
+    import_map(map_path, area_import='SPLIT')
+    assert "test" not in blender.data.objects
+    areas = blender.data.collections["test_Areas"]
+    assert sorted(collection.name for collection in areas.children) == ["test_Area_1", "test_Area_2"]
+    for area, faces, neighbours in ((1, [2, 3], [2]), (2, [0, 1], [1])):
+        collection = blender.data.collections[f"test_Area_{area}"]
+        assert [obj.name for obj in collection.objects] == [f"test_Area_{area}"]
+        assert face_indices(collection.objects[0]) == faces
+        assert list(collection["portal_areas"]) == neighbours
+        # Only its own room's corners
+        corners = np.array([vertex.co for vertex in collection.objects[0].data.vertices])
+        assert np.all(corners[:, 0] >= 0) if area == 1 else np.all(corners[:, 0] <= 0)
+
+
+@pytest.mark.parametrize("floor_flags, floor_class", [
+    ("SURF_SKY", "Sky"),
+    ("SURF_SKY | SURF_NODRAW", "Sky"),                  # Sky goes first: its faces draw the skybox
+    ("SURF_WARP", "Liquid"),
+    ("SURF_WARP | SURF_TRANS33", "Liquid"),
+    ("SURF_TRANS33", "Translucent"),
+    ("SURF_TRANS66", "Translucent"),
+    ("SURF_NODRAW", "NoDraw"),
+    ("SURF_HINT", "NoDraw"),
+    ("SURF_SKIP", "NoDraw"),
+    ("SURF_LIGHT | SURF_FLOWING", None),                # Still solid
+])
+@pytest.mark.parametrize("skip_nodraw", [True, False])
+def test_import_separates_faces_by_surface_flags(blender, tmp_path, floor_flags, floor_class, skip_nodraw):
+    flags = sum(getattr(custom_types, flag) for flag in floor_flags.split(" | "))
+    import_map(write_map(tmp_path, (flags, 0)), skip_nodraw=skip_nodraw, separate_special_faces=True)
+
+    if floor_class is None:
+        assert get_objects(blender) == {"test": [0, 1, 2, 3]}
+    elif floor_class == "NoDraw" and skip_nodraw:
+        assert get_objects(blender) == {"test": [1, 3]}
+    else:
+        assert get_objects(blender) == {"test": [1, 3], f"test_{floor_class}": [0, 2]}
+
+
+def test_import_separates_faces_by_area_and_surface_flags(blender, tmp_path):
+    import_map(write_map(tmp_path, (0, custom_types.SURF_SKY)), area_import='SPLIT', separate_special_faces=True)
+    assert get_objects(blender) == {"test_Area_1": [2], "test_Area_1_Sky": [3], "test_Area_2": [0], "test_Area_2_Sky": [1]}
+    # Sky and solid faces of an area share its collection
+    assert sorted(obj.name for obj in blender.data.collections["test_Area_1"].objects) == ["test_Area_1", "test_Area_1_Sky"]
+
+
+@pytest.mark.parametrize("options, objects", [
+    # Cells of 100 units: each face in its own, by its center
+    (dict(chunk_mode='GRID', chunk_size=100.0), {"test_Chunk_-1_0_0": [0], "test_Chunk_-1_0_1": [1], "test_Chunk_0_0_0": [2], "test_Chunk_0_0_1": [3]}),
+    # Chunk size is in scene units: 2 at scale 0.01 is 200 BSP units, a cell per room
+    (dict(chunk_mode='GRID', chunk_size=2.0, model_scale=0.01), {"test_Chunk_-1_0_0": [0, 1], "test_Chunk_0_0_0": [2, 3]}),
+    (dict(chunk_mode='NODES', chunk_depth=1), {"test_Node_1": [2, 3], "test_Node_2": [0, 1]}),
+    # Below the rooms' nodes are their leafs
+    (dict(chunk_mode='NODES', chunk_depth=3), {"test_Leaf_1": [2, 3], "test_Leaf_2": [0, 1]}),
+    (dict(chunk_mode='NODES', chunk_depth=1, area_import='SPLIT'), {"test_Area_1_Node_1": [2, 3], "test_Area_2_Node_2": [0, 1]}),
+])
+def test_import_split_into_chunks(blender, map_path, options, objects):
+    import_map(map_path, **options)
+    assert get_objects(blender) == objects
+    # Every chunk only keeps the vertices of its own quads
+    assert all(len(obj.data.vertices) == 4 * len(obj.data.polygons) for obj in blender.data.objects)
+
+
+def test_imports_share_one_surface_node_group(blender, map_path):
+    import_map(map_path, apply_lightmaps=True, lightmap_influence=100)
+    import_map(map_path, apply_lightmaps=True, lightmap_influence=50)
+    assert [group.name for group in blender.data.node_groups] == ["BSP Surface"]
+    group = blender.data.node_groups["BSP Surface"]
+    # The second import remade the materials (the first import's are gone), still on the same group
+    materials = [mat for mat in blender.data.materials if mat.name.startswith("M_")]
+    assert len(materials) == 2
+    assert all(mat.node_tree.nodes["BSP_Surface"].node_tree == group for mat in materials)
+    # The influence is the group's: the last import's goes for every material
+    assert group.nodes["Lightmap_Infuence"].outputs[0].default_value == 0.5
+
+
+def test_import_texture_atlas(blender, map_path):
+    import_map(map_path, apply_lightmaps=True, texture_atlas=True)
+    obj = blender.data.objects["test"]
+    # Both textures are on lit faces: one page, one material
+    assert [mat.name for mat in obj.data.materials] == ["M_test_textures_0"]
+    nodes = obj.data.materials[0].node_tree.nodes
+    assert nodes["BSP_Texture"].image == blender.data.images["test_textures_0"]
+    assert nodes["BSP_Texture"].inputs['Vector'].links[0].from_node == nodes["BSP_Atlas_Wrap"]
+    assert nodes["BSP_Surface"].inputs['Lightmap'].is_linked
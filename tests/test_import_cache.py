@@ -0,0 +1,94 @@
+import numpy as np
+
+from conftest import import_map, load_addon_module
+from synthetic_bsp import LIGHTMAP_SIZE, build_bsp
+
+
+import_cache = load_addon_module("import_cache")
+bsp_preprocess = load_addon_module("bsp_preprocess")
+custom_types = load_addon_module("custom_types")
+
+
+def preprocessed_context(map_path):
+    ctx = custom_types.bsp_import_context("test", str(map_path.parent))
+    data = bsp_preprocess.load_file(ctx, str(map_path))
+    bsp_preprocess.load_textures(ctx, data[ctx.header.texture_info_offset : ctx.header.texture_info_offset + ctx.header.texture_info_length])
+    bsp_preprocess.preprocess_geometry(ctx, data, 1.0, True, 'NONE', None, 'NONE', "", False, False, 0.1)
+    bsp_preprocess.get_texture_sizes(ctx, True)
+    bsp_preprocess.compute_uvs(ctx)
+    bsp_preprocess.pack_lightmap_atlas(ctx, data)
+    return ctx
+
+
+def test_save_and_restore(map_path, tmp_path):
+    ctx = preprocessed_context(map_path)
+    path = import_cache.get_import_cache_path(str(tmp_path / "cache"), "e1u1/test map", "key")
+    assert path.endswith("e1u1_test_map.key.npz")
+    import_cache.save_import_cache(path, ctx)
+
+    restored = custom_types.bsp_import_context("test")
+    texture_sizes = import_cache.restore_import_cache(restored, import_cache.load_import_cache(path))
+    for name in import_cache.CACHED_ARRAYS + import_cache.CACHED_LIGHTMAP_ARRAYS:
+        assert np.array_equal(getattr(restored, name), getattr(ctx, name)), name
+    assert restored.texture_source_dict == ctx.texture_source_dict
+    assert texture_sizes == {name: tuple(size) for name, size in ctx.texture_resolution_dict.items()}
+
+
+def test_load_import_cache_ignores_bad_snapshots(tmp_path):
+    assert import_cache.load_import_cache(str(tmp_path / "missing.npz")) is None
+    broken = tmp_path / "broken.npz"
+    broken.write_bytes(b"not a zip")
+    assert import_cache.load_import_cache(str(broken)) is None
+    # From an older version, without every array
+    partial = tmp_path / "partial.npz"
+    np.savez(partial, vertices=np.zeros((1, 3)))
+    assert import_cache.load_import_cache(str(partial)) is None
+
+
+def test_get_import_cache_key():
+    key = import_cache.get_import_cache_key("lighting", "folder", True)
+    assert key == import_cache.get_import_cache_key("lighting", "folder", True)
+    assert key != import_cache.get_import_cache_key("lighting", "folder", False)
+    assert key != import_cache.get_import_cache_key("other lighting", "folder", True)
+
+
+def get_mesh(obj):
+    coords = np.zeros(len(obj.data.vertices) * 3)
+    obj.data.vertices.foreach_get("co", coords)
+    uvs = np.zeros(len(obj.data.loops) * 2)
+    obj.data.uv_layers["UVMap"].data.foreach_get("uv", uvs)
+    return coords, uvs
+
+
+def test_import_uses_the_cache_until_the_map_changes(blender, map_path, tmp_path, capsys):
+    def import_cached():
+        blender.ops.wm.read_factory_settings()
+        import_map(map_path, apply_lightmaps=True, optimize_mesh=True, weld_distance=0.1, use_import_cache=True,
+                   import_cache_dir=str(tmp_path / "cache"))
+        out = capsys.readouterr().out
+        coords, uvs = get_mesh(blender.data.objects["test"])
+        atlas = np.array(blender.data.images["test_atlas"].pixels[:])
+        return (coords, uvs, atlas), "Loaded import cache" in out, "Saved import cache" in out
+
+    first, loaded, saved = import_cached()
+    assert not loaded and saved
+    second, loaded, saved = import_cached()
+    assert loaded and not saved
+    assert all(np.array_equal(a, b) for a, b in zip(first, second))
+
+    # Other lightmaps (which also decide which lit faces merge): a new snapshot
+    lightmaps = [np.full(LIGHTMAP_SIZE * LIGHTMAP_SIZE * 3, face * 20, dtype=np.uint8) for face in range(4)]
+    map_path.write_bytes(build_bsp(lightmaps=lightmaps))
+    third, loaded, saved = import_cached()
+    assert not loaded and saved
+    assert not np.array_equal(third[2], first[2])
+
+
+def test_triangulated_imports_share_the_snapshot(blender, map_path, tmp_path, capsys):
+    for triangulate, loaded in ((False, False), (True, True), (False, True)):
+        blender.ops.wm.read_factory_settings()
+        import_map(map_path, triangulate=triangulate, use_import_cache=True, import_cache_dir=str(tmp_path / "cache"))
+        assert ("Loaded import cache" in capsys.readouterr().out) == loaded
+        mesh = blender.data.objects["test"].data
+        assert len(mesh.polygons) == (8 if triangulate else 4)
+        assert all(len(polygon.vertices) == (3 if triangulate else 4) for polygon in mesh.polygons)
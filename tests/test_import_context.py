@@ -0,0 +1,84 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from conftest import import_map, load_addon_module
+
+
+custom_types = load_addon_module("custom_types")
+
+
+@pytest.fixture
+def contexts(monkeypatch):
+    """
+    Every import context the imports in a test create.
+    """
+    idtech2_bsp = load_addon_module("idtech2_bsp")
+    created = []
+
+    class recorded_context(custom_types.bsp_import_context):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            created.append(self)
+
+    monkeypatch.setattr(idtech2_bsp, "bsp_import_context", recorded_context)
+    return created
+
+
+def test_context_has_no_other_attributes():
+    ctx = custom_types.bsp_import_context("test")
+    with pytest.raises(AttributeError):
+        ctx.face_verts_list = []
+
+
+def test_release_keeps_only_the_name_and_objects():
+    ctx = custom_types.bsp_import_context("test", "maps")
+    ctx.vertices = np.zeros((4, 3))
+    ctx.face_classes = np.zeros(1, dtype=np.int64)
+    ctx.texture_obj_dict = {"e1u1/floor": object()}
+    ctx.lightmap_pixels = np.zeros((8, 64, 4), dtype=np.uint8)
+    ctx.objects = ["test"]
+
+    ctx.release()
+    assert (ctx.name, ctx.folder_path, ctx.objects) == ("test", "maps", ["test"])
+    assert ctx.vertices is None and ctx.face_classes is None and ctx.lightmap_extents is None
+    assert ctx.header is None and ctx.tree is None and not ctx.texture_obj_dict and ctx.lightmap_pixels is None
+
+
+def test_preprocessed_context_pickles_without_files_and_datablocks(map_path):
+    bsp_preprocess = load_addon_module("bsp_preprocess")
+    preprocessor = bsp_preprocess.bsp_preprocessor(str(map_path), custom_types.bsp_import_options(search_from_parent=True,
+                                                                                                  apply_lightmaps=True))
+    preprocessor.ctx = custom_types.bsp_import_context("test", str(map_path.parent))
+    preprocessor.preprocess()
+    ctx = preprocessor.ctx
+    assert ctx.tree is not None and ctx.lightmap_pixels is not None
+    # Datablocks, like open files, can't go to another process
+    ctx.obj = ctx.mesh = lambda: None
+
+    copy = pickle.loads(pickle.dumps(preprocessor))
+    assert not copy.cancel_requested.is_set() and copy.geometry_key == preprocessor.geometry_key
+    for slot in custom_types.bsp_import_context.UNPICKLED_SLOTS:
+        assert getattr(copy.ctx, slot) == getattr(custom_types.bsp_import_context(), slot), slot
+    for slot in ("vertices", "loop_vertices", "bsp_face_indices", "lightmap_extents", "uvs", "lightmap_pixels", "lightmap_uvs"):
+        assert np.array_equal(getattr(copy.ctx, slot), getattr(ctx, slot)), slot
+    assert copy.ctx.texture_resolution_dict == ctx.texture_resolution_dict and copy.ctx.name == "test"
+    ctx.paks.close()
+
+
+@pytest.mark.parametrize("options", [dict(), dict(apply_lightmaps=True, optimize_mesh=True), dict(area_import='SPLIT')])
+def test_imports_release_their_context(blender, map_path, contexts, options):
+    import_map(map_path, **options)
+    import_map(map_path, **options)
+    assert len(contexts) == 2 and contexts[0] is not contexts[1]
+    for ctx in contexts:
+        assert ctx.tree is None and ctx.vertices is None and ctx.loop_vertices is None and ctx.lightmap_pixels is None
+        assert ctx.objects and all(obj.name in blender.data.objects for obj in ctx.objects)
+
+
+def test_failed_imports_release_their_context(blender, tmp_path, contexts):
+    path = tmp_path / "broken.bsp"
+    path.write_bytes(b"IBSP")
+    import_map(path)
+    assert len(contexts) == 1 and contexts[0].header is None and contexts[0].tree is None
@@ -0,0 +1,121 @@
+"""
+Imports through bsp_import_job, step by step like the operator runs them: preprocess in a thread, build a batch at a time.
+"""
+import os
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from conftest import load_addon_module
+from synthetic_bsp import write_map
+
+
+idtech2_bsp = load_addon_module("idtech2_bsp")
+bsp_preprocess = load_addon_module("bsp_preprocess")
+custom_types = load_addon_module("custom_types")
+
+
+def new_job(map_path, **options):
+    return idtech2_bsp.bsp_import_job(str(map_path), custom_types.bsp_import_options(search_from_parent=True, use_paks=False,
+                                                                                     **options))
+
+
+def test_import_job_runs_in_steps(blender, map_path):
+    job = new_job(map_path, apply_lightmaps=True)
+    assert job.prepare()
+    job.preprocess_in_background()
+    job.thread.join(60)
+    assert not job.preprocessing and job.error is None
+    for _ in job.build():
+        assert 0.7 <= job.progress < 1.0
+    assert (job.stage, job.progress) == ("Done", 1.0)
+    job.finish()
+    assert len(blender.data.objects["test"].data.polygons) == 4
+
+
+def test_cancel_during_preprocess(blender, map_path):
+    job = new_job(map_path)
+    assert job.prepare()
+    job.cancel()
+    job.preprocess_in_background()
+    job.thread.join(60)
+    assert isinstance(job.error, bsp_preprocess.import_cancelled)
+    job.abort()
+    job.finish()
+    assert "test" not in blender.data.objects and "test" not in blender.data.meshes
+
+
+@pytest.mark.parametrize("batches", [0, 2, 4])
+def test_cancel_during_build_removes_what_was_created(blender, map_path, batches):
+    job = new_job(map_path, apply_lightmaps=True, area_import='SPLIT')
+    assert job.prepare()
+    job.preprocess()
+    build = job.build()
+    for _ in range(batches + 1):
+        next(build)
+    assert "test" in blender.data.objects
+    job.cancel()
+    with pytest.raises(bsp_preprocess.import_cancelled):
+        for _ in build:
+            pass
+    job.abort()
+    job.finish()
+    assert not blender.data.objects
+    assert not [mesh.name for mesh in blender.data.meshes if mesh.name.startswith("test")]
+
+
+def test_abort_keeps_an_updated_import(blender, map_path):
+    new_job(map_path).run()
+    obj = blender.data.objects["test"]
+    job = new_job(map_path, reimport=True)
+    assert job.prepare()
+    job.preprocess()
+    build = job.build()
+    next(build)
+    job.cancel()
+    with pytest.raises(bsp_preprocess.import_cancelled):
+        for _ in build:
+            pass
+    job.abort()
+    job.finish()
+    assert blender.data.objects["test"] == obj and len(obj.data.polygons) == 4
+
+
+def test_import_job_reports_missing_file(monkeypatch, tmp_path):
+    bpy = MagicMock(name="bpy")
+    monkeypatch.setattr(idtech2_bsp, "bpy", bpy)
+    job = new_job(tmp_path / "missing.bsp")
+    assert not job.prepare()
+    bpy.context.window_manager.popup_menu.assert_called_once_with(idtech2_bsp.missing_file, title="Error", icon='ERROR')
+    # Nothing to clean up
+    job.abort()
+    job.finish()
+
+
+@pytest.mark.parametrize("maps", [1, 3])
+def test_batch_import(blender, tmp_path, maps):
+    batch_import = load_addon_module("batch_import")
+    # One map is preprocessed in a thread, more in worker processes
+    map_path = write_map(tmp_path)
+    for i in range(maps):
+        (map_path.parent / f"map{i}.bsp").write_bytes(map_path.read_bytes())
+    map_path.unlink()
+    map_path.with_name("broken.bsp").write_bytes(b"IBSP" + bytes(100))
+    map_path.with_name("notes.txt").write_text("")
+    bsp_paths = batch_import.get_bsp_paths(str(map_path.parent))
+    assert [os.path.basename(path) for path in bsp_paths] == ["broken.bsp"] + [f"map{i}.bsp" for i in range(maps)]
+
+    batch = batch_import.bsp_batch_import(bsp_paths[1:] if maps == 1 else bsp_paths,
+                                          custom_types.bsp_import_options(search_from_parent=True, use_paks=False), max_workers=2)
+    batch.start()
+    deadline = time.monotonic() + 60
+    while not batch.step(0.05):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    batch.close()
+    assert sorted(batch.imported) == [f"map{i}" for i in range(maps)]
+    assert [name for name, error in batch.failed] == ([] if maps == 1 else ["broken"])
+    assert batch.progress == 1.0
+    for i in range(maps):
+        assert len(blender.data.objects[f"map{i}"].data.polygons) == 4
@@ -0,0 +1,48 @@
+import numpy as np
+
+from conftest import load_addon_module
+
+
+memory_usage = load_addon_module("memory_usage")
+
+
+def test_stage_memory_log_measures_growth_without_resetting_the_peak(capsys):
+    peak_before = memory_usage.get_peak_rss()
+    log = memory_usage.stage_memory_log()
+    log.begin("Allocating")
+    block = np.ones(64 * 1024 * 1024, dtype=np.uint8)
+    log.begin("Idle")
+    del block
+    log.report("test")
+
+    (allocating, growth, exact, peak, _), (idle, _, _, idle_peak, _) = log.stages
+    assert (allocating, idle) == ("Allocating", "Idle")
+    if peak_before is not None:
+        # Nothing resets the process' peak (give or take the kernel's lazily synced counters)
+        assert peak >= peak_before and idle_peak >= peak - 1024 * 1024
+    if memory_usage.get_current_rss() is not None:
+        assert exact and growth >= 60 * 1024 * 1024
+    assert "test: peak memory per stage" in capsys.readouterr().out
+
+
+def get_import(bpy):
+    mesh = bpy.data.objects["test"].data
+    coords = np.zeros(len(mesh.vertices) * 3)
+    mesh.vertices.foreach_get("co", coords)
+    uvs = {}
+    for layer in mesh.uv_layers:
+        uvs[layer.name] = np.zeros(len(mesh.loops) * 2)
+        layer.data.foreach_get("uv", uvs[layer.name])
+    return coords, uvs, np.array(bpy.data.images["test_atlas"].pixels[:]), sorted(image.name for image in bpy.data.images)
+
+
+def test_low_memory_imports_the_same(blender, map_path):
+    from conftest import import_map
+
+    import_map(map_path, apply_lightmaps=True, optimize_mesh=True, weld_distance=0.1)
+    coords, uvs, atlas, images = get_import(blender)
+    blender.ops.wm.read_factory_settings()
+    import_map(map_path, apply_lightmaps=True, optimize_mesh=True, weld_distance=0.1, low_memory=True)
+    low_coords, low_uvs, low_atlas, low_images = get_import(blender)
+    assert np.array_equal(low_coords, coords) and np.array_equal(low_atlas, atlas) and low_images == images
+    assert low_uvs.keys() == uvs.keys() and all(np.array_equal(low_uvs[name], uvs[name]) for name in uvs)
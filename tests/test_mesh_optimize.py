@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+from conftest import import_map, load_addon_module
+from synthetic_bsp import LIGHTMAP_SIZE, write_map
+
+
+mesh_optimize = load_addon_module("mesh_optimize")
+
+
+def grid_polygons(columns, rows, cells=None):
+    """
+    A flat grid of unit quads (z = 0) as mesh arrays, only the given (column, row) cells if any.
+    """
+    coords = np.array([(x, y, 0) for y in range(rows + 1) for x in range(columns + 1)], dtype=np.float64)
+    cells = cells if cells is not None else [(x, y) for y in range(rows) for x in range(columns)]
+    loops = []
+    for x, y in cells:
+        corner = y * (columns + 1) + x
+        loops.extend((corner, corner + 1, corner + columns + 2, corner + columns + 1))
+    loop_totals = np.full(len(cells), 4, dtype=np.int64)
+    return coords, np.array(loops, dtype=np.int64), np.cumsum(loop_totals) - loop_totals, loop_totals
+
+
+def merge(coords, loop_vertices, loop_starts, loop_totals, groups=None, mergeable=None):
+    count = len(loop_totals)
+    groups = np.zeros(count, dtype=np.int64) if groups is None else np.asarray(groups)
+    mergeable = np.ones(count, dtype=bool) if mergeable is None else np.asarray(mergeable)
+    normals = np.tile([0.0, 0.0, 1.0], (count, 1))
+    return mesh_optimize.merge_coplanar_polygons(coords, loop_vertices, loop_starts, loop_totals, groups, normals, mergeable)
+
+
+def polygon_areas(coords, loop_vertices, loop_starts, loop_totals):
+    areas = []
+    for start, total in zip(loop_starts, loop_totals):
+        x, y = coords[loop_vertices[start : start + total], :2].T
+        areas.append(0.5 * (np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))))
+    return np.array(areas)
+
+
+def test_weld_vertices_joins_close_vertices_and_drops_collapsed_polygons():
+    coords = np.array([(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0), (1.0004, 0, 0), (1.0004, 1, 0), (2, 0, 0), (2, 1, 0),
+                       (5, 5, 0), (5.0002, 5, 0), (5, 5.0002, 0)], dtype=np.float64)
+    loop_vertices = np.array([0, 1, 2, 3, 4, 6, 7, 5, 8, 9, 10], dtype=np.int64)
+    loop_totals = np.array([4, 4, 3], dtype=np.int64)
+    loop_starts = np.cumsum(loop_totals) - loop_totals
+
+    coords, loop_vertices, loop_starts, loop_totals, kept = mesh_optimize.weld_vertices(coords, loop_vertices, loop_starts, loop_totals, 0.01)
+    assert kept.tolist() == [0, 1]
+    assert loop_totals.tolist() == [4, 4]
+    # The two quads now share their middle edge
+    assert set(loop_vertices[:4].tolist()) & set(loop_vertices[4:].tolist()) == {loop_vertices[1], loop_vertices[2]}
+
+
+def test_get_components():
+    labels = mesh_optimize.get_components(6, np.array([4, 1, 2]), np.array([5, 2, 0]))
+    assert labels.tolist() == [0, 0, 0, 3, 4, 4]
+
+
+def test_fan_triangulate():
+    # A quad, a pentagon and a triangle
+    loop_totals = np.array([4, 5, 3], dtype=np.int64)
+    tri_loops, tri_polys = mesh_optimize.fan_triangulate(np.cumsum(loop_totals) - loop_totals, loop_totals)
+    assert tri_loops.tolist() == [[0, 1, 2], [0, 2, 3], [4, 5, 6], [4, 6, 7], [4, 7, 8], [9, 10, 11]]
+    assert tri_polys.tolist() == [0, 0, 1, 1, 1, 2]
+
+
+@pytest.mark.parametrize("columns, rows, cells, expected", [
+    (2, 2, None, 1),                                # Square of 4: one quad
+    (4, 1, None, 1),                                # Strip
+    (2, 2, [(0, 0), (1, 0), (0, 1)], 2),            # L: can't be one convex polygon
+    (3, 3, [(1, 0), (0, 1), (1, 1), (2, 1), (1, 2)], 3),     # Plus
+    (3, 3, [(x, y) for x in range(3) for y in range(3) if (x, y) != (1, 1)], 4),     # Ring around a hole
+])
+def test_merge_coplanar_polygons(columns, rows, cells, expected):
+    coords, loop_vertices, loop_starts, loop_totals = grid_polygons(columns, rows, cells)
+    area = polygon_areas(coords, loop_vertices, loop_starts, loop_totals).sum()
+
+    loop_vertices, loop_starts, loop_totals, kept = merge(coords, loop_vertices, loop_starts, loop_totals)
+    assert len(kept) == len(loop_totals) == expected
+    assert kept[0] == 0
+    areas = polygon_areas(coords, loop_vertices, loop_starts, loop_totals)
+    assert np.all(areas > 0) and areas.sum() == pytest.approx(area)
+
+    # Every merged polygon is convex: all its corners turn the same way
+    for start, total in zip(loop_starts, loop_totals):
+        corners = coords[loop_vertices[start : start + total], :2]
+        edges = np.roll(corners, -1, axis=0) - corners
+        turns = edges[:, 0] * np.roll(edges[:, 1], -1) - edges[:, 1] * np.roll(edges[:, 0], -1)
+        assert np.all(turns >= 0)
+
+
+def test_merge_coplanar_polygons_keeps_groups_and_unmergeable_polygons_apart():
+    mesh = grid_polygons(4, 1)
+    assert len(merge(*mesh, groups=[0, 0, 1, 1])[3]) == 2
+    assert len(merge(*mesh, mergeable=[True, True, False, True])[3]) == 3
+
+
+def uniform_lightmaps(*colors):
+    return [np.tile(np.array(color, dtype=np.uint8), LIGHTMAP_SIZE * LIGHTMAP_SIZE) for color in colors]
+
+
+@pytest.mark.parametrize("apply_lightmaps, lightmaps, expected", [
+    (False, None, 2),                                                           # Each room's floor and ceiling join up
+    (True, None, 4),                                                            # Different lightmaps: nothing merges
+    (True, uniform_lightmaps((90, 80, 70), (9, 9, 9), (90, 80, 70), (9, 9, 9)), 2),
+    (True, uniform_lightmaps((90, 80, 70), (9, 9, 9), (91, 80, 70), (9, 9, 9)), 3),    # Floors of different colors
+])
+def test_import_merges_lit_faces_with_the_same_uniform_lightmap(blender, tmp_path, apply_lightmaps, lightmaps, expected):
+    import_map(write_map(tmp_path, lightmaps=lightmaps), apply_lightmaps=apply_lightmaps, optimize_mesh=True, weld_distance=0.1)
+    assert len(blender.data.objects["test"].data.polygons) == expected
+
+
+def test_merged_faces_keep_their_own_lightmap_block(blender, tmp_path):
+    lightmaps = uniform_lightmaps((90, 80, 70), (9, 9, 9), (90, 80, 70), (9, 9, 9))
+    import_map(write_map(tmp_path, lightmaps=lightmaps), apply_lightmaps=True, optimize_mesh=True, weld_distance=0.1)
+
+    # 8x8 samples over 128 units, as the face was in the file, not the 256 unit polygon it's merged into
+    atlas = blender.data.images["test_atlas"]
+    assert tuple(atlas.size) == (64, 8)
+    pixels = np.round(np.array(atlas.pixels).reshape(8, 64, 4) * 255)
+    assert np.all(pixels[:, :8] == (90, 80, 70, 255)) and np.all(pixels[:, 8:16] == (9, 9, 9, 255))
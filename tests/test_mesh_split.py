@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from conftest import load_addon_module
+
+
+@pytest.fixture
+def mesh_split(blender):
+    return load_addon_module("mesh_split")
+
+
+def make_strip(bpy, name, count):
+    """
+    An object of count unit quads in a row along x, each with its own material, UVs and bsp_face_index.
+    """
+    coords = [(x, y, 0) for x in range(count + 1) for y in (0, 1)]
+    quads = [(2 * i, 2 * i + 2, 2 * i + 3, 2 * i + 1) for i in range(count)]
+    mesh = bpy.data.meshes.new(name)
+    mesh.from_pydata(coords, [], quads)
+    for i in range(count):
+        mesh.materials.append(bpy.data.materials.new(f"{name}_{i}"))
+    mesh.polygons.foreach_set("material_index", np.arange(count, dtype=np.int32))
+    uv_layer = mesh.uv_layers.new(name="UVMap")
+    uv_layer.data.foreach_set("uv", np.array(coords, dtype=np.float32)[np.ravel(quads), :2].ravel())
+    attribute = mesh.attributes.new(name="bsp_face_index", type='INT', domain='FACE')
+    attribute.data.foreach_set("value", np.arange(count, dtype=np.int32) * 10)
+
+    obj = bpy.data.objects.new(name, mesh)
+    bpy.context.scene.collection.objects.link(obj)
+    return obj
+
+
+def test_split_object(blender, mesh_split):
+    obj = make_strip(blender, "strip", 5)
+    mesh_name = obj.data.name
+    parts = mesh_split.split_object(obj, [1, 0, 1, 2, 0], {0: "even", 1: "odd"})
+    assert [part.name for part in parts] == ["even", "odd", "strip_2"]
+    assert "strip" not in blender.data.objects and mesh_name not in blender.data.meshes
+
+    for part, polys in zip(parts, ([1, 4], [0, 2], [3])):
+        mesh = part.data
+        assert part.name in blender.context.scene.collection.objects
+        # Only the vertices and materials its own polygons use
+        assert len(mesh.polygons) == len(polys) and len(mesh.vertices) == 4 * len(polys)
+        assert [material.name for material in mesh.materials] == [f"strip_{i}" for i in polys]
+        assert [polygon.material_index for polygon in mesh.polygons] == list(range(len(polys)))
+        assert [value.value for value in mesh.attributes["bsp_face_index"].data] == [10 * i for i in polys]
+        for polygon, poly in zip(mesh.polygons, polys):
+            corners = [tuple(mesh.vertices[vertex].co) for vertex in polygon.vertices]
+            assert corners == [(poly, 0, 0), (poly + 1, 0, 0), (poly + 1, 1, 0), (poly, 1, 0)]
+            assert [tuple(mesh.uv_layers["UVMap"].data[loop].uv) for loop in polygon.loop_indices] == [corner[:2] for corner in corners]
+
+
+def test_split_object_into_collections(blender, mesh_split):
+    obj = make_strip(blender, "grouped", 3)
+    collections = {group: blender.data.collections.new(f"group_{group}") for group in (0, 1)}
+    parts = mesh_split.split_object(obj, [0, 1, 0], {}, collections)
+    for part, group in zip(parts, (0, 1)):
+        assert list(part.users_collection) == [collections[group]]
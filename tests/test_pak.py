@@ -0,0 +1,99 @@
+import pytest
+
+from conftest import import_map, load_addon_module
+from synthetic_bsp import build_bsp, build_pak, build_wal, write_map
+
+
+pak = load_addon_module("pak")
+
+
+@pytest.fixture
+def paks(tmp_path):
+    """
+    pak0 with a map and a texture, pak1 overriding the texture, both opened as a collection.
+    """
+    (tmp_path / "pak0.pak").write_bytes(build_pak({"maps/test.bsp": build_bsp(), "textures/e1u1/floor.wal": b"old",
+                                                   "pics/colormap.pcx": b"pcx"}))
+    (tmp_path / "pak1.pak").write_bytes(build_pak({"TEXTURES\\E1U1\\FLOOR.wal": b"new"}))
+    collection = pak.pak_collection.from_folder(str(tmp_path))
+    yield collection
+    collection.close()
+
+
+def test_pak_file(tmp_path):
+    path = tmp_path / "pak0.pak"
+    path.write_bytes(build_pak({"maps/a.bsp": b"abc", "Textures\\X.wal": b"xyz"}))
+    pak_file = pak.pak_file(str(path))
+    try:
+        assert bytes(pak_file.read("maps/a.bsp")) == b"abc"
+        # Names are matched like the engine does on Windows: any case, either slash
+        assert bytes(pak_file.read("/textures/x.WAL")) == b"xyz"
+        assert pak_file.read("maps/b.bsp") is None
+    finally:
+        pak_file.close()
+
+
+def test_pak_file_rejects_other_files(tmp_path):
+    path = tmp_path / "pak0.pak"
+    path.write_bytes(b"NOPE" + bytes(8))
+    with pytest.raises(ValueError):
+        pak.pak_file(str(path))
+
+
+def test_get_pak_paths(tmp_path):
+    for name in ("pak10.pak", "pak2.pak", "zz.pak", "extra.PAK", "pak0.pak", "notes.txt"):
+        (tmp_path / name).write_bytes(b"")
+    (tmp_path / "folder.pak").mkdir()
+    paths = pak.get_pak_paths(str(tmp_path))
+    assert [path.rsplit("/", 1)[-1].rsplit("\\", 1)[-1] for path in paths] == ["pak0.pak", "pak2.pak", "pak10.pak", "extra.PAK", "zz.pak"]
+    assert pak.get_pak_paths(str(tmp_path / "missing")) == []
+
+
+def test_pak_collection_later_paks_override(paks):
+    assert len(paks.paks) == 2 and paks
+    assert bytes(paks.read("textures/e1u1/floor.wal")) == b"new"
+    assert paks.get_signature("textures/e1u1/floor.wal").startswith(paks.paks[1].signature)
+    assert paks.get_path("pics/colormap.pcx").endswith("colormap.pcx")
+    assert paks.read("textures/e1u1/ceil.wal") is None
+
+
+def test_pak_collection_find(paks):
+    assert paks.find_texture("e1u1/floor", (".png", ".wal")) == "textures/e1u1/floor.wal"
+    assert paks.find_texture("e1u1/ceil", (".png", ".wal")) is None
+    # By the name without its top folder
+    assert paks.find_texture("colormap", (".pcx",)) == "pics/colormap.pcx"
+    for name in ("test", "maps/test", "maps/test.bsp", "MAPS\\TEST.BSP"):
+        assert paks.find_map(name) == "maps/test.bsp"
+    assert paks.find_map("base1") is None
+
+
+def test_import_map_from_pak(blender, tmp_path):
+    """
+    A map and its textures straight out of the PAKs, nothing extracted.
+    """
+    (tmp_path / "pak0.pak").write_bytes(build_pak({"maps/test.bsp": build_bsp(), "textures/e1u1/floor.wal": build_wal("e1u1/floor", 64, 32)}))
+    import_map(tmp_path / "pak0.pak", pak_map="maps/test", search_from_parent=False)
+
+    assert len(blender.data.objects["test"].data.polygons) == 4
+    image = blender.data.images["e1u1/floor"]
+    assert tuple(image.size) == (64, 32) and image.packed_file
+    assert image["bsp_source"].startswith(str(tmp_path / "pak0.pak"))
+
+
+def test_import_textures_from_pak(blender, tmp_path):
+    map_path = write_map(tmp_path)
+    texture_folder = tmp_path / "textures" / "e1u1"
+    (tmp_path / "pak0.pak").write_bytes(build_pak({"textures/e1u1/ceil.png": (texture_folder / "ceil.png").read_bytes()}))
+    (texture_folder / "ceil.png").unlink()
+
+    import_map(map_path)
+    image = blender.data.images["e1u1/ceil"]
+    assert tuple(image.size) == (48, 24) and image.packed_file
+    # Loose files still come first
+    assert not blender.data.images["e1u1/floor"]["bsp_source"].startswith(str(tmp_path / "pak0.pak"))
+
+    for obj in list(blender.data.objects):
+        blender.data.objects.remove(obj)
+    blender.data.images.remove(image)
+    import_map(map_path, use_paks=False)
+    assert "e1u1/ceil" not in blender.data.images
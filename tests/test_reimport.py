@@ -0,0 +1,117 @@
+"""
+Updating an earlier import of the synthetic map after it changed, checking which datablocks are kept.
+"""
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from conftest import import_map, load_addon_module
+from synthetic_bsp import LIGHTMAP_SIZE, write_map
+
+
+custom_types = load_addon_module("custom_types")
+
+
+def get_datablocks(bpy):
+    return {"object": bpy.data.objects["test"], "mesh": bpy.data.objects["test"].data,
+            "material": bpy.data.materials["M_e1u1/ceil"], "image": bpy.data.images["e1u1/ceil"]}
+
+
+def move_first_vertex(bpy):
+    """
+    Edits the imported mesh, so whether a re-import rewrote it shows.
+    """
+    bpy.data.objects["test"].data.vertices[0].co.z += 1000
+
+
+def mesh_was_rewritten(bpy):
+    return max(vertex.co.z for vertex in bpy.data.objects["test"].data.vertices) < 1000
+
+
+def test_reimport_without_changes_keeps_everything(blender, map_path):
+    import_map(map_path)
+    before = get_datablocks(blender)
+    move_first_vertex(blender)
+
+    import_map(map_path, reimport=True)
+    assert get_datablocks(blender) == before
+    assert len(blender.data.objects) == 1 and not mesh_was_rewritten(blender)
+
+
+def test_reimport_rewrites_the_mesh_in_place_when_the_geometry_changes(blender, tmp_path):
+    import_map(write_map(tmp_path))
+    before = get_datablocks(blender)
+    move_first_vertex(blender)
+
+    # Texinfo flags are part of the geometry: the nodraw ceilings are left out now
+    write_map(tmp_path, texture_flags=(0, custom_types.SURF_NODRAW))
+    import_map(tmp_path / "maps" / "test.bsp", reimport=True)
+    assert get_datablocks(blender) == before
+    assert mesh_was_rewritten(blender)
+    assert len(blender.data.objects["test"].data.polygons) == 2
+
+
+def test_reimport_without_update_makes_new_datablocks(blender, map_path):
+    import_map(map_path)
+    before = get_datablocks(blender)
+    import_map(map_path)
+    assert blender.data.objects["test.001"].data != before["mesh"]
+    # Materials are replaced, images are reused by name
+    assert blender.data.materials["M_e1u1/ceil"] != before["material"] and blender.data.images["e1u1/ceil"] == before["image"]
+
+
+def test_reimport_refreshes_changed_images_in_place(blender, map_path):
+    import_map(map_path)
+    image = blender.data.images["e1u1/ceil"]
+    signature = image["bsp_source"]
+
+    texture_path = map_path.parent.parent / "textures" / "e1u1" / "ceil.png"
+    Image.new("RGB", (16, 8), (255, 0, 0)).save(texture_path)
+    os.utime(texture_path, ns=(0, 0))
+    import_map(map_path, reimport=True)
+    assert blender.data.images["e1u1/ceil"] == image
+    assert image["bsp_source"] != signature and tuple(image.size) == (16, 8)
+
+
+def test_reimport_rebuilds_the_lightmap_atlas_only_when_the_lighting_changes(blender, tmp_path):
+    map_path = write_map(tmp_path)
+    import_map(map_path, apply_lightmaps=True)
+    atlas = blender.data.images["test_atlas"]
+    pixels = np.array(atlas.pixels)
+    move_first_vertex(blender)
+
+    # New lightmaps leave the geometry alone, the atlas is rewritten in the same image
+    lightmaps = [np.full(LIGHTMAP_SIZE * LIGHTMAP_SIZE * 3, 200, dtype=np.uint8)] * 4
+    write_map(tmp_path, lightmaps=lightmaps)
+    import_map(map_path, apply_lightmaps=True, reimport=True)
+    assert blender.data.images["test_atlas"] == atlas and "test_atlas.001" not in blender.data.images
+    assert not mesh_was_rewritten(blender)
+    assert not np.array_equal(np.array(atlas.pixels), pixels)
+
+
+def test_reimport_swaps_the_lightmap_for_another_lightmap_mode(blender, map_path):
+    def lightmap_source(material):
+        return material.node_tree.nodes["BSP_Surface"].inputs['Lightmap'].links[0].from_node.name
+
+    import_map(map_path, apply_lightmaps=True)
+    material = blender.data.materials["M_e1u1/ceil"]
+    assert lightmap_source(material) == "LM_Atlas_Tex"
+
+    import_map(map_path, apply_lightmaps=True, lightmap_mode='VERTEX', reimport=True)
+    assert blender.data.materials["M_e1u1/ceil"] == material
+    assert lightmap_source(material) == "LM_Color_Attribute"
+    assert "LM_Atlas_Tex" not in material.node_tree.nodes and "LM_UVMap" not in material.node_tree.nodes
+    assert "Lightmap" in blender.data.objects["test"].data.attributes
+
+    import_map(map_path, apply_lightmaps=True, reimport=True)
+    assert lightmap_source(material) == "LM_Atlas_Tex"
+    assert "LM_Color_Attribute" not in material.node_tree.nodes
+
+
+@pytest.mark.parametrize("options", [dict(area_import='SPLIT'), dict(separate_special_faces=True)])
+def test_reimport_of_split_imports_imports_as_new(blender, map_path, options):
+    import_map(map_path)
+    import_map(map_path, reimport=True, **options)
+    assert "test" in blender.data.objects and len(blender.data.objects) > 1
@@ -0,0 +1,88 @@
+import shutil
+import sys
+from unittest.mock import MagicMock
+
+import pytest
+
+from conftest import import_map, load_addon_module
+
+
+@pytest.fixture
+def library(monkeypatch, tmp_path):
+    bpy = MagicMock(name="bpy")
+    bpy.data.images = []
+    bpy.data.materials = []
+    monkeypatch.setitem(sys.modules, "bpy", bpy)
+    texture_library = load_addon_module("texture_library")
+    monkeypatch.setattr(texture_library, "bpy", bpy)
+    return texture_library.texture_library(str(tmp_path))
+
+
+def test_find_material_by_texture_and_image(library):
+    image = {"bsp_content_hash": "abc"}
+    mat = {}
+    library.add_material(mat, "e1u1/floor", image)
+    assert library.find_material("E1U1/Floor", {"bsp_content_hash": "abc"}) is mat
+    assert library.find_material("e1u1/floor", {"bsp_content_hash": "def"}) is None
+    assert library.find_material("e1u1/floor", image, "other_map") is None
+
+
+def test_find_material_without_image(library):
+    # A texture that wasn't found gets one placeholder material, not a new one every import
+    mat = {}
+    library.add_material(mat, "e1u1/missing", None)
+    assert library.find_material("e1u1/missing", None) is mat
+    assert library.find_material("e1u1/floor", None) is None
+    assert library.find_material("e1u1/missing", {"bsp_content_hash": "abc"}) is None
+
+
+def import_maps(map_path, *names, **options):
+    """
+    Imports the map under each of the given names, from the same game folder.
+    """
+    for name in names:
+        path = map_path.with_name(f"{name}.bsp")
+        shutil.copy(map_path, path)
+        import_map(path, shared_library=True, **options)
+
+
+def get_material_names(obj):
+    return sorted(mat.name for mat in obj.data.materials)
+
+
+def get_library_names(datablocks):
+    return sorted(datablock.name for datablock in datablocks if "bsp_library_root" in datablock)
+
+
+def test_shared_library_reuses_images_and_materials(blender, map_path):
+    import_maps(map_path, "a", "b")
+    assert get_material_names(blender.data.objects["a"]) == get_material_names(blender.data.objects["b"]) == ["M_e1u1/ceil", "M_e1u1/floor"]
+    assert get_library_names(blender.data.images) == ["e1u1/ceil", "e1u1/floor"]
+    assert get_library_names(blender.data.materials) == ["M_e1u1/ceil", "M_e1u1/floor"]
+    assert list(blender.data.images["e1u1/floor"]["bsp_used_by"]) == ["a", "b"]
+
+
+def test_shared_library_keeps_lightmapped_materials_per_map(blender, map_path):
+    import_maps(map_path, "a", "b", apply_lightmaps=True)
+    assert get_material_names(blender.data.objects["b"]) == ["M_e1u1/ceil_b", "M_e1u1/floor_b"]
+    assert get_library_names(blender.data.images) == ["e1u1/ceil", "e1u1/floor"]
+    assert "a_atlas" in blender.data.images and "b_atlas" in blender.data.images
+
+
+def test_shared_library_reuses_materials_of_missing_textures(blender, map_path):
+    (map_path.parent.parent / "textures" / "e1u1" / "ceil.png").unlink()
+    import_maps(map_path, "a", "b")
+    assert get_material_names(blender.data.objects["b"]) == ["M_e1u1/ceil", "M_e1u1/floor"]
+    assert get_library_names(blender.data.materials) == ["M_e1u1/ceil", "M_e1u1/floor"]
+
+
+def test_cleanup_library(blender, map_path):
+    import_maps(map_path, "a", "b")
+    cleanup_library = load_addon_module("texture_library").cleanup_library
+    blender.data.objects.remove(blender.data.objects["a"])
+    assert cleanup_library() == (0, 0)
+    assert list(blender.data.materials["M_e1u1/floor"]["bsp_used_by"]) == ["b"]
+
+    blender.data.meshes.remove(blender.data.objects["b"].data)
+    assert cleanup_library() == (2, 2)
+    assert not get_library_names(blender.data.materials) and not get_library_names(blender.data.images)
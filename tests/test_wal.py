@@ -0,0 +1,131 @@
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from conftest import ADDON_DIR, import_map, load_addon_module
+from synthetic_bsp import build_wal
+
+
+wal = load_addon_module("wal")
+PALETTE = np.fromfile(f"{ADDON_DIR}/quake2.lmp", dtype=np.uint8)[:768].reshape(256, 3)
+
+
+def wal_indices(data, mip_level):
+    width, height = struct.unpack_from("<II", data, 32)
+    offset = np.frombuffer(data, dtype="<u4", count=4, offset=40)[mip_level]
+    return np.frombuffer(data, dtype=np.uint8, count=(width >> mip_level) * (height >> mip_level),
+                         offset=offset).reshape(height >> mip_level, width >> mip_level)
+
+
+@pytest.mark.parametrize("mip_level", [0, 1, 2, 3])
+def test_wal_image_mip_levels(mip_level):
+    data = build_wal("e1u1/floor", 64, 32)
+    image = wal.wal_image(data, mip_level)
+    assert image.texture_name == "e1u1/floor"
+    # The full size stays, UVs go by it
+    assert (image.width, image.height) == (64, 32)
+    assert (image.mip_width, image.mip_height) == (64 >> mip_level, 32 >> mip_level)
+    assert image.image.size == (64 >> mip_level, 32 >> mip_level)
+    assert np.array_equal(np.asarray(image.image), PALETTE[wal_indices(data, mip_level)])
+
+
+def test_wal_image_from_file_and_memoryview(tmp_path):
+    data = build_wal("e1u1/floor", 16, 16)
+    path = tmp_path / "floor.wal"
+    path.write_bytes(data)
+    from_file = np.asarray(wal.wal_image(str(path)).image)
+    assert np.array_equal(from_file, np.asarray(wal.wal_image(memoryview(data)).image))
+    assert np.array_equal(from_file, PALETTE[wal_indices(data, 0)])
+
+
+def get_uvs(obj):
+    uvs = np.zeros(len(obj.data.loops) * 2)
+    obj.data.uv_layers["UVMap"].data.foreach_get("uv", uvs)
+    return uvs
+
+
+def test_proxy_textures_keep_the_full_size_uvs(blender, map_path):
+    import_map(map_path)
+    full_uvs = get_uvs(blender.data.objects["test"])
+    blender.ops.wm.read_factory_settings()
+
+    import_map(map_path, texture_mip=2)
+    image = blender.data.images["e1u1/floor"]
+    assert tuple(image.size) == (16, 8) and image["bsp_mip_level"] == 2
+    assert tuple(image["bsp_texture_size"]) == (64, 32)
+    assert np.array_equal(get_uvs(blender.data.objects["test"]), full_uvs)
+
+
+def test_upgrade_proxy_textures(blender, map_path):
+    import_map(map_path, texture_mip=3)
+    image = blender.data.images["e1u1/floor"]
+    assert load_addon_module("idtech2_bsp").upgrade_proxy_textures() == 1
+    assert blender.data.images["e1u1/floor"] == image
+    assert tuple(image.size) == (64, 32) and image["bsp_mip_level"] == 0
+    # Nothing left to upgrade, and full resolution imports reuse the image
+    assert load_addon_module("idtech2_bsp").upgrade_proxy_textures() == 0
+    import_map(map_path)
+    assert "e1u1/floor.001" not in blender.data.images
+
+
+def test_read_wal_size():
+    data = build_wal("e1u1/floor", 64, 32)
+    # Only the header is needed
+    assert tuple(wal.read_wal_size(data[:wal.WAL_HEADER_SIZE])) == (64, 32)
+
+
+def test_read_texture_size_from_headers(map_path):
+    bsp_preprocess = load_addon_module("bsp_preprocess")
+    textures = map_path.parent.parent / "textures" / "e1u1"
+    assert bsp_preprocess.read_texture_size(str(textures / "floor.wal")) == (64, 32)
+    assert bsp_preprocess.read_texture_size(str(textures / "ceil.png")) == (48, 24)
+    # A truncated WAL still has its size, PAK members come in as bytes
+    data = (textures / "floor.wal").read_bytes()[:wal.WAL_HEADER_SIZE]
+    assert bsp_preprocess.read_texture_size("pak0.pak/textures/e1u1/floor.wal", data) == (64, 32)
+
+
+def test_geometry_only_keeps_the_full_import_uvs(blender, map_path):
+    import_map(map_path)
+    full_uvs = get_uvs(blender.data.objects["test"])
+    blender.ops.wm.read_factory_settings()
+
+    # Only the headers are left of the textures: the sizes must come from those alone
+    textures = map_path.parent.parent / "textures" / "e1u1"
+    floor = textures / "floor.wal"
+    floor.write_bytes(floor.read_bytes()[:wal.WAL_HEADER_SIZE])
+    import_map(map_path, geometry_only=True, apply_lightmaps=True)
+    assert np.array_equal(get_uvs(blender.data.objects["test"]), full_uvs)
+    assert not any(image.name.startswith("e1u1/") for image in blender.data.images)
+    assert "test_atlas" not in blender.data.images
+    material = blender.data.materials["M_e1u1/floor"]
+    assert material["bsp_texture_path"] == str(floor) and material["bsp_texture_member"] == ""
+    assert blender.data.materials["M_e1u1/ceil"]["bsp_texture_path"] == str(textures / "ceil.png")
+
+
+def test_cached_wal_files(blender, map_path, tmp_path):
+    from PIL import Image
+    cache_dir = tmp_path / "cache"
+    import_map(map_path, cache_textures=True, texture_cache_dir=str(cache_dir), texture_mip=1)
+
+    image = blender.data.images["e1u1/floor"]
+    assert not image.packed_file and image.filepath.endswith(".mip1.png") and "e1u1_floor" in image.filepath
+    assert tuple(image["bsp_texture_size"]) == (64, 32)
+    data = (map_path.parent.parent / "textures" / "e1u1" / "floor.wal").read_bytes()
+    with Image.open(image.filepath) as cached:
+        # Bottom row first, like the pixels packed into Blender images
+        assert np.array_equal(np.asarray(cached.convert("RGB")), PALETTE[wal_indices(data, 1)][::-1])
+
+    # Written once, then found by the next import
+    mtime = os.stat(image.filepath).st_mtime_ns
+    blender.ops.wm.read_factory_settings()
+    import_map(map_path, cache_textures=True, texture_cache_dir=str(cache_dir), texture_mip=1)
+    assert os.stat(blender.data.images["e1u1/floor"].filepath).st_mtime_ns == mtime
+    assert len(os.listdir(cache_dir)) == 1
+
+    # Upgrading rewrites it at full resolution, in a file of its own
+    load_addon_module("idtech2_bsp").upgrade_proxy_textures()
+    image = blender.data.images["e1u1/floor"]
+    assert image.filepath.endswith(".mip0.png") and tuple(image.size) == (64, 32)
+    assert len(os.listdir(cache_dir)) == 2